@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime
+from shutil import rmtree
+
+import numpy as np
+import PIL.Image
+import tifffile
+
+import prepareDZImages
+from dziTiler import iterTiffRowBands
+from imageScan import ScanCache, SCAN_CACHE_FILENAME
+from sliceStack import readStackLayout
+from tileArchive import TileArchive, getArchivePath
+
+LAYER_NAMES = ('Nissl', 'T2', 'Tracer', 'Myelin')
+
+
+def makeSliceImage(width, height, index, layer, rng):
+    '''
+    Synthetic brain-section-like slice : textured ellipse on an empty background.
+    '''
+    (y, x) = np.ogrid[0:height, 0:width]
+    # section outline varies along slices, so that tiles content differ
+    radiusX = width * (0.30 + 0.1 * np.sin(index / 7.0))
+    radiusY = height * (0.35 + 0.05 * np.cos(index / 5.0))
+    inside = ((x - width / 2) / radiusX) ** 2 + ((y - height / 2) / radiusY) ** 2 <= 1.0
+    texture = (128 + 60 * np.sin(x / (9.0 + layer)) * np.cos(y / 13.0)).astype(np.uint8)
+    noise = rng.integers(0, 32, size=(height, width), dtype=np.uint8)
+    return np.where(inside, texture + noise, 0).astype(np.uint8)
+
+
+def makeOverlayImage(width, height, index):
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}">'
+            f'<path id="R{index % 5}" d="M {width * 0.3:.3f} {height * 0.3:.3f} L {width * 0.7:.3f} {height * 0.3:.3f} '
+            f'L {width * 0.7:.3f} {height * 0.7:.3f} L {width * 0.3:.3f} {height * 0.7:.3f} Z"/></svg>')
+
+
+def generateDataset(input_path, axes, layers, slices, width, height, compression=None, seed=0):
+    '''
+    Generate a synthetic input tree in the layout expected by getLayersNFiles :
+    <axis>/layerNN_<name>/slice_NNN.tif and <axis>/overlay00_Regions/slice_NNN.svg
+    '''
+    rng = np.random.default_rng(seed)
+    for axis in prepareDZImages.AXIS[:axes]:
+        for layer in range(layers):
+            layerName = LAYER_NAMES[layer] if layer < len(LAYER_NAMES) else f"Layer{layer}"
+            layerPath = os.path.join(input_path, axis, f"layer{layer:02d}_{layerName}")
+            os.makedirs(layerPath, exist_ok=True)
+            for index in range(slices):
+                # a few extra pixels on some slices, so they need to be cropped
+                extra = rng.integers(0, 8) if index % 3 == 0 else 0
+                image = makeSliceImage(width + extra, height + extra, index, layer, rng)
+                tifffile.imwrite(os.path.join(layerPath, f"slice_{index:03d}.tif"), image,
+                                 compression=compression, rowsperstrip=64)
+
+        overlayPath = os.path.join(input_path, axis, 'overlay00_Regions')
+        os.makedirs(overlayPath, exist_ok=True)
+        for index in range(slices):
+            with open(os.path.join(overlayPath, f"slice_{index:03d}.svg"), 'w') as svgFile:
+                svgFile.write(makeOverlayImage(width, height, index))
+
+
+def makePaletteImage(path, width, height, rng):
+    '''
+    Synthetic palette (indexed color) TIFF slice, the texture being mapped to a color ramp through the colormap.
+    '''
+    colormap = np.zeros((3, 256), np.uint16)
+    colormap[0] = np.arange(256) * 257
+    colormap[1] = (255 - np.arange(256)) * 257
+    colormap[2] = (np.arange(256) * 7 % 256) * 257
+    image = makeSliceImage(width, height, 0, 0, rng)
+    tifffile.imwrite(path, image, photometric='palette', colormap=colormap, rowsperstrip=64)
+
+
+def readTiles(output_path, name):
+    tilesPath = os.path.join(output_path, name + '_files')
+    tiles = {}
+    for root, _, filenames in os.walk(tilesPath):
+        for filename in filenames:
+            with PIL.Image.open(os.path.join(root, filename)) as tile:
+                tiles[os.path.relpath(os.path.join(root, filename), tilesPath)] = np.asarray(tile.convert('RGB'))
+    return tiles
+
+
+def checkPaletteTiling(work_path, format, quality):
+    '''
+    Check that a palette TIFF slice is tiled the same way whether it is decoded by PIL (as a whole), by bands of rows
+    (streaming), or read from the slice stack (raw palette indexes and colormap), i.e. that its colormap is applied when
+    it is not kept as a label map.
+    '''
+    check_path = os.path.join(work_path, 'check_palette')
+    rmtree(check_path, ignore_errors=True)
+    os.makedirs(check_path)
+    source = os.path.join(check_path, 'palette.tif')
+    makePaletteImage(source, 700, 500, np.random.default_rng(0))
+    stacked = (tifffile.imread(source), readStackLayout(source)[2])
+    for (name, streaming, stack) in (('decoded', False, None), ('streaming', True, None), ('stacked', False, stacked)):
+        prepareDZImages.createDeepZoomImage(source, os.path.join(check_path, name + '.dzi'), format, quality,
+                                            streaming=streaming, stacked=stack)
+    decoded = readTiles(check_path, 'decoded')
+    for name in ('streaming', 'stacked'):
+        tiles = readTiles(check_path, name)
+        mismatches = sorted(tile for tile in decoded if tile not in tiles or not np.array_equal(decoded[tile], tiles[tile]))
+        if mismatches or len(decoded) != len(tiles):
+            raise Exception(f"Palette slice tiled differently when {name} ({format}), e.g. tile {(mismatches or ['count'])[0]}")
+
+
+def getFolderStats(path):
+    files = 0
+    size = 0
+    for root, _, filenames in os.walk(path):
+        for filename in filenames:
+            files += 1
+            size += os.path.getsize(os.path.join(root, filename))
+    return (files, size)
+
+
+def getSliceList(input_path):
+    '''
+    Slices of every layer and axis, with the crop box computed as in prepareImages.
+    '''
+    axisLayersFiles = prepareDZImages.getLayersNFiles(input_path, {}, 1)
+    slices = []
+    for axis in axisLayersFiles['axis'].values():
+        for layerName, layer in axis['layers'].items():
+            cropWidth = min(int(image['width'] - image['origin'][0]) for image in layer['images'])
+            cropHeight = min(int(image['height'] - image['origin'][1]) for image in layer['images'])
+            for image in layer['images']:
+                needsCropping = image['width'] > cropWidth or image['height'] > cropHeight
+                slices.append({
+                    'source': os.path.join(layer['path'], image['shortname'] + image['ext']),
+                    'crop': (int(image['origin'][0]), int(image['origin'][1]), cropWidth, cropHeight) if needsCropping else None,
+                })
+    return slices
+
+
+# -----------------------------------------------------------------------------
+# stages, each run in a fresh process so that peak memory is measured separately
+
+def benchScan(input_path, output_path, cached):
+    cachePath = os.path.join(output_path, SCAN_CACHE_FILENAME)
+    if not cached and os.path.exists(cachePath):
+        os.remove(cachePath)
+    scanCache = ScanCache(cachePath)
+    start = time.perf_counter()
+    axisLayersFiles = prepareDZImages.getLayersNFiles(input_path, {}, 1, scanCache)
+    elapsed = time.perf_counter() - start
+    items = sum(len(layer['images']) for axis in axisLayersFiles['axis'].values() for layer in axis['layers'].values())
+    return {'wall_time': elapsed, 'items': items}
+
+
+def benchCrop(slices, streaming):
+    bytesRead = 0
+    start = time.perf_counter()
+    for slice in slices:
+        bytesRead += os.path.getsize(slice['source'])
+        crop = slice['crop']
+        if streaming:
+            for band in iterTiffRowBands(slice['source'], 256, crop):
+                pass
+        else:
+            with PIL.Image.open(slice['source']) as image:
+                array = np.asarray(image)
+                if crop:
+                    array = np.array(array[crop[1]:crop[1] + crop[3], crop[0]:crop[0] + crop[2]])
+    elapsed = time.perf_counter() - start
+    return {'wall_time': elapsed, 'items': len(slices), 'bytes_read': bytesRead}
+
+
+def benchDeepZoom(slices, output_path, format, quality, streaming, container):
+    bytesRead = 0
+    start = time.perf_counter()
+    for index, slice in enumerate(slices):
+        bytesRead += os.path.getsize(slice['source'])
+        prepareDZImages.createDeepZoomImage(slice['source'], os.path.join(output_path, f"{index}.dzi"),
+                                            format, quality, slice['crop'], streaming, container=container)
+    elapsed = time.perf_counter() - start
+    (files, bytesWritten) = getFolderStats(output_path)
+    if container == 'archive':
+        tiles = 0
+        for index in range(len(slices)):
+            archive = TileArchive(getArchivePath(os.path.join(output_path, f"{index}.dzi")))
+            tiles += len(archive.index['tiles'])
+            archive.close()
+    else:
+        # every file but the descriptors are tiles
+        tiles = files - len(slices)
+    return {'wall_time': elapsed, 'items': len(slices), 'tiles': tiles, 'bytes_read': bytesRead,
+            'bytes_written': bytesWritten, 'files_written': files}
+
+
+def benchChangeSize(slices, output_path):
+    bytesRead = 0
+    start = time.perf_counter()
+    for index, slice in enumerate(slices):
+        bytesRead += os.path.getsize(slice['source'])
+        prepareDZImages.changeSize(slice['source'], os.path.join(output_path, f"{index}.jpg"), desired_size=[200, 200])
+    elapsed = time.perf_counter() - start
+    (files, bytesWritten) = getFolderStats(output_path)
+    return {'wall_time': elapsed, 'items': len(slices), 'bytes_read': bytesRead, 'bytes_written': bytesWritten}
+
+
+def runStage(function, *args):
+    # progress bars and messages of the benchmarked functions are discarded
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+    result = function(*args)
+    # peak resident set size of the process, in bytes (ru_maxrss is expressed in kilobytes on Linux)
+    result['peak_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return result
+
+
+def measure(function, *args):
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        result = executor.submit(runStage, function, *args).result()
+    if result.get('items') and result['wall_time'] > 0:
+        result['items_per_second'] = result['items'] / result['wall_time']
+    if result.get('tiles') and result['wall_time'] > 0:
+        result['tiles_per_second'] = result['tiles'] / result['wall_time']
+    return result
+
+
+# -----------------------------------------------------------------------------
+
+def runBenchmark(args, work_path):
+    input_path = os.path.join(work_path, 'input')
+    output_path = os.path.join(work_path, 'output')
+
+    print(f"Generating synthetic dataset in {input_path} ...")
+    generateDataset(input_path, args.axes, args.layers, args.slices, args.width, args.height, args.compression)
+    os.makedirs(output_path, exist_ok=True)
+
+    slices = getSliceList(input_path)
+    # subview images are only generated from the reference layer slices
+    referenceSlices = [slice for slice in slices if f"{os.sep}layer00_" in slice['source']]
+
+    stages = {}
+
+    def run(name, function, *stageArgs):
+        print(f"\t{name} ...")
+        results = [measure(function, *stageArgs) for _ in range(args.repeat)]
+        # best run is kept, as it is the least disturbed by other activities on the machine
+        stages[name] = min(results, key=lambda result: result['wall_time'])
+
+    def freshFolder(name):
+        path = os.path.join(output_path, name)
+        rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        return path
+
+    print("Running benchmarks ...")
+    run('getLayersNFiles', benchScan, input_path, output_path, False)
+    run('getLayersNFiles_cached', benchScan, input_path, output_path, True)
+    croppedSlices = [slice for slice in slices if slice['crop']]
+    run('crop', benchCrop, croppedSlices, False)
+    run('crop_streaming', benchCrop, croppedSlices, True)
+    run('createDeepZoomImage', benchDeepZoom, slices, freshFolder('dzi'), args.tileformat, args.tilequality, False, 'files')
+    run('createDeepZoomImage_streaming', benchDeepZoom, slices, freshFolder('dzi_streaming'), args.tileformat, args.tilequality, True, 'files')
+    run('createDeepZoomImage_archive', benchDeepZoom, slices, freshFolder('dzi_archive'), args.tileformat, args.tilequality, False, 'archive')
+    run('changeSize', benchChangeSize, referenceSlices, freshFolder('subview'))
+
+    print("Checking tiling consistency ...")
+    checkPaletteTiling(work_path, args.tileformat, args.tilequality)
+
+    return stages
+
+
+def compareResults(results, reference):
+    print(f"\nComparison with reference run ({reference['timestamp']}) :")
+    for name, stage in results['stages'].items():
+        if name not in reference['stages']:
+            continue
+        refStage = reference['stages'][name]
+        ratios = []
+        for metric in ('wall_time', 'peak_rss', 'bytes_written'):
+            if stage.get(metric) and refStage.get(metric):
+                ratios.append(f"{metric} x{stage[metric] / refStage[metric]:.2f}")
+        print(f"\t{name:32s} {', '.join(ratios)}")
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(description='Benchmark the Deep Zoom images preparation pipeline on a synthetic dataset')
+    parser.add_argument('-o', '--outputfile', type=str, default='benchmark.json',
+                        help='path of the JSON file where results are saved')
+    parser.add_argument('-w', '--workpath', type=str, default=None,
+                        help='folder where synthetic input and generated outputs are written (temporary folder by default)')
+    parser.add_argument('--axes', type=int, default=2, choices=(1, 2, 3),
+                        help='number of axis (in coronal, sagittal, axial order)')
+    parser.add_argument('--layers', type=int, default=2,
+                        help='number of layers per axis')
+    parser.add_argument('--slices', type=int, default=8,
+                        help='number of slices per layer')
+    parser.add_argument('--width', type=int, default=2048,
+                        help='width of slice images')
+    parser.add_argument('--height', type=int, default=1536,
+                        help='height of slice images')
+    parser.add_argument('--compression', type=str, default=None,
+                        help='compression of synthetic TIFF images (e.g. zlib, lzw), uncompressed by default')
+    parser.add_argument('-f', '--tileformat', type=str, default='jpg',
+                        help='image format of generated tiles (png | jpg)')
+    parser.add_argument('-q', '--tilequality', type=float, default=0.90,
+                        help='image quality of generated tiles')
+    parser.add_argument('-r', '--repeat', type=int, default=1,
+                        help='number of runs of each stage (the fastest is kept)')
+    parser.add_argument('-c', '--compare', type=str, default=None,
+                        help='path of a previous results file to compare with')
+    return parser
+
+
+def startBenchmark():
+    args = arg_parser().parse_args()
+
+    parameters = {key: value for key, value in vars(args).items() if key not in ('outputfile', 'workpath', 'compare')}
+    results = {
+        'timestamp': datetime.now().isoformat(),
+        'parameters': parameters,
+        'environment': {
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'numpy': np.__version__,
+            'pillow': PIL.__version__,
+        },
+    }
+
+    if args.workpath:
+        os.makedirs(args.workpath, exist_ok=True)
+        results['stages'] = runBenchmark(args, args.workpath)
+    else:
+        with tempfile.TemporaryDirectory() as work_path:
+            results['stages'] = runBenchmark(args, work_path)
+
+    with open(args.outputfile, 'w') as resultsFile:
+        json.dump(results, resultsFile, indent=2)
+    print(f"Results saved in {args.outputfile}")
+
+    for name, stage in results['stages'].items():
+        print(f"\t{name:32s} {stage['wall_time']:8.2f}s  {stage['peak_rss'] / 2**20:8.1f} MB")
+
+    if args.compare:
+        with open(args.compare, 'r') as referenceFile:
+            compareResults(results, json.load(referenceFile))
+
+
+if __name__ == '__main__':
+    startBenchmark()
@@ -0,0 +1,572 @@
+#!/usr/bin/env python
+
+import concurrent.futures
+import io
+import math
+import os
+import time
+from shutil import rmtree
+
+import numpy as np
+import tifffile
+
+import PIL.Image
+# disable image size check, since input image are quite large, but trusted
+PIL.Image.MAX_IMAGE_PIXELS = None
+
+try:
+    # AVIF encoder for Pillow versions which do not support it natively
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+from tileArchive import TileArchiveWriter, getArchivePath
+from outputSink import OutputSink, replaceFolder
+from intensityWindow import applyWindow
+
+
+DZI_NAMESPACE = "http://schemas.microsoft.com/deepzoom/2008"
+
+# how tiles are stored : 1 file per tile in the '_files' folder, or all tiles of a slice in a single archive
+TILE_CONTAINERS = ('files', 'archive')
+
+# PIL image formats corresponding to tile file extensions
+TILE_FORMATS = {
+    'jpg': 'JPEG',
+    'jpeg': 'JPEG',
+    'png': 'PNG',
+    'webp': 'WEBP',
+    'avif': 'AVIF',
+}
+
+# tile formats able to store label maps without altering their colors (WebP tiles are then always encoded losslessly)
+LABELMAP_FORMATS = ('png', 'webp')
+
+
+def getLevelCount(width, height):
+    # Deep Zoom pyramid goes down to a 1x1 pixel image
+    return int(math.ceil(math.log(max(width, height), 2))) + 1
+
+
+def getLevelSize(width, height, level, levelCount):
+    scale = 0.5 ** (levelCount - 1 - level)
+    return (int(math.ceil(width * scale)), int(math.ceil(height * scale)))
+
+
+def getTileBounds(column, row, levelWidth, levelHeight, tileSize, overlap):
+    # tiles overlap their neighbours, except on the image borders
+    x = column * tileSize - (0 if column == 0 else overlap)
+    y = row * tileSize - (0 if row == 0 else overlap)
+    width = tileSize + (1 if column == 0 else 2) * overlap
+    height = tileSize + (1 if row == 0 else 2) * overlap
+    return (x, y, min(width, levelWidth - x), min(height, levelHeight - y))
+
+
+def getUniformTileKey(tileArray):
+    '''
+    Return a key identifying the content of a tile whose pixels all have the same value (e.g. background), None otherwise.
+    '''
+    value = tileArray[0, 0]
+    if (tileArray == value).all():
+        return (tileArray.shape, tileArray.dtype.str, value.tobytes())
+    return None
+
+
+def applyColormap(array, colormap):
+    '''
+    Convert palette indexes to RGB through a TIFF colormap (3 x N values on 16 bits), as PIL converts palette images.
+    '''
+    colors = (np.asarray(colormap).T >> 8).astype(np.uint8)
+    return colors[array[..., 0] if array.ndim == 3 else array]
+
+
+def reduceByHalf(array, isLabelMap=False):
+    '''
+    Downsample image array by a factor 2 along both dimensions, the resulting size being rounded up as in Deep Zoom levels.
+    Pixel values are averaged over 2x2 blocks (area reduction), except for label maps where the top-left pixel is kept.
+    '''
+    if isLabelMap:
+        return array[::2, ::2]
+
+    height, width = array.shape[:2]
+    # replicate last row/column for odd sizes, so their value is kept as is
+    padding = [(0, height % 2), (0, width % 2)] + [(0, 0)] * (array.ndim - 2)
+    if height % 2 or width % 2:
+        array = np.pad(array, padding, mode='edge')
+
+    blocks = array.reshape((array.shape[0] // 2, 2, array.shape[1] // 2, 2) + array.shape[2:])
+    if np.issubdtype(array.dtype, np.integer):
+        # integer arithmetic with rounding, performed in wider type to avoid overflow
+        sumType = np.dtype(f"{array.dtype.kind}{min(2 * array.dtype.itemsize, 8)}")
+        reduced = (blocks.sum(axis=(1, 3), dtype=sumType) + 2) // 4
+        return reduced.astype(array.dtype)
+    else:
+        return blocks.mean(axis=(1, 3), dtype=np.float64).astype(array.dtype)
+
+
+def iterTiffRowBands(source, bandHeight, crop=None):
+    '''
+    Read a TIFF image as successive bands of (at least) bandHeight rows, restricted to the optional crop box (x, y, width, height).
+    Only the strips (or tiles) intersecting the current band are decoded, so memory usage is proportional to the image width.
+    '''
+    with tifffile.TiffFile(source) as tiff:
+        page = tiff.pages[0]
+        (cropX, cropY, width, height) = crop or (0, 0, page.imagewidth, page.imagelength)
+        # separated color planes are read as (samples, height, width) arrays
+        planar = page.planarconfig == 2 and page.samplesperpixel > 1
+
+        if page.is_memmappable:
+            # uncompressed contiguous image data is directly mapped from the file
+            image = tifffile.memmap(source, page=0, mode='r')
+            if planar:
+                image = np.moveaxis(image, 0, -1)
+            for y in range(cropY, cropY + height, bandHeight):
+                yield np.array(image[y:min(y + bandHeight, cropY + height), cropX:cropX + width])
+            del image
+            return
+
+        if page.planarconfig != 1 or page.imagedepth > 1:
+            # FIXME segments of separated color planes are not streamed, whole image is decoded instead
+            image = page.asarray()
+            if planar:
+                image = np.moveaxis(image, 0, -1)
+            for y in range(cropY, cropY + height, bandHeight):
+                yield image[y:min(y + bandHeight, cropY + height), cropX:cropX + width]
+            return
+
+        if page.is_tiled:
+            (segmentHeight, segmentWidth) = (page.tilelength, page.tilewidth)
+        else:
+            (segmentHeight, segmentWidth) = (page.rowsperstrip, page.imagewidth)
+        segmentsAcross = -(-page.imagewidth // segmentWidth)
+        samples = page.samplesperpixel
+
+        decode = page.decode
+        filehandle = tiff.filehandle
+        band = []
+        bandRows = 0
+        for segmentRowY in range((cropY // segmentHeight) * segmentHeight, cropY + height, segmentHeight):
+            segmentRow = np.zeros((segmentHeight, width) + ((samples,) if samples > 1 else ()), page.dtype)
+            for column in range(cropX // segmentWidth, -(-(cropX + width) // segmentWidth)):
+                index = (segmentRowY // segmentHeight) * segmentsAcross + column
+                if not page.databytecounts[index]:
+                    continue
+                filehandle.seek(page.dataoffsets[index])
+                data = filehandle.read(page.databytecounts[index])
+                segment = decode(data, index, jpegtables=page.jpegtables)[0]
+                segment = segment.reshape(segment.shape[-3:])
+                if samples == 1:
+                    segment = segment[..., 0]
+                # copy intersection of the segment and the crop box in the row
+                segmentX = column * segmentWidth
+                fromX = max(cropX, segmentX)
+                toX = min(cropX + width, segmentX + segment.shape[1])
+                segmentRow[:segment.shape[0], fromX - cropX:toX - cropX] = segment[:, fromX - segmentX:toX - segmentX]
+
+            fromY = max(cropY, segmentRowY)
+            toY = min(cropY + height, segmentRowY + segmentHeight)
+            band.append(segmentRow[fromY - segmentRowY:toY - segmentRowY])
+            bandRows += toY - fromY
+            if bandRows >= bandHeight:
+                yield np.concatenate(band) if len(band) > 1 else band[0]
+                band = []
+                bandRows = 0
+        if band:
+            yield np.concatenate(band) if len(band) > 1 else band[0]
+
+
+class TileDirectory(object):
+    '''
+    Store each tile in its own file, in the standard Deep Zoom '<name>_files/<level>/<column>_<row>.<format>' layout.
+    Tiles written with the same content key are hard links to the first one (when supported by the file system).
+    Tiles are written in a temporary folder, which replaces the tiles folder once complete, and through the output sink
+    when specified (write-behind).
+    '''
+
+    def __init__(self, path, tile_format, levelCount, sink=None):
+        self.path = path
+        self.tempPath = path + '.tmp'
+        self.tile_format = tile_format
+        self.sink = sink
+        self.written = {}
+        # create whole folder tree at once, so tiles can then be written in any order
+        rmtree(self.tempPath, ignore_errors=True)
+        for level in range(levelCount):
+            os.makedirs(os.path.join(self.tempPath, str(level)), exist_ok=True)
+
+    def write(self, level, column, row, data, key=None):
+        '''
+        Store tile data, return False if it was stored as a duplicate of a previous tile with the same key.
+        '''
+        tilePath = os.path.join(self.tempPath, str(level), f"{column}_{row}.{self.tile_format}")
+        if self.sink:
+            if key is not None and key in self.written:
+                (target, targetWrite) = self.written[key]
+                self.sink.linkFile(target, tilePath, data, targetWrite)
+                return False
+            tileWrite = self.sink.writeFile(tilePath, data)
+            if key is not None:
+                self.written[key] = (tilePath, tileWrite)
+            return True
+
+        if key is not None and key in self.written:
+            try:
+                os.link(self.written[key][0], tilePath)
+                return False
+            except OSError:
+                pass
+        with open(tilePath, 'wb') as tileFile:
+            tileFile.write(data)
+        if key is not None:
+            self.written.setdefault(key, (tilePath, None))
+        return True
+
+    def close(self):
+        if self.sink:
+            self.sink.flush()
+        replaceFolder(self.tempPath, self.path)
+
+
+class PyramidLevel(object):
+    '''
+    Receive successive bands of rows of one pyramid level, write the tiles as soon as a complete row of tiles is available,
+    and feed the next coarser level with the downsampled rows.
+    Only the rows needed for the current row of tiles are kept in memory.
+    '''
+
+    def __init__(self, tiler, level, width, height, store, coarser=None, isLabelMap=False, palette=None):
+        self.tiler = tiler
+        self.level = level
+        self.width = width
+        self.height = height
+        self.store = store
+        self.coarser = coarser
+        self.isLabelMap = isLabelMap
+        self.palette = palette
+        # buffered rows, the first of which is at index bufferStart in the level image
+        self.buffer = []
+        self.bufferStart = 0
+        self.bufferRows = 0
+        # rows waiting to be paired before being downsampled for the coarser level
+        self.pending = None
+        # all rows of the level are kept when this list is set
+        self.retained = None
+        self.tileRow = 0
+        self.tileRows = int(math.ceil(height / tiler.tile_size))
+
+    def push(self, rows):
+        if self.retained is not None:
+            self.retained.append(rows)
+        self.buffer.append(rows)
+        self.bufferRows += len(rows)
+        self.writeAvailableTileRows()
+
+        if self.coarser:
+            if self.pending is not None:
+                rows = np.concatenate((self.pending, rows))
+            evenRows = len(rows) - len(rows) % 2
+            self.pending = rows[evenRows:] if evenRows < len(rows) else None
+            if evenRows:
+                self.coarser.push(self.tiler.reduce(rows[:evenRows], self.isLabelMap))
+
+    def finish(self):
+        self.writeAvailableTileRows()
+        if self.coarser:
+            if self.pending is not None:
+                self.coarser.push(self.tiler.reduce(self.pending, self.isLabelMap))
+                self.pending = None
+            self.coarser.finish()
+
+    def writeAvailableTileRows(self):
+        tileSize = self.tiler.tile_size
+        overlap = self.tiler.tile_overlap
+        while self.tileRow < self.tileRows:
+            (_, y, _, height) = getTileBounds(0, self.tileRow, self.width, self.height, tileSize, overlap)
+            if self.bufferStart + self.bufferRows < y + height:
+                break
+            if len(self.buffer) > 1:
+                self.buffer = [np.concatenate(self.buffer)]
+            rows = self.buffer[0][y - self.bufferStart:y + height - self.bufferStart]
+            self.tiler.writeTileRow(rows, self.level, self.tileRow, self.width, self.height, self.store, self.palette)
+            self.tileRow += 1
+
+            # discard rows which are not part of the next row of tiles
+            nextY = self.tileRow * tileSize - overlap
+            if nextY > self.bufferStart:
+                self.buffer = [self.buffer[0][nextY - self.bufferStart:]]
+                self.bufferRows -= nextY - self.bufferStart
+                self.bufferStart = nextY
+
+
+class DeepZoomTiler(object):
+    '''
+    Create Deep Zoom image pyramid (.dzi descriptor and tiles folder) from a 2D image.
+    Each level is computed from the previous (finer) one, and tiles are cut directly from the level's pixel array.
+
+    When retain_size (width, height) is specified, the coarsest level at least that large is kept as a PIL image in
+    the retained attribute once the pyramid is created (e.g. to produce a thumbnail without decoding the source again).
+
+    WebP tiles are lossless when image_quality is 1.0, or when the image is a label map.
+
+    Time spent reading the source, downsampling levels, encoding and writing tiles, as well as the number of tiles and bytes
+    written, are accumulated in the stats attribute.
+
+    Uniform tiles (e.g. background) are encoded once per image, and their duplicates are stored as links to the first
+    occurrence; the number of such tiles and the bytes they would have taken are also counted in stats.
+
+    When an intensity window (low, high) is specified, pixel values (e.g. 16-bit or float) are mapped to 8-bit through
+    it before tiling, so every level shares the same window.
+
+    When write_threads is not 0, tiles are written behind by that many writer threads (see OutputSink), so encoding
+    only waits for the storage when the write queue is full; write_time is then the time spent queuing the tiles,
+    while writer_time is the time spent by the writer threads.
+    '''
+
+    def __init__(self, tile_size=256, tile_overlap=1, tile_format='jpg', image_quality=0.9, retain_size=None,
+                 tile_container='files', encode_threads=1, window=None, write_threads=0):
+        if tile_format not in TILE_FORMATS:
+            raise ValueError(f"Unsupported tile format : {tile_format}")
+        if TILE_FORMATS[tile_format] not in PIL.Image.SAVE:
+            PIL.Image.init()
+            if TILE_FORMATS[tile_format] not in PIL.Image.SAVE:
+                raise ValueError(f"Tile format not supported by installed Pillow : {tile_format}"
+                                 + (" (requires Pillow >= 11.2 or pillow-avif-plugin)" if tile_format == 'avif' else ''))
+        if tile_container not in TILE_CONTAINERS:
+            raise ValueError(f"Unsupported tile container : {tile_container}")
+        self.tile_container = tile_container
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.tile_format = tile_format
+        self.image_quality = image_quality
+        self.window = window
+        self.retain_size = retain_size
+        self.retained = None
+        # tiles of a row are encoded concurrently (encoders release the GIL)
+        self.encode_threads = encode_threads
+        self.encoder = None
+        self.write_threads = write_threads
+        self.sink = None
+        self.lossless = tile_format == 'png' or (tile_format == 'webp' and image_quality >= 1.0)
+        self.stats = {'tiles': 0, 'bytes_written': 0, 'duplicate_tiles': 0, 'duplicate_bytes': 0,
+                      'read_time': 0.0, 'resample_time': 0.0, 'encode_time': 0.0, 'write_time': 0.0, 'writer_time': 0.0,
+                      'queue_wait_time': 0.0}
+        # encoded data of uniform tiles, by content key
+        self.uniformTiles = {}
+
+    def create(self, source, destination, crop=None):
+        '''
+        Create Deep Zoom image from source image file, optionally cropped to the box (x, y, width, height).
+        '''
+        with PIL.Image.open(source) as image:
+            self.createFromImage(image, destination, crop)
+
+    def createFromImage(self, image, destination, crop=None):
+        '''
+        Create Deep Zoom image from PIL image, optionally cropped to the box (x, y, width, height).
+        '''
+        # label maps must not be interpolated, and palette must be preserved in tiles
+        isLabelMap = image.mode in ('P', '1') and self.tile_format in LABELMAP_FORMATS
+        palette = image.getpalette() if isLabelMap and image.mode == 'P' else None
+        if image.mode == '1':
+            image = image.convert('L')
+        elif image.mode not in ('L', 'RGB') and not isLabelMap and self.tile_format != 'png' and self.window is None:
+            image = image.convert('RGB')
+
+        start = time.perf_counter()
+        array = np.asarray(image)
+        self.stats['read_time'] += time.perf_counter() - start
+        if crop:
+            # tiles are directly cut from a view of the cropped region
+            (cropX, cropY, cropWidth, cropHeight) = crop
+            array = array[cropY:cropY + cropHeight, cropX:cropX + cropWidth]
+        self.createFromArray(array, destination, isLabelMap, palette)
+
+    def createFromArray(self, array, destination, isLabelMap=False, palette=None):
+        '''
+        Create Deep Zoom image from pixel array (height x width [x channels]).
+        '''
+        height, width = array.shape[:2]
+        # process array by bands to limit size of intermediate arrays
+        bands = (array[y:y + self.tile_size] for y in range(0, height, self.tile_size))
+        if self.window is not None and not isLabelMap:
+            bands = (self.toTileArray(band, isLabelMap) for band in bands)
+        self.createFromRowBands(bands, width, height, destination, isLabelMap, palette)
+
+    def createStreaming(self, source, destination, crop=None):
+        '''
+        Create Deep Zoom image from source TIFF file (optionally cropped) without decoding the whole image at once.
+        '''
+        with tifffile.TiffFile(source) as tiff:
+            page = tiff.pages[0]
+            (width, height) = (crop[2], crop[3]) if crop else (page.imagewidth, page.imagelength)
+            colormap = page.colormap if page.photometric == tifffile.PHOTOMETRIC.PALETTE else None
+
+        (isLabelMap, palette) = self.getTiffPalette(colormap)
+        bands = (self.toTileArray(band, isLabelMap, colormap)
+                 for band in iterTiffRowBands(source, self.tile_size, crop))
+        self.createFromRowBands(bands, width, height, destination, isLabelMap, palette)
+
+    def createFromTiffArray(self, array, destination, colormap=None):
+        '''
+        Create Deep Zoom image from pixel array decoded from a TIFF file (e.g. memory-mapped slice stack), as createStreaming.
+        '''
+        (isLabelMap, palette) = self.getTiffPalette(colormap)
+        height, width = array.shape[:2]
+        bands = (self.toTileArray(np.asarray(array[y:y + self.tile_size]), isLabelMap, colormap)
+                 for y in range(0, height, self.tile_size))
+        self.createFromRowBands(bands, width, height, destination, isLabelMap, palette)
+
+    def getTiffPalette(self, colormap):
+        isLabelMap = colormap is not None and self.tile_format in LABELMAP_FORMATS
+        palette = None
+        if isLabelMap:
+            # TIFF colormap is stored on 16 bits
+            palette = (np.asarray(colormap).T.ravel() >> 8).astype(np.uint8).tolist()
+        return (isLabelMap, palette)
+
+    def toTileArray(self, array, isLabelMap, colormap=None):
+        # convert pixel array to a type supported by the tile format, as done for PIL images in createFromImage
+        if isLabelMap:
+            return array
+        if colormap is not None:
+            # palette images which are not kept as label maps are converted to RGB
+            return applyColormap(array, colormap)
+        if self.window is not None:
+            array = applyWindow(array, self.window)
+        elif self.tile_format == 'png':
+            return array
+        if array.ndim == 3 and array.shape[2] not in (1, 3):
+            array = array[..., :3] if array.shape[2] > 3 else array[..., 0]
+        if array.dtype != np.uint8:
+            array = np.clip(array, 0, 255).astype(np.uint8)
+        return array
+
+    def createFromRowBands(self, bands, width, height, destination, isLabelMap=False, palette=None):
+        '''
+        Create Deep Zoom image from successive bands of rows of the full resolution image.
+        '''
+        levelCount = getLevelCount(width, height)
+        store = self.openTileStore(destination, levelCount)
+        if isLabelMap:
+            self.lossless = True
+
+        # chain levels from the coarsest to the finest
+        level = retainedLevel = None
+        for index in range(levelCount):
+            (levelWidth, levelHeight) = getLevelSize(width, height, index, levelCount)
+            level = PyramidLevel(self, index, levelWidth, levelHeight, store, level, isLabelMap, palette)
+            if self.retain_size and retainedLevel is None and (
+                    (levelWidth >= self.retain_size[0] and levelHeight >= self.retain_size[1]) or index == levelCount - 1):
+                level.retained = []
+                retainedLevel = level
+
+        bands = iter(bands)
+        while True:
+            start = time.perf_counter()
+            band = next(bands, None)
+            self.stats['read_time'] += time.perf_counter() - start
+            if band is None:
+                break
+            level.push(band)
+        level.finish()
+        self.closeTileStore(store)
+
+        if retainedLevel:
+            self.retained = PIL.Image.fromarray(np.concatenate(retainedLevel.retained))
+            if palette is not None:
+                self.retained.putpalette(palette)
+
+        self.writeDescriptor(destination, width, height)
+
+    def openTileStore(self, destination, levelCount):
+        self.uniformTiles = {}
+        if self.encode_threads > 1:
+            self.encoder = concurrent.futures.ThreadPoolExecutor(max_workers=self.encode_threads)
+        if self.write_threads > 0:
+            self.sink = OutputSink(self.write_threads)
+        if self.tile_container == 'archive':
+            return TileArchiveWriter(getArchivePath(destination), self.tile_format, self.sink)
+        else:
+            return TileDirectory(os.path.splitext(destination)[0] + '_files', self.tile_format, levelCount, self.sink)
+
+    def closeTileStore(self, store):
+        try:
+            store.close()
+        finally:
+            if self.encoder:
+                self.encoder.shutdown()
+                self.encoder = None
+            if self.sink:
+                self.sink.close()
+                self.stats['writer_time'] += self.sink.stats['writer_time']
+                self.stats['queue_wait_time'] += self.sink.stats['queue_wait_time']
+                self.sink = None
+
+    def writeTileRow(self, rows, level, row, levelWidth, levelHeight, store, palette=None):
+        columns = int(math.ceil(levelWidth / self.tile_size))
+        tileArrays = []
+        for column in range(columns):
+            (x, _, width, _) = getTileBounds(
+                column, row, levelWidth, levelHeight, self.tile_size, self.tile_overlap)
+            tileArrays.append(rows[:, x:x + width])
+
+        start = time.perf_counter()
+        keys = [getUniformTileKey(tileArray) for tileArray in tileArrays]
+        # uniform tiles are only encoded once
+        toEncode = []
+        for column, key in enumerate(keys):
+            if key is None or (key not in self.uniformTiles and key not in keys[:column]):
+                toEncode.append(column)
+        if self.encoder and len(toEncode) > 1:
+            encodedData = self.encoder.map(self.encodeTile, [tileArrays[column] for column in toEncode], [palette] * len(toEncode))
+        else:
+            encodedData = (self.encodeTile(tileArrays[column], palette) for column in toEncode)
+        tilesData = [None] * columns
+        for column, data in zip(toEncode, encodedData):
+            tilesData[column] = data
+            if keys[column] is not None:
+                self.uniformTiles.setdefault(keys[column], data)
+        encoded = time.perf_counter()
+
+        for column in range(columns):
+            data = tilesData[column] if tilesData[column] is not None else self.uniformTiles[keys[column]]
+            if store.write(level, column, row, data, keys[column]):
+                self.stats['bytes_written'] += len(data)
+            else:
+                self.stats['duplicate_tiles'] += 1
+                self.stats['duplicate_bytes'] += len(data)
+        self.stats['encode_time'] += encoded - start
+        self.stats['write_time'] += time.perf_counter() - encoded
+        self.stats['tiles'] += columns
+
+    def reduce(self, array, isLabelMap):
+        start = time.perf_counter()
+        reduced = reduceByHalf(array, isLabelMap)
+        self.stats['resample_time'] += time.perf_counter() - start
+        return reduced
+
+    def encodeTile(self, tileArray, palette=None):
+        tile = PIL.Image.fromarray(np.ascontiguousarray(tileArray))
+        if palette is not None:
+            tile.putpalette(palette)
+
+        data = io.BytesIO()
+        tileFormat = TILE_FORMATS[self.tile_format]
+        if tileFormat == 'WEBP' and self.lossless:
+            tile.save(data, tileFormat, lossless=True)
+        elif tileFormat in ('JPEG', 'WEBP', 'AVIF'):
+            tile.save(data, tileFormat, quality=int(self.image_quality * 100))
+        else:
+            tile.save(data, tileFormat)
+        return data.getvalue()
+
+    def writeDescriptor(self, destination, width, height):
+        # descriptor is replaced at once, after the tiles it describes
+        tempDestination = destination + '.tmp'
+        with open(tempDestination, 'w') as descriptor:
+            descriptor.write(
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                f'<Image TileSize="{self.tile_size}" Overlap="{self.tile_overlap}" Format="{self.tile_format}" xmlns="{DZI_NAMESPACE}">'
+                f'<Size Width="{width}" Height="{height}"/>'
+                '</Image>\n')
+        os.replace(tempDestination, destination)
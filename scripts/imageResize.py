@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+import math
+
+import numpy as np
+import PIL.Image
+
+from intensityWindow import applyWindow, computeWindow
+
+
+def reduceBandsByArea(bands, factor):
+    '''
+    Downsample an image, provided as successive bands of rows, by averaging blocks of factor x factor pixels
+    (incomplete blocks at the right and bottom edges are averaged over their actual pixels).
+    Return the reduced image as an array of 8-bit values for 8-bit images, float32 otherwise.
+    '''
+    reduced = []
+    pending = None
+    for band in bands:
+        if pending is not None:
+            band = np.concatenate((pending, band))
+        rows = (band.shape[0] // factor) * factor
+        pending = band[rows:] if rows < band.shape[0] else None
+        if rows:
+            reduced.append(reduceBlocks(band[:rows], factor))
+    if pending is not None:
+        reduced.append(reduceBlocks(pending, factor))
+    return np.concatenate(reduced)
+
+
+def reduceBlocks(rows, factor):
+    if factor == 1:
+        return np.asarray(rows, dtype=np.uint8 if rows.dtype == np.uint8 else np.float32)
+    if rows.dtype == np.uint8 and (rows.ndim == 2 or rows.shape[2] in (1, 3, 4)):
+        # box reduction of Pillow is much faster than averaging reshaped arrays
+        if rows.ndim == 3 and rows.shape[2] == 1:
+            rows = rows[..., 0]
+        return np.asarray(PIL.Image.fromarray(np.ascontiguousarray(rows)).reduce(factor))
+    if rows.ndim == 2:
+        return np.asarray(PIL.Image.fromarray(rows.astype(np.float32)).reduce(factor))
+    # multiple samples of more than 8 bits, columns are padded to a multiple of factor
+    (height, width) = rows.shape[:2]
+    padding = [(0, -(-height // factor) * factor - height), (0, -(-width // factor) * factor - width), (0, 0)]
+    rows = np.pad(rows.astype(np.float32), padding, mode='edge')
+    blocks = rows.reshape((rows.shape[0] // factor, factor, rows.shape[1] // factor, factor, rows.shape[2]))
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+
+def getThumbnailLayout(width, height, size, pad=True):
+    '''
+    Return size of the resized image fitting in size (width, height) without distortion, and the offset it is pasted at
+    in the padded thumbnail; when pad is False, image is stretched to size instead.
+    '''
+    if not pad:
+        return (tuple(size), (0, 0))
+    scale = min(size[0] / width, size[1] / height)
+    fitSize = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return (fitSize, ((size[0] - fitSize[0]) // 2, (size[1] - fitSize[1]) // 2))
+
+
+def makeThumbnail(bands, width, height, size, pad=True, background=0, window=None):
+    '''
+    Create anti-aliased thumbnail of the specified size from an image provided as successive bands of rows: the image is
+    first reduced by averaging blocks of pixels while it is read (so it is never loaded entirely), then resampled to its
+    final size with a Lanczos filter, and centered on a padded background when its aspect ratio differs from the
+    thumbnail's. Samples of more than 8 bits are mapped to 8-bit through the intensity window (low, high) if specified,
+    otherwise between the 0.5 and 99.5 percentiles of the thumbnail.
+    '''
+    (fitSize, offset) = getThumbnailLayout(width, height, size, pad)
+    # block averaging performs most of the reduction, leaving a factor between 2 and 4 to the final resampling
+    factor = max(1, math.floor(min(width / fitSize[0], height / fitSize[1]) / 2))
+    reduced = reduceBandsByArea(bands, factor)
+    if reduced.ndim == 3 and reduced.shape[2] == 1:
+        reduced = reduced[..., 0]
+    elif reduced.ndim == 3 and reduced.shape[2] > 3:
+        reduced = reduced[..., :3]
+
+    if reduced.dtype != np.uint8 and window is not None:
+        reduced = applyWindow(reduced, window)
+    elif reduced.dtype != np.uint8:
+        if reduced.max(initial=0) > 255 or reduced.min(initial=0) < 0:
+            reduced = applyWindow(reduced, computeWindow([reduced.ravel()]))
+        else:
+            reduced = np.round(reduced).astype(np.uint8)
+
+    image = PIL.Image.fromarray(reduced).resize(fitSize, PIL.Image.LANCZOS)
+    if fitSize == tuple(size):
+        return image
+    thumbnail = PIL.Image.new(image.mode, tuple(size), background)
+    thumbnail.paste(image, offset)
+    return thumbnail
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+import concurrent.futures
+import json
+import logging
+import os
+import struct
+
+import SimpleITK as sitk
+
+SCAN_CACHE_FILENAME = 'scan_cache.json'
+
+# number of files whose header are concurrently read (mostly waiting for I/O, hence more threads than cores)
+SCAN_THREADS = 16
+
+TIFFTAG_IMAGEWIDTH = 256
+TIFFTAG_IMAGELENGTH = 257
+TIFFTAG_XRESOLUTION = 282
+TIFFTAG_YRESOLUTION = 283
+TIFFTAG_RESOLUTIONUNIT = 296
+
+RESUNIT_INCH = 2
+RESUNIT_CENTIMETER = 3
+
+# TIFF field types : (struct format, size in bytes)
+TIFF_TYPES = {
+    3: ('H', 2),    # SHORT
+    4: ('I', 4),    # LONG
+    5: ('II', 8),   # RATIONAL
+    16: ('Q', 8),   # LONG8
+}
+
+
+def readTiffTags(path, tags):
+    '''
+    Read values of the specified tags in the first IFD of a TIFF (or BigTIFF) file, without decoding the image.
+    '''
+    values = {}
+    with open(path, 'rb') as file:
+        header = file.read(16)
+        if header[:2] == b'II':
+            byteOrder = '<'
+        elif header[:2] == b'MM':
+            byteOrder = '>'
+        else:
+            raise ValueError(f"Not a TIFF file : {path}")
+
+        version = struct.unpack(byteOrder + 'H', header[2:4])[0]
+        if version == 42:
+            (ifdOffset,) = struct.unpack(byteOrder + 'I', header[4:8])
+            (countFormat, entryFormat, inlineSize) = ('H', 'HHI', 4)
+        elif version == 43:
+            (ifdOffset,) = struct.unpack(byteOrder + 'Q', header[8:16])
+            (countFormat, entryFormat, inlineSize) = ('Q', 'HHQ', 8)
+        else:
+            raise ValueError(f"Unsupported TIFF version ({version}) : {path}")
+
+        countSize = struct.calcsize(countFormat)
+        entrySize = struct.calcsize('=' + entryFormat) + inlineSize
+        file.seek(ifdOffset)
+        (entryCount,) = struct.unpack(byteOrder + countFormat, file.read(countSize))
+        entries = file.read(entryCount * entrySize)
+
+        for index in range(entryCount):
+            entry = entries[index * entrySize:(index + 1) * entrySize]
+            (tag, fieldType, count) = struct.unpack(byteOrder + entryFormat, entry[:-inlineSize])
+            if tag not in tags or fieldType not in TIFF_TYPES:
+                continue
+            (valueFormat, valueSize) = TIFF_TYPES[fieldType]
+            data = entry[-inlineSize:]
+            if valueSize > inlineSize:
+                # value does not fit in the entry, it is stored at the specified offset
+                (offset,) = struct.unpack(byteOrder + ('I' if inlineSize == 4 else 'Q'), data)
+                file.seek(offset)
+                data = file.read(valueSize)
+            value = struct.unpack(byteOrder + valueFormat, data[:valueSize])
+            values[tag] = value[0] / value[1] if fieldType == 5 else value[0]
+
+    return values
+
+
+def readTiffImageInfo(path):
+    '''
+    Retrieve size, spacing and origin of a 2D TIFF image from its header, following the same conventions as SimpleITK
+    (spacing in mm when resolution unit is inch or centimeter, origin at 0).
+    '''
+    tags = readTiffTags(path, (TIFFTAG_IMAGEWIDTH, TIFFTAG_IMAGELENGTH,
+                               TIFFTAG_XRESOLUTION, TIFFTAG_YRESOLUTION, TIFFTAG_RESOLUTIONUNIT))
+    if TIFFTAG_IMAGEWIDTH not in tags or TIFFTAG_IMAGELENGTH not in tags:
+        raise ValueError(f"Missing image size tags : {path}")
+
+    spacing = [1.0, 1.0]
+    xResolution = tags.get(TIFFTAG_XRESOLUTION, 0)
+    yResolution = tags.get(TIFFTAG_YRESOLUTION, 0)
+    # TIFF default resolution unit is inch
+    resolutionUnit = tags.get(TIFFTAG_RESOLUTIONUNIT, RESUNIT_INCH)
+    if xResolution > 0 and yResolution > 0:
+        if resolutionUnit == RESUNIT_INCH:
+            spacing = [25.4 / xResolution, 25.4 / yResolution]
+        elif resolutionUnit == RESUNIT_CENTIMETER:
+            spacing = [10.0 / xResolution, 10.0 / yResolution]
+
+    return {
+        'width': tags[TIFFTAG_IMAGEWIDTH],
+        'height': tags[TIFFTAG_IMAGELENGTH],
+        'spacing': spacing,
+        'origin': [0.0, 0.0]
+    }
+
+
+def readImageInfo(path):
+    '''
+    Retrieve size, spacing and origin of a 2D image, from TIFF header when possible, otherwise using SimpleITK.
+    '''
+    try:
+        return readTiffImageInfo(path)
+    except (ValueError, struct.error) as error:
+        logging.info(f"Falling back to SimpleITK to read image information ({error})")
+
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(path)
+    reader.LoadPrivateTagsOn()
+    reader.ReadImageInformation()
+
+    # FIXME check it is actual 2D image
+    size = reader.GetSize()
+    return {
+        'width': size[0],
+        'height': size[1],
+        # distance between pixels along each of the dimensions, in consistent, but not specified, units (nm, mm, m ?)
+        'spacing': list(reader.GetSpacing()),
+        # images should be aligned on their respective origin
+        'origin': list(reader.GetOrigin())
+    }
+
+
+class ScanCache(object):
+    '''
+    On-disk cache of image information, keyed by file path, and invalidated when file size or modification time change.
+    '''
+
+    def __init__(self, filepath=None):
+        self.filepath = filepath
+        self.entries = {}
+        self.modified = False
+        if filepath and os.path.isfile(filepath):
+            try:
+                with open(filepath, 'r') as cacheFile:
+                    self.entries = json.load(cacheFile)
+            except ValueError:
+                logging.warning(f"Ignoring invalid scan cache : {filepath}")
+
+    def get(self, path, stat):
+        entry = self.entries.get(path)
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+            return entry['info']
+        return None
+
+    def put(self, path, stat, info):
+        self.entries[path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'info': info}
+        self.modified = True
+
+    def save(self):
+        if not self.filepath or not self.modified:
+            return
+        tempFilepath = self.filepath + '.tmp'
+        with open(tempFilepath, 'w') as cacheFile:
+            json.dump(self.entries, cacheFile)
+        os.replace(tempFilepath, self.filepath)
+        self.modified = False
+
+
+def scanImageFiles(entries, cache=None, onScanned=None):
+    '''
+    Retrieve image information of the specified directory entries, concurrently reading files not found in the cache.
+    Results are returned in the same order as the entries; onScanned is invoked after each file is handled.
+    '''
+    if cache is None:
+        cache = ScanCache()
+
+    infos = [None] * len(entries)
+    toRead = []
+    for index, entry in enumerate(entries):
+        stat = entry.stat()
+        infos[index] = cache.get(entry.path, stat)
+        if infos[index] is None:
+            toRead.append((index, entry, stat))
+        elif onScanned:
+            onScanned()
+
+    if toRead:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=SCAN_THREADS) as executor:
+            futures = {executor.submit(readImageInfo, entry.path): (index, entry, stat) for (index, entry, stat) in toRead}
+            for future in concurrent.futures.as_completed(futures):
+                (index, entry, stat) = futures[future]
+                infos[index] = future.result()
+                cache.put(entry.path, stat, infos[index])
+                if onScanned:
+                    onScanned()
+
+    return infos
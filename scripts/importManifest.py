@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+import hashlib
+import json
+import logging
+import os
+
+MANIFEST_FILENAME = 'import_manifest.jsonl'
+
+
+def getFileInfo(path):
+    stat = os.stat(path)
+    return {
+        'path': path,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns
+    }
+
+
+def getFileDigest(path, blockSize=4 * 1024 * 1024):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(blockSize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ImportManifest(object):
+    '''
+    Record of the outputs generated in the output folder, with the source file and the parameters they were generated from.
+    It is used to skip the outputs that are still up-to-date when the import is run again.
+
+    Entries are appended to the manifest file (JSON lines, last entry of an output wins) as soon as the output is complete,
+    so an interrupted import can be resumed from where it stopped.
+    When reuse is False, previous entries are discarded and every output is considered outdated.
+    When shard_path is specified (sharded import), entries of the manifest of the output folder are loaded, but entries
+    are recorded in a manifest of the shard folder, which is later merged in the former.
+    '''
+
+    def __init__(self, output_path, enabled=True, reuse=True, shard_path=None):
+        self.filepath = os.path.join(shard_path or output_path, MANIFEST_FILENAME)
+        self.output_path = output_path
+        self.enabled = enabled
+        self.entries = {}
+        self.file = None
+        if enabled:
+            if reuse:
+                if shard_path:
+                    self.load(os.path.join(output_path, MANIFEST_FILENAME))
+                self.load(self.filepath)
+            elif os.path.exists(self.filepath):
+                os.remove(self.filepath)
+
+    def load(self, filepath):
+        if not os.path.isfile(filepath):
+            return
+        with open(filepath, 'r') as manifest:
+            for line in manifest:
+                try:
+                    entry = json.loads(line)
+                    self.entries[entry['output']] = entry
+                except (ValueError, KeyError):
+                    # last line might be truncated when previous import was interrupted
+                    logging.warning(f"Ignoring invalid manifest entry in {filepath}")
+
+    def getKey(self, output):
+        return os.path.relpath(output, self.output_path)
+
+    def isUpToDate(self, output, source, params, extraOutputs=()):
+        '''
+        Check whether output (and its companion outputs) previously generated from the same source file and parameters still exist.
+        '''
+        if not self.enabled:
+            return False
+        entry = self.entries.get(self.getKey(output))
+        if entry is None or entry['params'] != params:
+            return False
+        if not all(os.path.exists(path) for path in (output,) + tuple(extraOutputs)):
+            return False
+
+        recorded = entry['source']
+        current = getFileInfo(source)
+        if recorded['path'] != current['path'] or recorded['size'] != current['size']:
+            return False
+        if recorded['mtime'] != current['mtime']:
+            # file was touched, but its content might still be the same
+            if recorded.get('hash') is None or recorded['hash'] != getFileDigest(source):
+                return False
+            recorded['mtime'] = current['mtime']
+            self.record(output, recorded, params)
+        return True
+
+    def record(self, output, sourceInfo, params):
+        if not self.enabled:
+            return
+        entry = {
+            'output': self.getKey(output),
+            'source': sourceInfo,
+            'params': params
+        }
+        self.entries[entry['output']] = entry
+        if self.file is None:
+            self.file = open(self.filepath, 'a')
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+
+    def close(self):
+        '''
+        Rewrite manifest with only the latest entry of each output.
+        '''
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if not self.enabled:
+            return
+        tempFilepath = self.filepath + '.tmp'
+        with open(tempFilepath, 'w') as manifest:
+            for entry in self.entries.values():
+                manifest.write(json.dumps(entry) + '\n')
+        os.replace(tempFilepath, self.filepath)
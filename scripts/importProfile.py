@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+import contextlib
+import cProfile
+import csv
+import json
+import os
+import resource
+import sys
+import time
+from datetime import datetime
+
+PROFILE_REPORT_FILENAME = 'import_profile.json'
+PROFILE_SLICES_FILENAME = 'import_profile.csv'
+PROFILE_DUMP_FILENAME = 'import_profile.prof'
+
+# per slice values written in the CSV report, in that order
+SLICE_FIELDS = ('axis', 'layer', 'index', 'source', 'width', 'height', 'bytes_read', 'tiles', 'bytes_written',
+                'duplicate_tiles', 'duplicate_bytes',
+                'wall_time', 'read_time', 'resample_time', 'encode_time', 'write_time', 'writer_time', 'queue_wait_time',
+                'stack_time', 'subview_time', 'hash_time', 'peak_rss')
+
+
+def getPeakMemory(who=resource.RUSAGE_SELF):
+    # ru_maxrss is expressed in kilobytes on Linux, but in bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class StageTimer(object):
+    '''
+    Accumulate wall time, number of runs and arbitrary counters (bytes read/written, tiles...) of named stages.
+    '''
+
+    def __init__(self):
+        self.stages = {}
+
+    def get(self, name):
+        return self.stages.setdefault(name, {'wall_time': 0.0, 'count': 0})
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        '''
+        Time the enclosed block as a run of the specified stage; yielded dict may be used to update stage counters.
+        '''
+        entry = self.get(name)
+        start = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            entry['wall_time'] += time.perf_counter() - start
+            entry['count'] += 1
+
+    def add(self, name, **counters):
+        entry = self.get(name)
+        for (counter, value) in counters.items():
+            entry[counter] = entry.get(counter, 0) + value
+
+
+class ImportProfile(object):
+    '''
+    Timings and counters of an import, by stage and by slice, saved next to the viewer config when the import completes.
+    When cprofile is True, the calling process is also run under cProfile (slices processed by worker processes are not
+    included in the dump, so use a single job to profile the whole pipeline).
+    '''
+
+    def __init__(self, output_path, enabled=True, cprofile=False):
+        self.output_path = output_path
+        self.enabled = enabled
+        self.timer = StageTimer()
+        self.slices = []
+        self.start = time.perf_counter()
+        self.profiler = None
+        if enabled and cprofile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stage(self, name):
+        return self.timer.stage(name)
+
+    def recordSlice(self, task, stats):
+        '''
+        Record statistics returned by the processing of a slice, and add them to the totals of the slice stages.
+        '''
+        self.slices.append(dict({'axis': task['axis'], 'layer': task['layer'], 'index': task['index'],
+                                 'source': task['source']}, **stats))
+        self.timer.add('slices', wall_time=stats['wall_time'], count=1, bytes_read=stats['bytes_read'],
+                       bytes_written=stats['bytes_written'], tiles=stats['tiles'],
+                       duplicate_tiles=stats['duplicate_tiles'], duplicate_bytes=stats['duplicate_bytes'])
+        for stage in ('read', 'resample', 'encode', 'write', 'writer', 'queue_wait', 'stack', 'subview', 'hash'):
+            self.timer.add(stage, wall_time=stats[stage + '_time'], count=1)
+
+    def save(self, parameters=None):
+        if not self.enabled:
+            return
+        if self.profiler:
+            self.profiler.disable()
+            self.profiler.dump_stats(os.path.join(self.output_path, PROFILE_DUMP_FILENAME))
+
+        report = {
+            'timestamp': datetime.now().isoformat(),
+            'parameters': parameters or {},
+            'wall_time': time.perf_counter() - self.start,
+            # peak memory of the main process, and of the largest of the terminated worker processes
+            'peak_rss': getPeakMemory(),
+            'peak_rss_workers': getPeakMemory(resource.RUSAGE_CHILDREN),
+            'stages': self.timer.stages,
+            'slices': self.slices
+        }
+        with open(os.path.join(self.output_path, PROFILE_REPORT_FILENAME), 'w') as reportFile:
+            json.dump(report, reportFile, indent=2)
+
+        with open(os.path.join(self.output_path, PROFILE_SLICES_FILENAME), 'w', newline='') as slicesFile:
+            writer = csv.DictWriter(slicesFile, fieldnames=SLICE_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(self.slices)
+
+    def printSummary(self):
+        print("Time spent per stage :")
+        for (name, entry) in self.timer.stages.items():
+            counters = ', '.join(f"{counter}={value}" for (counter, value) in entry.items()
+                                 if counter not in ('wall_time', 'count'))
+            print(f"\t{name:<12} {entry['wall_time']:10.2f}s" + (f"  ({counters})" if counters else ''))
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import logging
+import os
+from datetime import datetime
+
+import numpy as np
+
+from importManifest import MANIFEST_FILENAME
+
+# fragments of the shards are saved in a sub-folder of the output folder, one folder per shard
+SHARDS_FOLDERNAME = 'import_shards'
+SHARD_FOLDERNAME_PATTERN = '{index}of{count}'
+FRAGMENT_FILENAME = 'fragment.json'
+THUMBNAILS_FILENAME = 'thumbnails.npz'
+
+
+def parseShard(value):
+    '''
+    Parse shard specification "K/N" (K-th of N shards, 1 <= K <= N) as (K, N).
+    '''
+    try:
+        (index, count) = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"shard must be specified as K/N (e.g. 2/4), not {value}")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"shard index must be between 1 and the number of shards, not {value}")
+    return (index, count)
+
+
+def getShardsPath(output_path):
+    return os.path.join(output_path, SHARDS_FOLDERNAME)
+
+
+class ShardFragment(object):
+    '''
+    Partial result of the import of a shard: the (axis, layer, slice) work units of a dataset are enumerated in a
+    deterministic order, and dealt in turn to the shards, so every node processes about the same number of slices of
+    each layer. Tiles are written in the shared output folder, while the results which would otherwise update the
+    files shared by all slices (viewer config, subview volumes, region index, intensity windows, import manifest...)
+    are saved in the folder of the shard, to be then merged once every shard is done.
+    The fragment descriptor is written last, so a shard which failed or is still running has no fragment.
+    '''
+
+    def __init__(self, output_path, index, count):
+        self.index = index
+        self.count = count
+        self.path = os.path.join(getShardsPath(output_path), SHARD_FOLDERNAME_PATTERN.format(index=index, count=count))
+        os.makedirs(self.path, exist_ok=True)
+        for filename in (FRAGMENT_FILENAME, THUMBNAILS_FILENAME):
+            if os.path.exists(os.path.join(self.path, filename)):
+                os.remove(os.path.join(self.path, filename))
+        self.thumbnails = {}
+        self.regions = {}
+
+    def includes(self, position):
+        '''
+        Check whether the work unit at the specified position (in enumeration order) is processed by this shard.
+        '''
+        return position % self.count == self.index - 1
+
+    def setThumbnail(self, axis, index, thumbnail):
+        self.thumbnails.setdefault(axis, {})[index] = thumbnail
+
+    def setRegions(self, axis, index, regions):
+        self.regions.setdefault(axis, []).append([index, regions])
+
+    def save(self, config, parameters, windows, ondemandSources):
+        arrays = {}
+        for (axis, thumbnails) in self.thumbnails.items():
+            arrays[f"{axis}_indexes"] = np.array(sorted(thumbnails), dtype=np.int64)
+            arrays[f"{axis}_thumbnails"] = np.stack([thumbnails[index] for index in sorted(thumbnails)])
+        tempFilepath = os.path.join(self.path, THUMBNAILS_FILENAME + '.tmp.npz')
+        np.savez(tempFilepath, **arrays)
+        os.replace(tempFilepath, os.path.join(self.path, THUMBNAILS_FILENAME))
+
+        fragment = {
+            'shard': self.index,
+            'count': self.count,
+            'timestamp': datetime.now().isoformat(),
+            'parameters': parameters,
+            'config': config,
+            'regions': self.regions,
+            'windows': windows,
+            'ondemand': ondemandSources
+        }
+        tempFilepath = os.path.join(self.path, FRAGMENT_FILENAME + '.tmp')
+        with open(tempFilepath, 'w') as fragmentFile:
+            json.dump(fragment, fragmentFile)
+        os.replace(tempFilepath, os.path.join(self.path, FRAGMENT_FILENAME))
+
+
+def loadShardFragments(output_path):
+    '''
+    Load the fragments of every shard of the last sharded import, after checking they are all present, and were made
+    from the same images with the same parameters. Return the fragments, ordered by shard.
+    '''
+    shardsPath = getShardsPath(output_path)
+    fragments = []
+    if os.path.isdir(shardsPath):
+        for entry in sorted(os.scandir(shardsPath), key=lambda entry: entry.name):
+            filepath = os.path.join(entry.path, FRAGMENT_FILENAME)
+            if entry.is_dir() and os.path.isfile(filepath):
+                with open(filepath, 'r') as fragmentFile:
+                    fragment = json.load(fragmentFile)
+                fragment['path'] = entry.path
+                fragments.append(fragment)
+    if not fragments:
+        message = f"No shard fragment found in : {shardsPath}"
+        logging.critical(message)
+        raise Exception(message)
+
+    counts = set(fragment['count'] for fragment in fragments)
+    if len(counts) > 1:
+        message = f"Fragments of imports with different numbers of shards ({', '.join(str(count) for count in sorted(counts))}) found in : {shardsPath}"
+        logging.critical(message)
+        raise Exception(message)
+    count = counts.pop()
+    missing = sorted(set(range(1, count + 1)) - set(fragment['shard'] for fragment in fragments))
+    if missing:
+        message = f"Missing fragment of shard(s) {', '.join(f'{index}/{count}' for index in missing)} (failed or still running)"
+        logging.critical(message)
+        raise Exception(message)
+
+    fragments = sorted(fragments, key=lambda fragment: fragment['shard'])
+    for fragment in fragments[1:]:
+        for key in ('config', 'parameters'):
+            if fragment[key] != fragments[0][key]:
+                message = f"Shard {fragment['shard']}/{count} was imported with a different {key} than shard 1/{count}"
+                logging.critical(message)
+                raise Exception(message)
+    return fragments
+
+
+def loadFragmentThumbnails(fragment):
+    '''
+    Return the subview thumbnails of a fragment, as dict of axis: (slice indexes, thumbnails).
+    '''
+    thumbnails = {}
+    with np.load(os.path.join(fragment['path'], THUMBNAILS_FILENAME)) as arrays:
+        for name in arrays.files:
+            if name.endswith('_indexes'):
+                axis = name[:-len('_indexes')]
+                thumbnails[axis] = (arrays[name], arrays[f"{axis}_thumbnails"])
+    return thumbnails
+
+
+def clearFragment(fragment):
+    # files of the shard folder which are not part of the fragment (e.g. import profile) are kept
+    for filename in (FRAGMENT_FILENAME, THUMBNAILS_FILENAME, MANIFEST_FILENAME):
+        if os.path.exists(os.path.join(fragment['path'], filename)):
+            os.remove(os.path.join(fragment['path'], filename))
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+import functools
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+import tifffile
+
+WINDOWS_FILENAME = 'intensity_windows.json'
+
+# percentiles of the layer intensities mapped to 0 and 255
+DEFAULT_PERCENTILES = (0.5, 99.5)
+
+# approximate number of pixels sampled in each slice
+SAMPLES_PER_SLICE = 1 << 16
+
+
+def needsWindowing(source):
+    '''
+    Check whether pixels of a TIFF slice must be windowed to fit in 8-bit tiles (more than 8 bits integer, or float values).
+    '''
+    with tifffile.TiffFile(source) as tiff:
+        page = tiff.pages[0]
+        if page.photometric == tifffile.PHOTOMETRIC.PALETTE:
+            return False
+        return page.dtype.kind in 'uif' and page.dtype != np.uint8
+
+
+def sampleIntensities(bands, width, height, sampleCount=SAMPLES_PER_SLICE):
+    '''
+    Sample pixel values of an image, provided as successive bands of rows, on a regular grid of about sampleCount pixels.
+    '''
+    step = max(1, int(np.sqrt(width * height / sampleCount)))
+    samples = []
+    y = 0
+    for band in bands:
+        # rows of the grid, in band coordinates
+        samples.append(np.asarray(band[(-y) % step::step, ::step]).ravel())
+        y += band.shape[0]
+    return np.concatenate(samples) if samples else np.zeros(0)
+
+
+def computeWindow(samples, percentiles=DEFAULT_PERCENTILES):
+    '''
+    Return intensity window (low, high) at the specified percentiles of the samples of every slices of a layer.
+    '''
+    samples = np.concatenate(samples)
+    samples = samples[np.isfinite(samples)] if samples.dtype.kind == 'f' else samples
+    if not samples.size:
+        return (0.0, 255.0)
+    (low, high) = np.percentile(samples, percentiles)
+    if high <= low:
+        high = low + 1
+    return (float(low), float(high))
+
+
+@functools.lru_cache(maxsize=8)
+def makeWindowLUT(dtype, low, high):
+    values = np.arange(np.iinfo(dtype).max + 1, dtype=np.float32)
+    return np.clip((values - low) * (255 / (high - low)) + 0.5, 0, 255).astype(np.uint8)
+
+
+def applyWindow(array, window):
+    '''
+    Map pixel values to 8-bit through the intensity window (low, high): lookup table for 8 and 16 bits unsigned integers,
+    vectorized scaling otherwise.
+    '''
+    (low, high) = window
+    if array.dtype.kind == 'u' and array.dtype.itemsize <= 2:
+        return makeWindowLUT(np.dtype(array.dtype.name), low, high)[array]
+    scaled = (array.astype(np.float32) - low) * (255 / (high - low)) + 0.5
+    return np.clip(np.nan_to_num(scaled), 0, 255).astype(np.uint8)
+
+
+def getSourcesDigest(sources):
+    # sources are (file info, crop) of every slices of the layer
+    return hashlib.blake2b(json.dumps(sources).encode('UTF-8'), digest_size=20).hexdigest()
+
+
+class IntensityWindows(object):
+    '''
+    Intensity windows of the layers, saved in the output folder along with the percentiles and the source slices they
+    were computed from, so they are not computed again while the slices of a layer have not changed.
+    '''
+
+    def __init__(self, output_path):
+        self.filepath = os.path.join(output_path, WINDOWS_FILENAME)
+        self.windows = {}
+        self.modified = False
+        if os.path.isfile(self.filepath):
+            try:
+                with open(self.filepath, 'r') as windowsFile:
+                    self.windows = json.load(windowsFile)
+            except ValueError:
+                logging.warning(f"Ignoring invalid intensity windows : {self.filepath}")
+
+    def get(self, key, percentiles, sourcesDigest):
+        entry = self.windows.get(key)
+        if entry is None or entry['percentiles'] != list(percentiles) or entry['sources'] != sourcesDigest:
+            return None
+        return tuple(entry['window'])
+
+    def set(self, key, percentiles, sourcesDigest, window):
+        self.windows[key] = {'percentiles': list(percentiles), 'sources': sourcesDigest, 'window': list(window)}
+        self.modified = True
+
+    def save(self):
+        if not self.modified:
+            return
+        with open(self.filepath, 'w') as windowsFile:
+            json.dump(self.windows, windowsFile, indent=2)
+        self.modified = False
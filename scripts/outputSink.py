@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+import concurrent.futures
+import os
+import shutil
+import threading
+import time
+
+# maximum number of writes waiting for a writer thread, beyond which the producer waits (limiting memory used by the
+# data of pending writes, e.g. 256 tiles of a few tens of KB)
+WRITE_QUEUE_SIZE = 256
+
+
+def writeFileData(path, data):
+    with open(path, 'wb') as outputFile:
+        outputFile.write(data)
+
+
+def linkFileData(target, path, data):
+    # file is written as a copy of the target when hard links are not supported by the file system
+    try:
+        os.link(target, path)
+    except OSError:
+        writeFileData(path, data)
+
+
+def replaceFolder(tempPath, path):
+    '''
+    Replace folder by the completely written temporary folder (a non empty folder can not be atomically replaced, so the
+    previous one is first moved aside, then deleted).
+    '''
+    if os.path.exists(path):
+        previousPath = path + '.old'
+        shutil.rmtree(previousPath, ignore_errors=True)
+        os.rename(path, previousPath)
+        os.rename(tempPath, path)
+        shutil.rmtree(previousPath, ignore_errors=True)
+    else:
+        os.rename(tempPath, path)
+
+
+class OutputSink(object):
+    '''
+    Write-behind output: writes are queued and performed by a pool of writer threads, so the calling thread (e.g.
+    encoding tiles) does not wait for the storage (e.g. network file system), unless the bounded queue is full.
+    Folders must exist before writes are queued (e.g. whole tiles folder tree created beforehand).
+    Error of any write is raised by the next queued write or by flush.
+
+    Number of files and bytes written, time spent by writer threads, time spent waiting for room in the queue, and
+    highest number of pending writes are accumulated in the stats attribute.
+    '''
+
+    def __init__(self, threads, queue_size=WRITE_QUEUE_SIZE):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.error = None
+        self.stats = {'files': 0, 'bytes_written': 0, 'writer_time': 0.0, 'queue_wait_time': 0.0, 'peak_queued': 0}
+
+    def writeFile(self, path, data):
+        '''
+        Queue writing of data to a new file, return the future of the write.
+        '''
+        self.stats['files'] += 1
+        self.stats['bytes_written'] += len(data)
+        return self.submit(writeFileData, path, data)
+
+    def linkFile(self, target, path, data, targetWrite=None):
+        '''
+        Queue creation of a hard link to a file (written with the same data), once its queued write is done.
+        '''
+        self.stats['files'] += 1
+        return self.submit(self.linkWritten, target, path, data, targetWrite)
+
+    def writeAt(self, fileno, data, offset):
+        '''
+        Queue writing of data at the specified offset of an open file (writes to distinct ranges may be concurrent).
+        '''
+        self.stats['bytes_written'] += len(data)
+        return self.submit(os.pwrite, fileno, data, offset)
+
+    def linkWritten(self, target, path, data, targetWrite):
+        if targetWrite is not None:
+            # writes are started in queue order, hence the target write is already running (or done)
+            targetWrite.result()
+        linkFileData(target, path, data)
+
+    def submit(self, function, *args):
+        self.raiseError()
+        start = time.perf_counter()
+        self.slots.acquire()
+        self.stats['queue_wait_time'] += time.perf_counter() - start
+        try:
+            future = self.executor.submit(self.run, function, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        with self.lock:
+            self.pending.add(future)
+            self.stats['peak_queued'] = max(self.stats['peak_queued'], len(self.pending))
+        future.add_done_callback(self.done)
+        return future
+
+    def run(self, function, *args):
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        except Exception as error:
+            with self.lock:
+                if self.error is None:
+                    self.error = error
+            raise
+        finally:
+            with self.lock:
+                self.stats['writer_time'] += time.perf_counter() - start
+            self.slots.release()
+
+    def done(self, future):
+        with self.lock:
+            self.pending.discard(future)
+
+    def raiseError(self):
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def flush(self):
+        '''
+        Wait until every queued write is done.
+        '''
+        with self.lock:
+            pending = list(self.pending)
+        concurrent.futures.wait(pending)
+        self.raiseError()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.executor.shutdown()
@@ -7,37 +7,99 @@ import logging
 
 import sys
 import os
-import tempfile
+import concurrent.futures
+import contextlib
 
-from shutil import copyfile
+from shutil import copyfile, rmtree
 import re
 from datetime import datetime
 import json
 import base64
+import math
+import time
 
 from progress.spinner import Spinner
 from progress.bar import Bar
 
-import SimpleITK as sitk
 import numpy as np
-
-import deepzoom
-import PIL
-# disable image size check, since input image are quite large, but trusted
-PIL.Image.MAX_IMAGE_PIXELS = None
-
-
-def createDeepZoomImage(source, output, format, quality):
+import tifffile
+
+import PIL.Image
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from dziTiler import DeepZoomTiler, TILE_CONTAINERS, LABELMAP_FORMATS, iterTiffRowBands
+from tileArchive import getArchivePath
+from importManifest import ImportManifest, MANIFEST_FILENAME, getFileInfo, getFileDigest
+from imageScan import ScanCache, SCAN_CACHE_FILENAME, scanImageFiles
+from importProfile import ImportProfile, getPeakMemory
+from subviewVolume import SubviewVolume, SUBVIEW_SIZE, makeSliceThumbnail
+from imageResize import makeThumbnail
+from tileRenderer import ONDEMAND_SOURCES_FILENAME
+from importShards import ShardFragment, parseShard, loadShardFragments, loadFragmentThumbnails, clearFragment
+from svgOptimizer import optimizeSVGFile, saveCompressedVariants, COMPRESSIONS
+from svgRasterizer import makeRegionLabels, saveColorTable, parseSVGShapes, iterLabelMapBands
+from regionIndex import RegionIndex, getSliceRegions, makeRegionsByAbb
+from sliceStack import SliceStack, openStackSlice, storeStackSlice, readStackLayout
+from volumeExport import LayerVolume, writeVolumeSlab
+from tileCompositor import createCompositeImage
+from outputSink import OutputSink
+from intensityWindow import (IntensityWindows, DEFAULT_PERCENTILES, needsWindowing, sampleIntensities, computeWindow,
+                             getSourcesDigest)
+
+
+def createDeepZoomImage(source, output, format, quality, crop=None, streaming=False, retain_size=None, container='files',
+                        stats=None, encode_threads=1, stacked=None, window=None, write_threads=0):
     # set up Deep Zoom Image creation parameters
-    creator = deepzoom.ImageCreator(
+    creator = DeepZoomTiler(
         tile_size=256,
         tile_overlap=1,
         tile_format=format,
         image_quality=quality,
-        resize_filter="antialias"
+        retain_size=retain_size,
+        tile_container=container,
+        encode_threads=encode_threads,
+        window=window,
+        write_threads=write_threads
     )
-    # Create Deep Zoom image pyramid from source
-    creator.create(source, output)
+    # Create Deep Zoom image pyramid from source (optionally cropped to the box (x, y, width, height))
+    if stacked is not None:
+        # source was already decoded and cropped in the slice stack, as (pixel array, TIFF colormap)
+        creator.createFromTiffArray(stacked[0], output, stacked[1])
+    elif streaming:
+        # source is read by strips of rows, hence never entirely loaded in memory
+        creator.createStreaming(source, output, crop)
+    else:
+        creator.create(source, output, crop)
+    # time spent in each step of the creation, tiles and bytes written
+    if stats is not None:
+        stats.update(creator.stats)
+    # smallest pyramid level larger than retain_size, if requested
+    return creator.retained
+
+
+def createLabelMapDeepZoomImage(source, output, format, labels, width, height, container='files', stats=None, encode_threads=1,
+                                write_threads=0, unknownRegionIds=None):
+    # label map tiles must be stored losslessly, and levels are downsampled without interpolation
+    creator = DeepZoomTiler(
+        tile_size=256,
+        tile_overlap=1,
+        tile_format=format,
+        tile_container=container,
+        encode_threads=encode_threads,
+        write_threads=write_threads
+    )
+    # Rasterize regions delineated in source SVG into a label map, by bands of rows fed to the pyramid creation
+    labelByRegion = {label: value for (value, label, _) in labels}
+    colors = np.array([color for (_, _, color) in labels], dtype=np.uint8)
+    shapes = parseSVGShapes(source, labelByRegion, width, height, unknownRegionIds)
+    creator.createFromRowBands(iterLabelMapBands(shapes, colors, width, height, creator.tile_size), width, height, output,
+                               isLabelMap=True)
+    if stats is not None:
+        stats.update(creator.stats)
 
 
 def createDeepZoomImages(input_path, output_path, format, quality):
@@ -54,45 +116,65 @@ def createDeepZoomImages(input_path, output_path, format, quality):
 # -----------------------------------------------------------------------------
 
 
-def changeSize(in_filename, out_filename, scale_factor=0.1, desired_size=None):
-
-    image = sitk.ReadImage(in_filename)
-    resample = sitk.ResampleImageFilter()
-    resample.SetInterpolator = sitk.sitkLinear
-    resample.SetOutputDirection = image.GetDirection()
-    resample.SetOutputOrigin = image.GetOrigin()
+def changeSize(in_filename, out_filename, scale_factor=0.1, desired_size=None, stats=None, crop=None, pad=True):
+    '''
+    Save downsized version of an image (optionally cropped to the box (x, y, width, height)), either to desired_size
+    (width, height), padded to preserve the aspect ratio unless pad is False, or scaled by scale_factor.
+    TIFF images are read by bands of rows, so they are never entirely loaded in memory.
+    Subview thumbnails of an import are not made by this function, but by the slice tasks (see processSliceImages and
+    processOnDemandSlice), which already process every slice concurrently.
+    '''
+    start = time.perf_counter()
+    if os.path.splitext(in_filename)[1].lower() in ('.tif', '.tiff'):
+        with tifffile.TiffFile(in_filename) as tiff:
+            page = tiff.pages[0]
+            (width, height) = (crop[2], crop[3]) if crop else (page.imagewidth, page.imagelength)
+        bands = iterTiffRowBands(in_filename, 256, crop)
+    else:
+        image = PIL.Image.open(in_filename)
+        if image.mode not in ('L', 'RGB', 'I', 'I;16', 'F'):
+            image = image.convert('RGB')
+        array = np.asarray(image)
+        if crop:
+            (cropX, cropY, width, height) = crop
+            array = array[cropY:cropY + height, cropX:cropX + width]
+        (height, width) = array.shape[:2]
+        bands = (array[y:y + 256] for y in range(0, height, 256))
 
-    orig_size = np.array(image.GetSize(), dtype=int)
-    orig_spacing = image.GetSpacing()
     # resize by final pixel or via scale factor
     if desired_size:
         new_size = desired_size
-        # might not preserve aspect-ratio to respect desired_size
-        new_spacing = (orig_spacing[0]*orig_size[0]/desired_size[0],
-                       orig_spacing[1]*orig_size[1]/desired_size[1])
     else:
-        new_size = orig_size*(scale_factor)
-        # Image dimensions are in integers
-        new_size = np.ceil(new_size).astype(np.int)
-        new_size = [int(s) for s in new_size]
-        new_spacing = (orig_spacing[0]/scale_factor,
-                       orig_spacing[1]/scale_factor)
-
-    resample.SetSize(new_size)
-    logging.info("Original image size: " + str(orig_size))
-    logging.info("New image size: " + str(new_size))
-    logging.info("Original image spacing: " + str(orig_spacing))
-    logging.info("New image spacing: " + str(new_spacing))
-    resample.SetOutputSpacing(new_spacing)
-
-    newimage = resample.Execute(image)
-
-    sitk.WriteImage(newimage, out_filename)
+        new_size = (math.ceil(width * scale_factor), math.ceil(height * scale_factor))
+        pad = False
+    logging.info(f"Original image size: {[width, height]}")
+    logging.info(f"New image size: {list(new_size)}")
+
+    # reading is interleaved with the area reduction
+    newimage = makeThumbnail(bands, width, height, new_size, pad)
+    resampled = time.perf_counter()
+
+    newimage.save(out_filename)
+
+    if stats is not None:
+        stats.update({
+            'bytes_read': os.path.getsize(in_filename),
+            'bytes_written': os.path.getsize(out_filename),
+            'resample_time': resampled - start,
+            'write_time': time.perf_counter() - resampled
+        })
 
 
 # -----------------------------------------------------------------------------
 AXIS = ('coronal', 'sagittal', 'axial')
 DELINEATION_RELPATH = "SVGs"
+COMPOSITE_DIRNAME = "composite"
+REGIONTREE_FILENAME = 'regionTree.json'
+
+# TODO for single plane mode, enable users to select preferred subview instead of predefined value
+PLANE_PREFSUBVIEW = {"axial": "coronal",
+                     "coronal": "sagittal",
+                     "sagittal": "axial"}
 
 
 def getCleanedAndCheckedPath(input_query, error_message, mount_path, default_path=None, interactive=True):
@@ -117,7 +199,7 @@ def getCleanedAndCheckedPath(input_query, error_message, mount_path, default_pat
         raise Exception(message)
 
 
-def getLayersNFiles(input_path, config, phys_unit):
+def getLayersNFiles(input_path, config, phys_unit, scan_cache=None):
 
     layersCompo = list()
     overlaysCompo = list()
@@ -194,54 +276,28 @@ def getLayersNFiles(input_path, config, phys_unit):
                 imageFile_re = re.compile(
                     '((?:.+_)?(\d+))(\.(?:tif))$', re.IGNORECASE)
                 imageEntries = [f for f in os.scandir(
-                    axis_layerpath) if f.is_file()]
+                    axis_layerpath) if f.is_file() and imageFile_re.match(f.name)]
                 bar = Bar(f"Reading images in layer {layer['name']} ", suffix='%(percent)d%%', max=len(
                     imageEntries)+1, check_tty=False)
                 bar.next()
 
-                for imageEntry in imageEntries:
-
-                    imageFile_search = imageFile_re.match(imageEntry.name)
-                    if imageFile_search:
-
-                        reader = sitk.ImageFileReader()
+                # only image headers are read (concurrently), or retrieved from cache when files have not changed
+                imageInfos = scanImageFiles(imageEntries, scan_cache, bar.next)
 
-                        reader.SetFileName(imageEntry.path)
-                        reader.LoadPrivateTagsOn()
+                for imageEntry, imageInfo in zip(imageEntries, imageInfos):
 
-                        reader.ReadImageInformation()
-
-                        # for k in reader.GetMetaDataKeys():
-                        #    v = reader.GetMetaData(k)
-                        #    print("({0}) = = \"{1}\"".format(k, v))
-
-                        # currently only expect 2D images
-                        # FIXME check it is actual 2D image
-                        # if reader.GetDepth()==0:
-                        # if reader.GetDimension()==2
-
-                        #
-                        # distance between pixels along each of the dimensions, in consistent, but not specified, units (nm, mm, m ?)
-                        spacing = reader.GetSpacing()
-                        # size in pixels along each of the dimensions
-                        size = reader.GetSize()
-
-                        # images should be aligned on their respective origin
-                        origin = reader.GetOrigin()
-                        # reader.GetDirection(): Direction cosine matrix (axis directions in physical space).
-
-                        images.append({
-                            'ordnum': imageFile_search.group(2),
-                            'shortname': imageFile_search.group(1),
-                            'ext': imageFile_search.group(3),
-                            'width': size[0],
-                            'height': size[1],
-                            'spacing': spacing,
-                            'origin': origin
-                        })
-                        image2D = None
+                    imageFile_search = imageFile_re.match(imageEntry.name)
 
-                    bar.next()
+                    # currently only expect 2D images
+                    images.append({
+                        'ordnum': imageFile_search.group(2),
+                        'shortname': imageFile_search.group(1),
+                        'ext': imageFile_search.group(3),
+                        'width': imageInfo['width'],
+                        'height': imageInfo['height'],
+                        'spacing': imageInfo['spacing'],
+                        'origin': imageInfo['origin']
+                    })
 
                 bar.finish()
 
@@ -263,7 +319,7 @@ def getLayersNFiles(input_path, config, phys_unit):
                 }
 
                 print(
-                    f"\t{len(images)} images(s) found in layer '{layer['name']}' [{size[0]}x{size[1]}]\n")
+                    f"\t{len(images)} images(s) found in layer '{layer['name']}' [{images[-1]['width']}x{images[-1]['height']}]\n")
 
             #
             axisLayersFiles['axis'][axis]['overlays'] = {}
@@ -298,6 +354,7 @@ def getLayersNFiles(input_path, config, phys_unit):
                 axisLayersFiles['axis'][axis]['overlays'][overlayName] = {
                     'name': overlayName,
                     'path': axis_overlaypath,
+                    'dirname': overlay['dirname'],
                     'safename': overlay['safename'],
                     'images': images
                 }
@@ -305,6 +362,9 @@ def getLayersNFiles(input_path, config, phys_unit):
                 # TODO check that same ordnums are used as in layers
                 # TODO check that same same number of overlay file as number of slice
 
+    if scan_cache:
+        scan_cache.save()
+
     # update config with layer composition
     config['data'] = {}
     for layer in layersCompo:
@@ -355,12 +415,283 @@ def getLayersNFiles(input_path, config, phys_unit):
     return axisLayersFiles
 
 
-def prepareImages(axisLayersFiles, config, ouput_path, phys_unit, format, quality):
+def countUnknownRegions(unknownRegions, result):
+    # regions missing from the region information are counted by overlay file, to be reported once for all of them
+    for regionId in result.get('unknown_regions', ()):
+        unknownRegions[regionId] = unknownRegions.get(regionId, 0) + 1
+
+
+def logUnknownRegions(unknownRegions, what):
+    if unknownRegions:
+        regions = ', '.join(f"{regionId} ({count})" for (regionId, count) in sorted(unknownRegions.items())[:20])
+        if len(unknownRegions) > 20:
+            regions += ', ...'
+        logging.warning(f"{len(unknownRegions)} region(s) not found in region information, ignored while {what} "
+                        f"(number of overlay files) : {regions}")
+
+
+def removeOtherTileContainer(output, container):
+    '''
+    Remove tiles of a slice previously generated in the other tile container, once its new tiles are complete (tiles
+    previously generated in the same container are replaced as a whole, so they remain valid until then).
+    '''
+    if container == 'archive':
+        rmtree(os.path.splitext(output)[0] + '_files', ignore_errors=True)
+    elif os.path.exists(getArchivePath(output)):
+        os.remove(getArchivePath(output))
+
+
+def processSliceImages(task):
+    '''
+    Create DeepZoom image of a single slice (cropped if required), and its thumbnail for the subview volume when needed.
+    This is the unit of work dispatched to worker processes, hence it must not rely on any shared state.
+    '''
+    start = time.perf_counter()
+    source = task['source']
+    # source info is retrieved beforehand, so any later modification will be detected on next import
+    sourceInfo = getFileInfo(source)
+    stats = {'width': task['width'], 'height': task['height'], 'bytes_read': sourceInfo['size'], 'stack_time': 0.0}
+
+    # slice is decoded once in the slice stack (when enabled), and later read from there while its source is unchanged
+    stack = task['stack']
+    stacked = None
+    if stack is not None:
+        if stack['stored']:
+            array = openStackSlice(stack)
+            sourceInfo = stack['stored']['source']
+            stats['bytes_read'] = array.nbytes
+        else:
+            stackStart = time.perf_counter()
+            array = storeStackSlice(stack, source, task['crop'])
+            stats['stack_time'] = time.perf_counter() - stackStart
+        stacked = (array, stack['colormap'])
+
+    # create actual DeepZoom image for the slice, cropping is directly performed on the decoded source
+    levelImage = createDeepZoomImage(source, task['output'], task['format'], task['quality'], task['crop'], task['streaming'],
+                                     retain_size=[SUBVIEW_SIZE, SUBVIEW_SIZE] if task['thumbnail'] else None,
+                                     container=task['container'], stats=stats, encode_threads=task['encode_threads'],
+                                     stacked=stacked, window=task['window'], write_threads=task['write_threads'])
+    removeOtherTileContainer(task['output'], task['container'])
+
+    subviewStart = time.perf_counter()
+    # thumbnail is derived from a coarse level of the pyramid, instead of decoding the source again
+    thumbnail = makeSliceThumbnail(levelImage) if task['thumbnail'] else None
+
+    hashStart = time.perf_counter()
+    if 'hash' not in sourceInfo:
+        sourceInfo['hash'] = getFileDigest(source)
+        stats['bytes_read'] += sourceInfo['size']
+
+    end = time.perf_counter()
+    stats.update({
+        'subview_time': hashStart - subviewStart,
+        'hash_time': end - hashStart,
+        'wall_time': end - start,
+        # peak memory of the process which handled the slice (so far)
+        'peak_rss': getPeakMemory()
+    })
+    return {'source': sourceInfo, 'stats': stats, 'thumbnail': thumbnail,
+            'stacked': stack is not None and not stack['stored']}
+
+
+def processOnDemandSlice(task):
+    '''
+    Prepare a single slice whose tiles are rendered on demand by the tile server: only its Deep Zoom descriptor is
+    written, along with its thumbnail for the subview volume when needed.
+    '''
+    start = time.perf_counter()
+    source = task['source']
+    sourceInfo = getFileInfo(source)
+    stats = dict({counter: 0 for counter in ('bytes_read', 'tiles', 'bytes_written', 'duplicate_tiles', 'duplicate_bytes')},
+                 **{f"{stage}_time": 0.0 for stage in ('read', 'resample', 'encode', 'write', 'writer', 'queue_wait', 'stack',
+                                                       'subview', 'hash')},
+                 width=task['width'], height=task['height'])
+
+    # previously generated tiles would be served instead of the rendered ones
+    for previousOutput in (task['output'], getArchivePath(task['output'])):
+        if os.path.exists(previousOutput):
+            os.remove(previousOutput)
+    rmtree(os.path.splitext(task['output'])[0] + '_files', ignore_errors=True)
+    DeepZoomTiler(tile_format=task['format']).writeDescriptor(task['output'], task['width'], task['height'])
+
+    thumbnail = None
+    if task['thumbnail']:
+        subviewStart = time.perf_counter()
+        bands = iterTiffRowBands(source, 256, task['crop'])
+        # stretched as the thumbnails derived from the pyramid (see makeSliceThumbnail)
+        thumbnail = makeThumbnail(bands, task['width'], task['height'], (SUBVIEW_SIZE, SUBVIEW_SIZE), pad=False,
+                                  window=task['window'])
+        thumbnail = np.asarray(thumbnail.convert('RGB'))
+        stats['bytes_read'] = sourceInfo['size']
+        stats['subview_time'] = time.perf_counter() - subviewStart
+
+    stats.update({'wall_time': time.perf_counter() - start, 'peak_rss': getPeakMemory()})
+    return {'source': sourceInfo, 'stats': stats, 'thumbnail': thumbnail, 'stacked': False}
+
+
+def processIntensitySamples(task):
+    '''
+    Sample pixel values of a single slice (cropped if required), to compute the intensity window of its layer.
+    '''
+    bands = iterTiffRowBands(task['source'], 256, task['crop'])
+    return {'samples': sampleIntensities(bands, task['width'], task['height'])}
+
+
+def processVolumeSlab(task):
+    '''
+    Export a slab of slices (as deep as the volume chunks) of a layer volume, at every resolution level.
+    '''
+    stats = writeVolumeSlab(task['path'], task['index'], task['sources'], task['levels'], np.dtype(task['dtype']),
+                            task['samples'], task['pick'])
+    return {'stats': stats}
+
+
+def processOverlayImage(task):
+    '''
+    Copy overlay SVG of a single slice to the output folder, optimized and pre-compressed when required, and retrieve the
+    regions it delineates when required.
+    '''
+    source = task['source']
+    sourceInfo = getFileInfo(source)
+    # remove pre-compressed variants generated by a previous import, which are not requested anymore
+    for extension in COMPRESSIONS:
+        if extension not in task['compressions'] and os.path.exists(f"{task['output']}.{extension}"):
+            os.remove(f"{task['output']}.{extension}")
+    if task['optimize']:
+        stats = optimizeSVGFile(source, task['output'], task['precision'], True, task['compressions'])
+    else:
+        copyfile(source, task['output'])
+        stats = {'bytes_read': sourceInfo['size'], 'bytes_written': sourceInfo['size']}
+        if task['compressions']:
+            with open(task['output'], 'rb') as outputFile:
+                stats.update(saveCompressedVariants(task['output'], outputFile.read(), task['compressions']))
+    if task['regions'] is None:
+        return {'source': sourceInfo, 'stats': stats}
+
+    start = time.perf_counter()
+    unknownRegionIds = set()
+    regions = getSliceRegions(source, task['regions'], task['width'], task['height'], unknownRegionIds)
+    stats['index_time'] = time.perf_counter() - start
+    return {'source': sourceInfo, 'stats': stats, 'regions': regions, 'unknown_regions': sorted(unknownRegionIds)}
+
+
+def processLabelMapImage(task):
+    '''
+    Create DeepZoom label map image of a single slice from its overlay SVG.
+    '''
+    source = task['source']
+    sourceInfo = getFileInfo(source)
+    stats = {}
+    unknownRegionIds = set()
+    createLabelMapDeepZoomImage(source, task['output'], task['format'], task['labels'], task['width'], task['height'],
+                                task['container'], stats, task['encode_threads'], task['write_threads'], unknownRegionIds)
+    removeOtherTileContainer(task['output'], task['container'])
+    return {'source': sourceInfo, 'stats': stats, 'unknown_regions': sorted(unknownRegionIds)}
+
+
+def processCompositeImage(task):
+    '''
+    Create DeepZoom image of a single slice blending the slices of several layers with their opacities.
+    '''
+    sourceInfo = getFileInfo(task['source'])
+    stats = createCompositeImage(task['slices'], task['opacities'], task['output'], task['format'], task['quality'],
+                                 task['container'], task['encode_threads'], task['write_threads'])
+    removeOtherTileContainer(task['output'], task['container'])
+    return {'source': sourceInfo, 'stats': stats}
+
+
+# worker processes shared by successive imports when running in batch mode (see runBatchImport)
+sharedExecutor = None
+
+
+def runSliceTasks(tasks, jobs, onSuccess=None, worker=processSliceImages, title='Processing slices images... '):
+    '''
+    Process slice tasks, concurrently when more than 1 job is requested.
+    Failure of a slice does not prevent other slices from being processed; failed tasks are returned with their error.
+    onSuccess callback is invoked (in the calling process) with the task and its result as soon as a task is completed.
+    '''
+    failures = []
+
+    bar = Bar(title, suffix='%(index)d/%(max)d - %(percent)d%%', max=len(tasks), check_tty=False)
+
+    def reportFailure(task, error):
+        message = f"Failed to process slice #{task['index']} of layer '{task['layer']}' ({task['axis']}) from {task['source']} : {error}"
+        logging.error(message)
+        failures.append((task, error))
+
+    if jobs <= 1:
+        for task in tasks:
+            try:
+                result = worker(task)
+            except Exception as error:
+                reportFailure(task, error)
+            else:
+                if onSuccess:
+                    onSuccess(task, result)
+            bar.next()
+    else:
+        # pool of worker processes is shared by the imports of a batch
+        pool = contextlib.nullcontext(sharedExecutor) if sharedExecutor else concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+        with pool as executor:
+            futures = {executor.submit(worker, task): task for task in tasks}
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    error = future.exception()
+                    if error:
+                        reportFailure(futures[future], error)
+                    elif onSuccess:
+                        onSuccess(futures[future], future.result())
+                    bar.next()
+            except KeyboardInterrupt:
+                # do not wait for pending slices when the user stops the import
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+
+    bar.finish()
+    return failures
+
+
+def getLayerWindow(axis, layerName, layer, intensityWindows, percentiles, jobs):
+    '''
+    Return intensity window of the layer, computed from the pixel values sampled in every (cropped) slices of the layer,
+    or reused when the slices have not changed since it was computed.
+    '''
+    sampleTasks = []
+    sources = []
+    for index, image in enumerate(layer['images']):
+        source = os.path.join(layer['path'], image['shortname'] + image['ext'])
+        sources.append([getFileInfo(source), list(image['crop']) if image['crop'] else None])
+        sampleTasks.append({
+            'axis': axis,
+            'layer': layerName,
+            'index': index,
+            'source': source,
+            'crop': image['crop'],
+            'width': image['final_width'],
+            'height': image['final_height']
+        })
+    key = f"{layer['safename']}/{axis}"
+    sourcesDigest = getSourcesDigest(sources)
+    window = intensityWindows.get(key, percentiles, sourcesDigest)
+    if window:
+        return window
+
+    samples = []
+    failures = runSliceTasks(sampleTasks, jobs, lambda task, result: samples.append(result['samples']),
+                             processIntensitySamples, 'Sampling intensities... ')
+    if failures:
+        message = f"{len(failures)} slice image(s) of layer '{layerName}' could not be sampled (see errors above)"
+        logging.critical(message)
+        raise Exception(message)
+    window = computeWindow(samples, percentiles)
+    intensityWindows.set(key, percentiles, sourcesDigest, window)
+    return window
 
-    # TODO for single plane mode, enable users to select preferred subview instead of predefined value
-    PLANE_PREFSUBVIEW = {"axial": "coronal",
-                         "coronal": "sagittal",
-                         "sagittal": "axial"}
+
+def prepareImages(axisLayersFiles, config, ouput_path, phys_unit, format, quality, jobs=1, streaming=False, manifest=None,
+                  container='files', profile=None, encode_threads=1, svg_precision=None, svg_compressions=(), region_tree=None, labelmaps=False,
+                  stack_path=None, window_percentiles=DEFAULT_PERCENTILES, ondemand=False, shard=None, volumes=False,
+                  composite=None, write_threads=0, region_index=False):
 
     print('Preparing images...')
 
@@ -374,19 +705,70 @@ def prepareImages(axisLayersFiles, config, ouput_path, phys_unit, format, qualit
 
     isMultiPlane = len(axisLayersFiles['axis'].keys()) > 1
 
-    # all othogonal planes to existing slice axis, i.e. planes for which subview has to be prepared
-    requiredOrthogPlanes = axisLayersFiles['axis'].keys() if isMultiPlane else [
-        PLANE_PREFSUBVIEW[axis] for axis in axisLayersFiles['axis'].keys()]
-    # when there is not slice provided to populate a subview, use default image
-    subviewToDefault = [
-        plane for plane in requiredOrthogPlanes if plane not in axisLayersFiles['axis']]
+    if manifest is None:
+        manifest = ImportManifest(ouput_path, enabled=False)
+    if profile is None:
+        profile = ImportProfile(ouput_path, enabled=False)
+
+    # slices of every layers and axis are collected first, to be then processed together (possibly concurrently)
+    sliceTasks = []
+    overlayTasks = []
+    upToDateCount = 0
+
+    # overlays are rasterized as label map layers when the regions (which labels are made from) are specified
+    labelMapTasks = []
+    if labelmaps:
+        if format not in LABELMAP_FORMATS:
+            # tile format is the same for all layers in the viewer
+            message = f"Overlay label maps require a lossless tile format ({', '.join(LABELMAP_FORMATS)}), not {format}"
+            logging.critical(message)
+            raise Exception(message)
+        labels = makeRegionLabels(region_tree)
+        labelsDigest = getFileDigest(region_tree)
+
+    # overlays are optimized when a coordinates precision is specified, and possibly pre-compressed
+    optimizeOverlays = svg_precision is not None
+    overlayParams = {'precision': svg_precision, 'compressions': list(svg_compressions)} if optimizeOverlays or svg_compressions else {}
+
+    # regions delineated in overlays are indexed by slice (when requested), the index being updated with the overlays
+    # processed again
+    regionIndex = None
+    if region_tree and region_index:
+        regionIndex = RegionIndex(ouput_path, region_tree)
+        regionsByAbb = makeRegionsByAbb(region_tree)
+
+    # subview images are derived from low resolution volumes of the reference layer, stacked along each axis
+    subviewVolumes = {}
+    # decoded slices of each layer and axis, when kept in memory-mapped stacks
+    sliceStacks = {}
+    # layers with more than 8 bits per sample are mapped to 8-bit through a window computed on all their slices
+    intensityWindows = IntensityWindows(ouput_path)
+    # intensity window of each layer and axis (None for 8-bit layers), as used to tile their slices
+    layerWindows = {}
+    # slices whose tiles are rendered on demand by the tile server, by path of their descriptor
+    ondemandSources = {}
+    # position of the current (axis, layer, slice) work unit, when only the units of a shard are processed
+    unitPosition = -1
+    # slices of each layer along the reference axis are also exported as multi-resolution volumes, by slabs of slices
+    layerVolumes = {}
+    volumeTasks = []
+    if volumes and shard:
+        logging.warning("Volumes are not exported by sharded imports, run an import without --shard to export them")
+
+    # layers blended in the composite layer, with their opacity
+    compositeLayers = None
+    if composite is not None:
+        if ondemand or shard:
+            # composite tiles are made from the tiles of every layers of a slice
+            logging.warning("Composite layer is not generated when tiles are rendered on demand, or by sharded imports")
+        else:
+            compositeLayers = getCompositeLayers(composite, axisLayersFiles['axis'][referenceAxis]['layers'])
 
     for axis in axisLayersFiles['axis'].keys():
 
         print(f"\t{axis}")
-        subviewBasePath = os.path.join(
-            ouput_path, config['subview']['foldername'])
-        os.makedirs(subviewBasePath, exist_ok=True)
+        subviewVolume = subviewVolumes[axis] = SubviewVolume(
+            axis, len(axisLayersFiles['axis'][axis]['layers'][referenceLayerName]['images']), ouput_path)
 
         for layerName, layer in axisLayersFiles['axis'][axis]['layers'].items():
             print(f"\t\t{layerName}")
@@ -401,10 +783,6 @@ def prepareImages(axisLayersFiles, config, ouput_path, phys_unit, format, qualit
             nbImages = len(layer['images'])
             centerImageIndex = nbImages // 2
 
-            bar = Bar('Processing slices images... ', suffix='%(percent)d%%', max=nbImages *
-                      (2 if layerName == referenceLayerName else 1) + 1, check_tty=False)
-            bar.next()
-
             # image are assumed to:
             #  * have same spacing values,
             #  * be aligned on their registered origin,
@@ -414,82 +792,125 @@ def prepareImages(axisLayersFiles, config, ouput_path, phys_unit, format, qualit
                 cropWidth = int(min(image['width'] - image['origin'][0], cropWidth))
                 cropHeigth = int(min(image['height'] - image['origin'][1], cropHeigth))
 
+            for image in layer['images']:
+                needsCropping = (image['width'] - image['origin'][0] > cropWidth) or (image['height'] - image['origin'][1] > cropHeigth)
+                if needsCropping:
+                    image['crop'] = (int(image['origin'][0]), int(image['origin'][1]), cropWidth, cropHeigth)
+                    image['final_width'] = cropWidth
+                    image['final_height'] = cropHeigth
+                else:
+                    image['crop'] = None
+                    image['final_width'] = image['width']
+                    image['final_height'] = image['height']
+
+            window = None
+            firstImage = layer['images'][0]
+            if needsWindowing(os.path.join(layer['path'], firstImage['shortname'] + firstImage['ext'])):
+                with profile.stage('windows'):
+                    window = getLayerWindow(axis, layerName, layer, intensityWindows, window_percentiles, jobs)
+                print(f"\t\t\tintensity window : [{window[0]:g}, {window[1]:g}]")
+            layerWindows[(axis, layerName)] = window
+
+            sliceStack = None
+            if stack_path:
+                # every shard has its own stacks, with the slices it processes only
+                sliceStack = sliceStacks[(axis, layerName)] = SliceStack(
+                    os.path.join(stack_path, os.path.basename(shard.path)) if shard else stack_path, layer['safename'], axis,
+                    os.path.join(layer['path'], firstImage['shortname'] + firstImage['ext']), nbImages,
+                    max(image['final_width'] for image in layer['images']),
+                    max(image['final_height'] for image in layer['images']),
+                    firstImage['spacing'])
+
+            if volumes and not shard and axis == referenceAxis:
+                layerVolume = layerVolumes[layerName] = LayerVolume(
+                    ouput_path, layerName, layer['safename'], axis, nbImages,
+                    max(image['final_width'] for image in layer['images']),
+                    max(image['final_height'] for image in layer['images']),
+                    readStackLayout(os.path.join(layer['path'], firstImage['shortname'] + firstImage['ext'])),
+                    firstImage['spacing'], config.get(f"{axis}_slice_step", config.get('slice_step', 1)), phys_unit, window)
+                sources = [(os.path.join(layer['path'], image['shortname'] + image['ext']), image['crop'])
+                           for image in layer['images']]
+                for slab in layerVolume.getSlabTasks(sources):
+                    volumeTasks.append({
+                        'axis': axis,
+                        'layer': layerName,
+                        'index': slab['slab'],
+                        'source': slab['sources'][0][0],
+                        'sources': slab['sources'],
+                        'digest': slab['digest'],
+                        'path': layerVolume.path,
+                        'levels': layerVolume.layout['levels'],
+                        'dtype': layerVolume.layout['dtype'],
+                        'samples': layerVolume.layout['samples'],
+                        'pick': layerVolume.attributes['zaviewer']['colormap'] is not None
+                    })
+
             for index, image in enumerate(layer['images']):
 
                 # create DeepZoom image for the slice
                 source = os.path.join(
                     layer['path'], image['shortname'] + image['ext'])
                 output = os.path.join(layer_ouputpath, str(index) + '.dzi')
-
-                #
-                with tempfile.TemporaryDirectory() as tmpDir:
-                    needsCropping = (image['width'] - image['origin'][0] > cropWidth) or (image['height'] - image['origin'][1] > cropHeigth)
-                    if needsCropping:
-                        # create temporary cropped image
-                        tempImgPath = os.path.join(tmpDir, 'croppedImg' + image['ext'])
-                        image2D = sitk.ReadImage(source)
-
-                        # extract subregion using ExtractImageFilter
-                        extract = sitk.ExtractImageFilter()
-                        extract.SetSize([cropWidth, cropHeigth])
-                        extract.SetIndex([int(image['origin'][0]), int(image['origin'][1])])
-                        croppedImg = extract.Execute(image2D)
-                        sitk.WriteImage(croppedImg, tempImgPath)
-                        source = tempImgPath
-
-                        image['final_width'] = cropWidth
-                        image['final_height'] = cropHeigth
-                    else:
-                        image['final_width'] = image['width']
-                        image['final_height'] = image['height']
-
-                    # create actual DeepZoom image for the slice
-                    createDeepZoomImage(source, output, format, quality)
-
-                bar.next()
-
-                # subview images are create from reference layer
-                if layerName == referenceLayerName:
-
-                    # create subview image(s) because current axis is used as subview for another axis
-                    # FIXME works only if current axis and its orthogonal plane have same number of slices!
-                    if axis in requiredOrthogPlanes:
-
-                        if isMultiPlane or index == centerImageIndex:
-
-                            # in single plane mode, only 1 image for the subview, but one for each slice in multiplane
-                            subviewPath = os.path.join(
-                                subviewBasePath, axis) if isMultiPlane else subviewBasePath
-                            os.makedirs(subviewPath, exist_ok=True)
-
-                            subviewImageFile = os.path.join(
-                                subviewPath, (str(index) if isMultiPlane else 'subview') + '.jpg')
-                            changeSize(
-                                os.path.join(
-                                    layer['path'], image['shortname'] + image['ext']),
-                                subviewImageFile,
-                                desired_size=[200, 200])
-
-                    # current axis' subview can not be generated, use default image instead
-                    orthogplane = PLANE_PREFSUBVIEW[axis]
-                    if orthogplane in subviewToDefault:
-                        if isMultiPlane or index == centerImageIndex:
-
-                            defaultSubview = os.path.join(os.path.dirname(
-                                __file__), 'assets', 'subview_' + orthogplane + '.jpg')
-
-                            subviewPath = os.path.join(
-                                subviewBasePath, orthogplane) if isMultiPlane else subviewBasePath
-                            os.makedirs(subviewPath, exist_ok=True)
-
-                            subviewImageFile = os.path.join(
-                                subviewPath, (str(index) if isMultiPlane else 'subview') + '.jpg')
-
-                            # copy SVG to output dir
-                            copyfile(defaultSubview, subviewImageFile)
-
-                    bar.next()
-            bar.finish()
+                crop = image['crop']
+                unitPosition += 1
+                if shard and not shard.includes(unitPosition):
+                    continue
+
+                # reference layer slices are needed to build the subview volume, unless it is reused from a previous import
+                thumbnail = layerName == referenceLayerName
+
+                # parameters which the generated images depend on
+                params = {
+                    'format': format,
+                    'quality': quality,
+                    'crop': list(crop) if crop else None,
+                    'tile_size': 256,
+                    'tile_overlap': 1,
+                    'container': container,
+                    'thumbnail': thumbnail,
+                    'window': list(window) if window else None
+                }
+                if ondemand:
+                    params['ondemand'] = True
+                    ondemandSources[os.path.relpath(output, ouput_path).replace(os.sep, '/')] = {
+                        'source': os.path.abspath(source),
+                        'crop': list(crop) if crop else None,
+                        'width': image['final_width'],
+                        'height': image['final_height'],
+                        'format': format,
+                        'quality': quality,
+                        'window': list(window) if window else None,
+                        'colormap': readStackLayout(source)[2]
+                    }
+                if (not thumbnail or subviewVolume.reused) and manifest.isUpToDate(output, source, params):
+                    upToDateCount += 1
+                    continue
+
+                stack = None
+                if sliceStack:
+                    stack = sliceStack.getSliceTask(index, image['final_width'], image['final_height'])
+                    stack['stored'] = sliceStack.getStoredSlice(index, source, crop)
+
+                sliceTasks.append({
+                    'axis': axis,
+                    'layer': layerName,
+                    'index': index,
+                    'source': source,
+                    'output': output,
+                    'crop': crop,
+                    'width': image['final_width'],
+                    'height': image['final_height'],
+                    'format': format,
+                    'quality': quality,
+                    'streaming': streaming,
+                    'container': container,
+                    'encode_threads': encode_threads,
+                    'write_threads': write_threads,
+                    'thumbnail': thumbnail,
+                    'stack': stack,
+                    'window': window,
+                    'params': params
+                })
 
         if 'first_access' not in config:
             config['first_access'] = {
@@ -510,21 +931,212 @@ def prepareImages(axisLayersFiles, config, ouput_path, phys_unit, format, qualit
 
             os.makedirs(overlay_ouputpath, exist_ok=True)
 
-            # TODO check SVG conformance
-            nbImages = len(overlay['images'])
-
-            bar = Bar('Processing overlay images... ', suffix='%(percent)d%%', max=nbImages, check_tty=False)
+            # overlays are stretched over the slices of the reference layer
+            referenceImages = axisLayersFiles['axis'][axis]['layers'][referenceLayerName]['images']
+            if regionIndex:
+                regionIndex.setSliceCount(axis, len(referenceImages))
 
+            # TODO check SVG conformance
             for index, image in enumerate(overlay['images']):
-                bar.next()
                 source = os.path.join(
                     overlay['path'], image['shortname'] + image['ext'])
                 output = os.path.join(
                     overlay_ouputpath, 'Anno_' + str(index) + image['ext'])
-                # copy SVG to output dir
-                copyfile(source, output)
+                compressedOutputs = [f"{output}.{extension}" for extension in svg_compressions]
+                indexRegions = regionIndex is not None and index < len(referenceImages)
+                unitPosition += 1
+                if shard and not shard.includes(unitPosition):
+                    continue
+                if (not manifest.isUpToDate(output, source, overlayParams, compressedOutputs)
+                        or (indexRegions and not regionIndex.hasSlice(axis, index))):
+                    overlayTasks.append({
+                        'axis': axis,
+                        'layer': overlayName,
+                        'index': index,
+                        'source': source,
+                        'output': output,
+                        'optimize': optimizeOverlays,
+                        'precision': svg_precision,
+                        'compressions': list(svg_compressions),
+                        'regions': regionsByAbb if indexRegions else None,
+                        'width': referenceImages[index]['final_width'] if indexRegions else None,
+                        'height': referenceImages[index]['final_height'] if indexRegions else None,
+                        'params': overlayParams
+                    })
+
+            if labelmaps:
+                # label map is an additional layer, on top of the image layers
+                labelMapDirname = 'labelmap_' + overlay['dirname']
+                labelMapSafename = base64.urlsafe_b64encode(labelMapDirname.encode('UTF-8')).decode('UTF-8')
+                labelMap_ouputpath = os.path.join(ouput_path, labelMapSafename)
+                os.makedirs(labelMap_ouputpath, exist_ok=True)
+                colorTable = os.path.join(labelMapSafename, 'labelmap.ctbl')
+                saveColorTable(os.path.join(ouput_path, colorTable), labels)
+                config['data'][labelMapSafename] = {
+                    "metadata": f"{overlayName} (label map)",
+                    "colortable": colorTable
+                }
+                if isMultiPlane:
+                    labelMap_ouputpath = os.path.join(labelMap_ouputpath, axis)
+                    os.makedirs(labelMap_ouputpath, exist_ok=True)
+
+                # label maps have the same size as the slices of the reference layer
+                for index, image in enumerate(overlay['images'][:len(referenceImages)]):
+                    source = os.path.join(overlay['path'], image['shortname'] + image['ext'])
+                    output = os.path.join(labelMap_ouputpath, str(index) + '.dzi')
+                    (width, height) = (referenceImages[index]['final_width'], referenceImages[index]['final_height'])
+                    unitPosition += 1
+                    if shard and not shard.includes(unitPosition):
+                        continue
+                    params = {
+                        'format': format,
+                        'width': width,
+                        'height': height,
+                        'tile_size': 256,
+                        'tile_overlap': 1,
+                        'container': container,
+                        'labels': labelsDigest
+                    }
+                    if manifest.isUpToDate(output, source, params):
+                        continue
+                    labelMapTasks.append({
+                        'axis': axis,
+                        'layer': labelMapDirname,
+                        'index': index,
+                        'source': source,
+                        'output': output,
+                        'format': format,
+                        'width': width,
+                        'height': height,
+                        'labels': labels,
+                        'container': container,
+                        'encode_threads': encode_threads,
+                        'write_threads': write_threads,
+                        'params': params
+                    })
+
+    # copy (or optimize) overlay SVG files to output dir
+    overlayStats = {}
+    unknownRegions = {}
+
+    def recordOverlay(task, result):
+        manifest.record(task['output'], result['source'], task['params'])
+        countUnknownRegions(unknownRegions, result)
+        if 'regions' in result and shard:
+            shard.setRegions(task['axis'], task['index'], result['regions'])
+        elif 'regions' in result:
+            regionIndex.setSlice(task['axis'], task['index'], result['regions'])
+        for (counter, value) in result['stats'].items():
+            overlayStats[counter] = overlayStats.get(counter, 0) + value
+
+    # overlays which could not be processed do not stop the import of the slices, they are only reported once every slice
+    # is processed (and processed again on next import, since they are not recorded in the manifest)
+    unprocessed = []
+    with profile.stage('overlays') as stage:
+        failures = runSliceTasks(overlayTasks, jobs, recordOverlay, processOverlayImage, 'Processing overlay images... ')
+        stage.update(overlayStats)
+    logUnknownRegions(unknownRegions, 'indexing regions')
+    if regionIndex and not shard:
+        regionIndex.save()
+    if failures:
+        unprocessed.append(f"{len(failures)} overlay image(s)")
+    if overlayParams and overlayStats:
+        print(f"\tOverlay images : {overlayStats['bytes_read'] / 1024:.0f} KB in source files, {overlayStats['bytes_written'] / 1024:.0f} KB in output"
+              + ''.join(f", {overlayStats['bytes_' + extension] / 1024:.0f} KB once compressed as .{extension}"
+                        for extension in svg_compressions)
+              + (f" ({overlayStats['merged_paths']} path(s) merged)" if optimizeOverlays else ''))
+
+    unknownRegions = {}
+
+    def recordLabelMap(task, result):
+        manifest.record(task['output'], result['source'], task['params'])
+        countUnknownRegions(unknownRegions, result)
+        profile.timer.add('labelmaps', tiles=result['stats']['tiles'], bytes_written=result['stats']['bytes_written'])
+
+    if labelMapTasks:
+        with profile.stage('labelmaps'):
+            failures = runSliceTasks(labelMapTasks, jobs, recordLabelMap, processLabelMapImage, 'Rasterizing overlay images... ')
+        logUnknownRegions(unknownRegions, 'rasterizing label maps')
+        if failures:
+            unprocessed.append(f"{len(failures)} overlay label map(s)")
+
+    if upToDateCount:
+        print(f"{upToDateCount} slice image(s) already up-to-date, skipped.")
+    print(f"Processing {len(sliceTasks)} slice image(s) using {jobs} job(s)...")
+
+    # uniform tiles (e.g. background) stored only once, by layer
+    duplicatesByLayer = {}
+
+    def recordSlice(task, result):
+        if result['thumbnail'] is not None and shard:
+            shard.setThumbnail(task['axis'], task['index'], result['thumbnail'])
+        elif result['thumbnail'] is not None:
+            subviewVolumes[task['axis']].setSlice(task['index'], result['thumbnail'])
+        manifest.record(task['output'], result['source'], task['params'])
+        if result['stacked']:
+            sliceStacks[(task['axis'], task['layer'])].setSlice(task['index'], result['source'], task['crop'])
+        profile.recordSlice(task, result['stats'])
+        duplicates = duplicatesByLayer.setdefault(task['layer'], {'tiles': 0, 'bytes': 0})
+        duplicates['tiles'] += result['stats']['duplicate_tiles']
+        duplicates['bytes'] += result['stats']['duplicate_bytes']
+
+    with profile.stage('tiling'):
+        failures = runSliceTasks(sliceTasks, jobs, recordSlice, processOnDemandSlice if ondemand else processSliceImages)
+
+    if not shard:
+        saveOnDemandSources(ouput_path, ondemandSources if ondemand else None)
+
+    for layerName, duplicates in duplicatesByLayer.items():
+        if not duplicates['tiles']:
+            continue
+        print(f"\t{duplicates['tiles']} uniform tile(s) stored as duplicates in layer '{layerName}', "
+              f"saving {duplicates['bytes'] / (1024 * 1024):.1f} MB")
+
+    # volumes are saved even if some slices failed, since these slices will be processed again on next import
+    # (volumes, windows and regions shared by all shards are saved when the fragments are merged)
+    if not shard:
+        for subviewVolume in subviewVolumes.values():
+            subviewVolume.save()
+        intensityWindows.save()
+    for sliceStack in sliceStacks.values():
+        sliceStack.save()
+    if failures:
+        message = f"{' and '.join([f'{len(failures)} slice image(s)'] + unprocessed)} could not be processed (see errors above)"
+        logging.critical(message)
+        raise Exception(message)
 
-            bar.finish()
+    def recordVolumeSlab(task, result):
+        layerVolumes[task['layer']].setSlab(task['index'], task['digest'])
+        profile.timer.add('volumes', **result['stats'])
+
+    if compositeLayers:
+        compositeTasks = getCompositeTasks(axisLayersFiles, config, ouput_path, compositeLayers, layerWindows, sliceTasks,
+                                           manifest, format, quality, container, encode_threads, write_threads)
+
+        def recordComposite(task, result):
+            manifest.record(task['output'], result['source'], task['params'])
+            profile.timer.add('composite', tiles=result['stats']['tiles'], bytes_written=result['stats']['bytes_written'])
+
+        with profile.stage('composite'):
+            failures = runSliceTasks(compositeTasks, jobs, recordComposite, processCompositeImage, 'Compositing layers... ')
+        if failures:
+            message = f"{len(failures)} composite image(s) could not be processed (see errors above)"
+            logging.critical(message)
+            raise Exception(message)
+
+    if layerVolumes:
+        with profile.stage('volumes'):
+            failures = runSliceTasks(volumeTasks, jobs, recordVolumeSlab, processVolumeSlab, 'Exporting volumes... ')
+        for layerVolume in layerVolumes.values():
+            layerVolume.save()
+        if failures:
+            message = f"{len(failures)} volume slab(s) could not be exported (see errors above)"
+            logging.critical(message)
+            raise Exception(message)
+
+    if not shard:
+        with profile.stage('subviews'):
+            saveSubviews(subviewVolumes, config, ouput_path, write_threads)
 
     sizesByAxis = {}
     for axis in axisLayersFiles['axis'].keys():
@@ -537,7 +1149,7 @@ def prepareImages(axisLayersFiles, config, ouput_path, phys_unit, format, qualit
         and 'sagittal_size' not in config
         and 'axial_size' not in config):
         if hasSingleSize:
-            config['image_size'] = sizesByAxis.values()[0]
+            config['image_size'] = next(iter(sizesByAxis.values()))
         else:
             config.update(sizesByAxis)
 
@@ -557,6 +1169,151 @@ def prepareImages(axisLayersFiles, config, ouput_path, phys_unit, format, qualit
                 refImg = axisLayersFiles['axis'][axis]['layers'][referenceLayerName]['images'][0]
                 config[axis + '_matrix'] = makeMatrix(refImg)
 
+    if unprocessed:
+        # shard fragment is not saved, so the shard is not merged before being run again
+        message = f"{' and '.join(unprocessed)} could not be processed (see errors above)"
+        logging.critical(message)
+        raise Exception(message)
+
+    if shard:
+        shard.save(config, {'format': format, 'quality': quality, 'container': container, 'ondemand': ondemand,
+                            'regionindex': region_index},
+                   intensityWindows.windows, ondemandSources)
+
+
+def getCompositeLayers(composite, layers):
+    '''
+    Return the layers blended in the composite layer, as dict of layer name: opacity (0 to 1) ordered from bottom to top,
+    from the LAYER=OPACITY (in percent) specifications of the command line (every layer fully opaque when none is given).
+    '''
+    if not composite:
+        return {layerName: 1.0 for layerName in layers}
+    opacities = {}
+    for spec in composite:
+        (layerName, _, opacity) = spec.rpartition('=')
+        if layerName not in layers:
+            message = f"Unknown layer in composite layer specification '{spec}' (layers : {', '.join(layers)})"
+            logging.critical(message)
+            raise Exception(message)
+        opacities[layerName] = min(max(float(opacity) / 100, 0.0), 1.0)
+    if not any(opacities.values()):
+        message = "Composite layer must include at least one layer with a non-zero opacity"
+        logging.critical(message)
+        raise Exception(message)
+    return {layerName: opacities[layerName] for layerName in layers if layerName in opacities}
+
+
+def getCompositeTasks(axisLayersFiles, config, ouput_path, compositeLayers, layerWindows, sliceTasks, manifest, format,
+                      quality, container, encode_threads, write_threads):
+    '''
+    Register the composite layer in the config, on top of the image layers, and return the tasks of the composite slices
+    which are not up-to-date (composite slice is outdated as soon as the slice of any of its layers was regenerated).
+    '''
+    isMultiPlane = len(axisLayersFiles['axis'].keys()) > 1
+    compositeSafename = base64.urlsafe_b64encode(COMPOSITE_DIRNAME.encode('UTF-8')).decode('UTF-8')
+    regenerated = set((task['axis'], task['index']) for task in sliceTasks if task['layer'] in compositeLayers)
+
+    # composite layer is displayed above the image layers (and below label maps), hiding them while fully opaque
+    referenceLayers = next(iter(axisLayersFiles['axis'].values()))['layers']
+    topLayerKey = list(referenceLayers.values())[-1]['safename']
+    data = {}
+    for (key, value) in config['data'].items():
+        data[key] = value
+        if key == topLayerKey:
+            data[compositeSafename] = {
+                "metadata": f"Composite ({', '.join(compositeLayers)})",
+                "opacity": "100"
+            }
+    config['data'] = data
+    # blended layers are initially displayed with the same opacities, when the composite layer is disabled
+    for (layerName, opacity) in compositeLayers.items():
+        if opacity < 1:
+            data[referenceLayers[layerName]['safename']]['opacity'] = str(round(opacity * 100))
+
+    tasks = []
+    for axis in axisLayersFiles['axis'].keys():
+        layers = [axisLayersFiles['axis'][axis]['layers'][layerName] for layerName in compositeLayers]
+        composite_ouputpath = os.path.join(ouput_path, compositeSafename)
+        if isMultiPlane:
+            composite_ouputpath = os.path.join(composite_ouputpath, axis)
+        os.makedirs(composite_ouputpath, exist_ok=True)
+
+        windows = [layerWindows[(axis, layerName)] for layerName in compositeLayers]
+        params = {
+            'format': format,
+            'quality': quality,
+            'container': container,
+            'layers': [[layer['safename'], opacity] for (layer, opacity) in zip(layers, compositeLayers.values())],
+            # composite slices are blended from the source slices of the layers (see createCompositeImage)
+            'blend': 'sources'
+        }
+        for index, image in enumerate(layers[0]['images']):
+            # layer slices are decoded and mapped to 8-bit as for tiling their layer
+            slices = []
+            for (layer, window) in zip(layers, windows):
+                layerImage = layer['images'][index]
+                slices.append({
+                    'source': os.path.join(layer['path'], layerImage['shortname'] + layerImage['ext']),
+                    'crop': layerImage['crop'],
+                    'width': layerImage['final_width'],
+                    'height': layerImage['final_height'],
+                    'window': window
+                })
+            source = os.path.join(layers[0]['path'], image['shortname'] + image['ext'])
+            output = os.path.join(composite_ouputpath, str(index) + '.dzi')
+            if (axis, index) not in regenerated and manifest.isUpToDate(output, source, params):
+                continue
+            tasks.append({
+                'axis': axis,
+                'layer': COMPOSITE_DIRNAME,
+                'index': index,
+                'source': source,
+                'output': output,
+                'slices': slices,
+                'opacities': list(compositeLayers.values()),
+                'format': format,
+                'quality': quality,
+                'container': container,
+                'encode_threads': encode_threads,
+                'write_threads': write_threads,
+                'params': params
+            })
+    return tasks
+
+
+def saveOnDemandSources(ouput_path, ondemandSources):
+    # file is removed when tiles are generated, since the tile server would otherwise render them
+    ondemandSourcesPath = os.path.join(ouput_path, ONDEMAND_SOURCES_FILENAME)
+    if ondemandSources is not None:
+        with open(ondemandSourcesPath, 'w') as sourcesFile:
+            json.dump(ondemandSources, sourcesFile, indent=2)
+    elif os.path.exists(ondemandSourcesPath):
+        os.remove(ondemandSourcesPath)
+
+
+def saveSubviews(subviewVolumes, config, ouput_path, write_threads=0):
+    '''
+    Save subview images derived from the subview volumes (by axis, the first one being the reference axis), written
+    behind their encoding by write_threads threads (if not 0).
+    '''
+    subviewBasePath = os.path.join(ouput_path, config['subview']['foldername'])
+    os.makedirs(subviewBasePath, exist_ok=True)
+    if len(subviewVolumes) > 1:
+        # one subview image for each slice, taken from the volume of the same axis
+        sink = OutputSink(write_threads) if write_threads > 0 else None
+        try:
+            for axis, subviewVolume in subviewVolumes.items():
+                subviewPath = os.path.join(subviewBasePath, axis)
+                os.makedirs(subviewPath, exist_ok=True)
+                subviewVolume.saveSlices(subviewPath, sink)
+        finally:
+            if sink:
+                sink.close()
+    else:
+        # in single plane mode, only 1 image for the subview, resliced across the volume along the preferred plane
+        (referenceAxis, subviewVolume) = next(iter(subviewVolumes.items()))
+        subviewVolume.saveReslice(PLANE_PREFSUBVIEW[referenceAxis], os.path.join(subviewBasePath, 'subview.jpg'))
+
 
 def saveConfig(config_filepath, prev_config, config):
     '''
@@ -588,23 +1345,57 @@ def arg_parser():
 
     # Beware that png tiles might be rendered with black border in OSD (v2.4.2, see https://github.com/openseadragon/openseadragon/issues/1683 )
     parser.add_argument('-f', '--tileformat', type=str, default='jpg',
-                        help='image format of generated tiles (png | jpg)')
+                        help='image format of generated tiles (png | jpg | webp | avif), label maps require png or webp')
     parser.add_argument('-q', '--tilequality', type=float, default=0.90,
-                        help='image quality of generated tiles ([0.1 ~ 1.0], the higher the better)')
+                        help='image quality of generated tiles ([0.1 ~ 1.0], the higher the better, 1.0 for lossless webp)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes used to process slice images concurrently (0 to use all available cores)')
+    parser.add_argument('-t', '--encodethreads', type=int, default=0,
+                        help='number of threads encoding the tiles of each slice (0 to share available cores between jobs)')
+    parser.add_argument('--writethreads', type=int, default=4,
+                        help='number of threads writing the tiles of each slice behind their encoding, for output folders with a high write latency (e.g. network file systems), 0 to write them synchronously')
+    parser.add_argument('-s', '--streaming', action='store_true',
+                        help='read source images by strips while tiling, to limit memory usage for very large images')
+    parser.add_argument('-c', '--tilecontainer', type=str, default='files', choices=TILE_CONTAINERS,
+                        help='storage of generated tiles : one file per tile (files), or one indexed archive file per slice (archive)')
+    parser.add_argument('-r', '--rebuild', action='store_true',
+                        help='regenerate all images, even those which are up-to-date according to the import manifest')
+    parser.add_argument('--svgprecision', type=int, default=None,
+                        help='optimize overlay SVG files : coordinates rounded to that number of decimals, paths of the same region merged, markup minified')
+    parser.add_argument('--svgcompress', type=str, nargs='*', default=[], choices=sorted(COMPRESSIONS.keys()),
+                        help='also save pre-compressed variants of the optimized overlay SVG files (.svg.gz, .svg.br if brotli module is installed)')
+    parser.add_argument('-l', '--labelmaps', action='store_true',
+                        help='also rasterize overlay SVG files into label map layers (requires png or webp tiles), using the regions of regionTree.json')
+    parser.add_argument('--regionindex', action='store_true',
+                        help='also index the regions delineated in the overlay SVG files (bounding box and area by slice) in regionIndex.json')
+    parser.add_argument('-m', '--slicestack', metavar='PATH',
+                        help='keep decoded (and cropped) slices of each layer in memory-mapped stacks in the specified folder, so subsequent imports do not decode unchanged source images again')
+    parser.add_argument('-w', '--windowpercentiles', nargs=2, type=float, metavar=('LOW', 'HIGH'), default=DEFAULT_PERCENTILES,
+                        help='percentiles of the intensities of a layer mapped to black and white, for layers with more than 8 bits per sample (16-bit, float)')
+    parser.add_argument('--ondemand', action='store_true',
+                        help='do not generate tiles, which are then rendered on demand from the source images by serveTiles.py')
+    parser.add_argument('--composite', nargs='*', metavar='LAYER=OPACITY',
+                        help='also blend the specified layers (all by default) with their opacity (in percent) in a composite layer displayed by default on top of them, so a single image is loaded instead of one per layer')
+    parser.add_argument('--volumes', action='store_true',
+                        help='also export the slices of each layer along the reference axis as chunked multi-resolution volumes (zarr), in the volumes folder')
+    parser.add_argument('--shard', type=parseShard, metavar='K/N',
+                        help='only process the K-th of N deterministic shares of the slices (e.g. on one of N nodes sharing the output folder), saving a fragment to be merged with --merge')
+    parser.add_argument('--merge', action='store_true',
+                        help='merge the fragments of every shard of a sharded import in the output folder, then save the config')
+    parser.add_argument('-b', '--batch', metavar='JOBFILE',
+                        help='import every dataset listed in the JSON (or YAML) job file, with per-dataset options, using a shared pool of worker processes')
+    parser.add_argument('-p', '--profile', action='store_true',
+                        help='save time spent, bytes read/written, tiles and peak memory per stage and per slice in import_profile.json/.csv')
+    parser.add_argument('--cprofile', action='store_true',
+                        help='also save a cProfile dump of the import in import_profile.prof (implies --profile)')
     return parser
 
 
-def startGuidedImport():
-    mount_path = "/mnt/hostdir"
-
-    args = arg_parser().parse_args()
-
-    interactive = args.outputpath is None or args.inputpath is None
-
-    displayouput_path = args.outputpath
-    (displayouput_path, ouput_path) = getCleanedAndCheckedPath(
-        "Please indicate output path", "Output path not found", mount_path, displayouput_path, interactive)
-
+def importDataset(args, input_path, ouput_path, displayouput_path, jobs, encodeThreads):
+    '''
+    Import a single dataset from input_path to ouput_path, according to the tile format, quality, physical unit, and
+    other options of args.
+    '''
     print(f"Config & data will be generated in : {displayouput_path}")
     config = {}
 
@@ -639,33 +1430,313 @@ def startGuidedImport():
     else:
         config['data_root_path'] = data_root_path
 
-    displayinput_path = args.inputpath
-    (displayinput_path, input_path) = getCleanedAndCheckedPath(
-        "Path of the source images", "Path of the source images not found", mount_path, displayinput_path, interactive)
-
     tileformat = args.tileformat
     tilequality = args.tilequality
     # physical unit used in the image spacing properties, hence can be used to determine physical size of the image
     phys_unit = args.physicalunit
-    if interactive:
-        phys_unit = float(input(
-            f"Physical unit used in images, in micrometer ({phys_unit}) : ") or phys_unit)
-        tileformat = str(input(
-            f"Image format of tiles, (jpg, png)) ({tileformat}) : ") or tileformat)
-        tilequality = float(input(
-            f"Image quality of tiles, [0.1 ~ 1.0] ({tilequality}) : ") or tilequality)
 
     # copy provided hierarchical region information resource to output folder
-    REGIONTREE_FILENAME = 'regionTree.json'
     regionTreeFilePath = os.path.join(os.path.dirname(__file__), 'assets', REGIONTREE_FILENAME)
     print(f"Copying hierarchical regions info ({regionTreeFilePath}) in output folder.")
     copyfile(regionTreeFilePath, os.path.join(ouput_path, REGIONTREE_FILENAME))
     config['tree'] = data_root_path
 
-    axisLayersFiles = getLayersNFiles(input_path, config, phys_unit)
+    # in a sharded import, only the work units of the shard are processed, and results shared by all units are saved
+    # in a fragment, to be merged later
+    shard = None
+    if args.shard:
+        shard = ShardFragment(ouput_path, *args.shard)
+        print(f"Importing shard {shard.index} of {shard.count}")
+
+    profile = ImportProfile(shard.path if shard else ouput_path, enabled=args.profile or args.cprofile, cprofile=args.cprofile)
+
+    # image information retrieved by previous imports are reused for unchanged input files (every shard keeps its own
+    # cache, since shards running concurrently would otherwise overwrite each other's)
+    scanCache = ScanCache(os.path.join(shard.path if shard else ouput_path, SCAN_CACHE_FILENAME))
+    with profile.stage('scan') as stage:
+        axisLayersFiles = getLayersNFiles(input_path, config, phys_unit, scanCache)
+        stage['images'] = sum(len(layer['images']) for axis in axisLayersFiles['axis'].values()
+                              for layer in axis['layers'].values())
     # print("axisLayersFiles :",  json.dumps(axisLayersFiles, indent=2))
-    prepareImages(axisLayersFiles, config, ouput_path, phys_unit, tileformat, tilequality)
+    # outputs generated by previous imports are not regenerated when their source and parameters have not changed
+    manifest = ImportManifest(ouput_path, reuse=not args.rebuild, shard_path=shard.path if shard else None)
+    try:
+        prepareImages(axisLayersFiles, config, ouput_path, phys_unit, tileformat, tilequality, jobs, args.streaming, manifest,
+                      args.tilecontainer, profile, encodeThreads, args.svgprecision, args.svgcompress,
+                      regionTreeFilePath, args.labelmaps, args.slicestack, args.windowpercentiles, args.ondemand, shard,
+                      args.volumes, args.composite, args.writethreads, args.regionindex)
+    finally:
+        manifest.close()
+    if shard:
+        print(f"Fragment of shard {shard.index} of {shard.count} saved, config will be saved once every shard is merged (--merge).")
+    else:
+        saveConfig(config_filepath, prev_config, config)
+
+    if profile.enabled:
+        profile.save({'tileformat': tileformat, 'tilequality': tilequality, 'jobs': jobs, 'encodethreads': encodeThreads,
+                      'writethreads': args.writethreads, 'streaming': args.streaming,
+                      'tilecontainer': args.tilecontainer, 'rebuild': args.rebuild})
+        profile.printSummary()
+
+
+def mergeShards(ouput_path, displayouput_path, write_threads=0):
+    '''
+    Merge the fragments saved in the output folder by every shard of a sharded import (see --shard): viewer config,
+    subview images, region index, intensity windows, sources of the slices rendered on demand and import manifest are
+    assembled from the fragments only, without scanning or decoding any source image again.
+    '''
+    fragments = loadShardFragments(ouput_path)
+    print(f"Merging fragments of {len(fragments)} shard(s) in : {displayouput_path}")
+    config = fragments[0]['config']
+    parameters = fragments[0]['parameters']
+
+    # axis of the dataset are the ones with slices, in their usual order
+    axes = [axis for axis in AXIS if f"{axis}_slide" in config['subview']]
+    subviewVolumes = {axis: SubviewVolume(axis, config['subview'][f"{axis}_slide"], ouput_path) for axis in axes}
+    regionIndex = RegionIndex(ouput_path, os.path.join(ouput_path, REGIONTREE_FILENAME)) if parameters.get('regionindex') else None
+    intensityWindows = IntensityWindows(ouput_path)
+    ondemandSources = {}
+    for fragment in fragments:
+        for (axis, (indexes, thumbnails)) in loadFragmentThumbnails(fragment).items():
+            for (index, thumbnail) in zip(indexes, thumbnails):
+                subviewVolumes[axis].setSlice(int(index), thumbnail)
+        for (axis, slices) in (fragment['regions'].items() if regionIndex else ()):
+            regionIndex.setSliceCount(axis, config['subview'][f"{axis}_slide"])
+            for (index, regions) in slices:
+                regionIndex.setSlice(axis, index, regions)
+        for (key, entry) in fragment['windows'].items():
+            if intensityWindows.get(key, entry['percentiles'], entry['sources']) is None:
+                intensityWindows.set(key, entry['percentiles'], entry['sources'], entry['window'])
+        ondemandSources.update(fragment['ondemand'])
+
+    for subviewVolume in subviewVolumes.values():
+        subviewVolume.save()
+
+    # manifest entries of the shards are only merged once the volumes they depend on are saved
+    manifest = ImportManifest(ouput_path)
+    for fragment in fragments:
+        manifest.load(os.path.join(fragment['path'], MANIFEST_FILENAME))
+    manifest.close()
+
+    saveSubviews(subviewVolumes, config, ouput_path, write_threads)
+    if regionIndex:
+        regionIndex.save()
+    intensityWindows.save()
+    saveOnDemandSources(ouput_path, ondemandSources if parameters['ondemand'] else None)
+
+    config_filepath = os.path.join(ouput_path, 'viewer.json')
+    prev_config = None
+    if os.path.isfile(config_filepath):
+        with open(config_filepath, 'r') as config_file:
+            prev_config = json.load(config_file)
     saveConfig(config_filepath, prev_config, config)
 
+    # fragments are only merged once
+    for fragment in fragments:
+        clearFragment(fragment)
+    print(f"Config saved in : {config_filepath}")
+
+
+def loadBatchJobs(jobfile_path):
+    '''
+    Read batch job file (JSON, or YAML when PyYAML is installed) listing the datasets to import:
+        {
+            "defaults": {<option>: <value>, ...},
+            "retries": 1,
+            "report": "batch_report.json",
+            "datasets": [{"name": ..., "inputpath": ..., "outputpath": ..., <option>: <value>, ...}, ...]
+        }
+    where options are the long names of the command line options (e.g. tileformat, tilequality, physicalunit).
+    '''
+    with open(jobfile_path, 'r') as jobfile:
+        if os.path.splitext(jobfile_path)[1].lower() in ('.yaml', '.yml'):
+            if yaml is None:
+                message = f"PyYAML module is required to read YAML job file : {jobfile_path}"
+                logging.critical(message)
+                raise Exception(message)
+            jobs = yaml.safe_load(jobfile)
+        else:
+            jobs = json.load(jobfile)
+    if not isinstance(jobs, dict) or not isinstance(jobs.get('datasets'), list):
+        message = f"Job file must define a list of datasets : {jobfile_path}"
+        logging.critical(message)
+        raise Exception(message)
+    return jobs
+
+
+# options of the command line which apply to the whole batch (shared pool of worker processes), or select the mode of
+# the run, hence can not be set for each dataset in the job file
+BATCH_OPTIONS = ('jobs', 'encodethreads', 'batch', 'merge')
+
+
+def getDatasetArgs(args, datasetOptions, index, jobfile_path):
+    '''
+    Return the options of a dataset of the job file (as dict of long option name: value), on top of the command line
+    options, parsed by the command line parser, so they are converted and checked the same way (types, choices...).
+    '''
+    parser = arg_parser()
+    actions = {action.dest: action for action in parser._actions}
+    datasetArgs = argparse.Namespace(**dict(vars(args), batch=None))
+    argv = []
+    for (name, value) in datasetOptions.items():
+        if name == 'name':
+            continue
+        if name not in actions or not actions[name].option_strings:
+            message = f"Unknown option '{name}' in job file : {jobfile_path}"
+            logging.critical(message)
+            raise Exception(message)
+        if name in BATCH_OPTIONS:
+            message = f"Option '{name}' applies to the whole batch, it must be specified on the command line, not in job file : {jobfile_path}"
+            logging.critical(message)
+            raise Exception(message)
+        action = actions[name]
+        if action.nargs == 0:
+            # flags (e.g. streaming) are set or cleared by a boolean value
+            if not isinstance(value, bool):
+                message = f"Option '{name}' of dataset #{index} must be true or false in job file : {jobfile_path}"
+                logging.critical(message)
+                raise Exception(message)
+            setattr(datasetArgs, name, value)
+        elif value is None:
+            setattr(datasetArgs, name, None)
+        elif isinstance(value, list):
+            argv += [action.option_strings[-1]] + [str(item) for item in value]
+        else:
+            argv += [action.option_strings[-1], str(value)]
+    try:
+        datasetArgs = parser.parse_args(argv, namespace=datasetArgs)
+    except SystemExit:
+        # parser already reported the invalid option
+        message = f"Invalid option of dataset #{index} in job file : {jobfile_path}"
+        logging.critical(message)
+        raise Exception(message)
+    if not datasetArgs.inputpath or not datasetArgs.outputpath:
+        message = f"Dataset #{index} must define inputpath and outputpath in job file : {jobfile_path}"
+        logging.critical(message)
+        raise Exception(message)
+    return datasetArgs
+
+
+def runBatchImport(args, mount_path):
+    '''
+    Import every dataset of the batch job file, in the same process and with a shared pool of worker processes.
+    Failed datasets are retried independently once the others have been imported; a summary is printed at the end
+    (and saved as JSON when the job file specifies a report path). Return the number of datasets which failed.
+    '''
+    global sharedExecutor
+
+    jobs = loadBatchJobs(args.batch)
+    datasets = []
+    for (index, dataset) in enumerate(jobs['datasets']):
+        datasetArgs = getDatasetArgs(args, dict(jobs.get('defaults', {}), **dataset), index, args.batch)
+        datasets.append({
+            'name': dataset.get('name', datasetArgs.outputpath),
+            'args': datasetArgs,
+            'status': 'pending',
+            'attempts': 0,
+            'wall_time': 0.0,
+            'error': None
+        })
+
+    retries = int(jobs.get('retries', 1))
+    workerCount = args.jobs if args.jobs > 0 else os.cpu_count()
+    encodeThreads = args.encodethreads if args.encodethreads > 0 else max(1, os.cpu_count() // workerCount)
+    print(f"Batch import of {len(datasets)} dataset(s) from : {args.batch}")
+
+    if workerCount > 1:
+        sharedExecutor = concurrent.futures.ProcessPoolExecutor(max_workers=workerCount)
+    try:
+        for attempt in range(retries + 1):
+            pending = [dataset for dataset in datasets if dataset['status'] != 'done']
+            if not pending:
+                break
+            if attempt:
+                print(f"\nRetrying {len(pending)} failed dataset(s) (attempt {attempt + 1} of {retries + 1})")
+            for dataset in pending:
+                print(f"\n[{dataset['name']}]")
+                dataset['attempts'] += 1
+                start = time.perf_counter()
+                try:
+                    datasetArgs = dataset['args']
+                    (displayouput_path, ouput_path) = getCleanedAndCheckedPath(
+                        None, "Output path not found", mount_path, datasetArgs.outputpath, False)
+                    (_, input_path) = getCleanedAndCheckedPath(
+                        None, "Path of the source images not found", mount_path, datasetArgs.inputpath, False)
+                    importDataset(datasetArgs, input_path, ouput_path, displayouput_path, workerCount, encodeThreads)
+                except Exception as error:
+                    logging.error(f"Import of dataset '{dataset['name']}' failed : {error}")
+                    dataset['status'] = 'failed'
+                    dataset['error'] = str(error)
+                    if sharedExecutor:
+                        # worker processes might have been lost, next import starts with a fresh pool
+                        sharedExecutor.shutdown(wait=True, cancel_futures=True)
+                        sharedExecutor = concurrent.futures.ProcessPoolExecutor(max_workers=workerCount)
+                else:
+                    dataset['status'] = 'done'
+                    dataset['error'] = None
+                finally:
+                    dataset['wall_time'] += time.perf_counter() - start
+    finally:
+        if sharedExecutor:
+            sharedExecutor.shutdown()
+            sharedExecutor = None
+
+    print("\nBatch import summary :")
+    for dataset in datasets:
+        print(f"\t{dataset['name']:<30} {dataset['status']:<8} {dataset['attempts']} attempt(s) {dataset['wall_time']:10.2f}s"
+              + (f"  {dataset['error']}" if dataset['error'] else ''))
+    failedCount = sum(1 for dataset in datasets if dataset['status'] != 'done')
+    print(f"{len(datasets) - failedCount} dataset(s) imported, {failedCount} failed.")
+
+    if jobs.get('report'):
+        reportPath = os.path.join(os.path.dirname(os.path.abspath(args.batch)), jobs['report'])
+        with open(reportPath, 'w') as reportFile:
+            json.dump({
+                'timestamp': datetime.now().isoformat(),
+                'datasets': [{key: dataset[key] for key in ('name', 'status', 'attempts', 'wall_time', 'error')}
+                             for dataset in datasets]
+            }, reportFile, indent=2)
+    return failedCount
+
+
+def startGuidedImport():
+    mount_path = "/mnt/hostdir"
+
+    args = arg_parser().parse_args()
+
+    if args.batch:
+        if runBatchImport(args, mount_path):
+            sys.exit(1)
+        return
+
+    if args.merge:
+        (displayouput_path, ouput_path) = getCleanedAndCheckedPath(
+            "Please indicate output path", "Output path not found", mount_path, args.outputpath, args.outputpath is None)
+        mergeShards(ouput_path, displayouput_path, args.writethreads)
+        return
+
+    interactive = args.outputpath is None or args.inputpath is None
+
+    displayouput_path = args.outputpath
+    (displayouput_path, ouput_path) = getCleanedAndCheckedPath(
+        "Please indicate output path", "Output path not found", mount_path, displayouput_path, interactive)
+
+    displayinput_path = args.inputpath
+    (displayinput_path, input_path) = getCleanedAndCheckedPath(
+        "Path of the source images", "Path of the source images not found", mount_path, displayinput_path, interactive)
+
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+    encodeThreads = args.encodethreads if args.encodethreads > 0 else max(1, os.cpu_count() // jobs)
+    if interactive:
+        args.physicalunit = float(input(
+            f"Physical unit used in images, in micrometer ({args.physicalunit}) : ") or args.physicalunit)
+        args.tileformat = str(input(
+            f"Image format of tiles, (jpg, png, webp, avif) ({args.tileformat}) : ") or args.tileformat)
+        args.tilequality = float(input(
+            f"Image quality of tiles, [0.1 ~ 1.0] ({args.tilequality}) : ") or args.tilequality)
+
+    importDataset(args, input_path, ouput_path, displayouput_path, jobs, encodeThreads)
+
 
-startGuidedImport()
+if __name__ == '__main__':
+    startGuidedImport()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+import json
+import logging
+import os
+
+import numpy as np
+
+from importManifest import getFileDigest
+from svgRasterizer import parseSVGShapes
+
+REGION_INDEX_FILENAME = 'regionIndex.json'
+
+# values stored for each occurrence of a region in a slice, bounding box being in pixels of the reference layer image
+OCCURRENCE_FIELDS = ('slice', 'left', 'top', 'right', 'bottom', 'area')
+
+
+def getPolygonArea(points):
+    # shoelace formula, signed according to the winding of the polygon
+    x = points[:, 0]
+    y = points[:, 1]
+    return 0.5 * (np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+
+def getSliceRegions(svgPath, regionByAbb, width, height, unknownRegionIds=None):
+    '''
+    Retrieve regions delineated in overlay SVG of a slice, with their bounding box and area (in pixels of an image of the
+    specified size). Return dict of region abbreviation: [left, top, right, bottom, area].
+    Regions missing from the region information are added to the unknownRegionIds set, if specified (see parseSVGShapes).
+    '''
+    regions = {}
+    for (abb, _, subpaths, bbox) in parseSVGShapes(svgPath, regionByAbb, width, height, unknownRegionIds):
+        # holes are expected to be drawn with the opposite winding, so they are subtracted
+        area = abs(sum(getPolygonArea(points) for points in subpaths))
+        bbox = [int(np.floor(bbox[0])), int(np.floor(bbox[1])), int(np.ceil(bbox[2])), int(np.ceil(bbox[3]))]
+        if abb in regions:
+            previous = regions[abb]
+            bbox = [min(previous[0], bbox[0]), min(previous[1], bbox[1]), max(previous[2], bbox[2]), max(previous[3], bbox[3])]
+            area += previous[4]
+        regions[abb] = bbox + [area]
+    return {abb: values[:4] + [int(round(values[4]))] for (abb, values) in regions.items()}
+
+
+def makeRegionsByAbb(regionTreePath):
+    # SVG region ids are stripped, while abbreviations are kept as in region information
+    with open(regionTreePath, 'r') as regionTreeFile:
+        regions = json.load(regionTreeFile)['regions']
+    return {region['abb'].strip(): region['abb'] for region in regions}
+
+
+class RegionIndex(object):
+    '''
+    Index of the regions delineated in the overlay slices of each axis, saved in the output folder:
+    region abbreviation -> occurrences in slices (index, bounding box and area), and slice -> regions present.
+    Previously saved index is loaded so slices whose overlay is not processed again keep their entries; it is only reused
+    when made from the same region information (reused entries are then checked by slice with hasSlice).
+    '''
+
+    def __init__(self, output_path, regionTreePath):
+        self.filepath = os.path.join(output_path, REGION_INDEX_FILENAME)
+        self.regionTreeDigest = getFileDigest(regionTreePath)
+        self.slices = {}
+        self.modified = False
+        if os.path.isfile(self.filepath):
+            try:
+                self.load()
+            except (ValueError, KeyError, TypeError):
+                logging.warning(f"Ignoring invalid region index : {self.filepath}")
+                self.slices = {}
+
+    def load(self):
+        with open(self.filepath, 'r') as indexFile:
+            index = json.load(indexFile)
+        if index['regiontree'] != self.regionTreeDigest:
+            return
+        for (axis, axisIndex) in index['axes'].items():
+            slices = [{} for _ in axisIndex['slices']]
+            for (abb, occurrences) in axisIndex['regions'].items():
+                for occurrence in occurrences:
+                    slices[occurrence[0]][abb] = occurrence[1:]
+            # slices which were not indexed are recorded as null
+            self.slices[axis] = [sliceRegions if regions is not None else None
+                                 for (sliceRegions, regions) in zip(slices, axisIndex['slices'])]
+
+    def setSliceCount(self, axis, sliceCount):
+        slices = self.slices.get(axis)
+        if slices is None or len(slices) != sliceCount:
+            self.slices[axis] = [None] * sliceCount
+            self.modified = True
+
+    def hasSlice(self, axis, index):
+        return self.slices[axis][index] is not None
+
+    def setSlice(self, axis, index, regions):
+        self.slices[axis][index] = regions
+        self.modified = True
+
+    def save(self):
+        if not self.modified:
+            return
+        index = {
+            'regiontree': self.regionTreeDigest,
+            'fields': OCCURRENCE_FIELDS,
+            'axes': {}
+        }
+        for (axis, slices) in self.slices.items():
+            regions = {}
+            for (sliceIndex, sliceRegions) in enumerate(slices):
+                for (abb, values) in (sliceRegions or {}).items():
+                    regions.setdefault(abb, []).append([sliceIndex] + values)
+            index['axes'][axis] = {
+                'regions': regions,
+                'slices': [sorted(sliceRegions) if sliceRegions is not None else None for sliceRegions in slices]
+            }
+        tempFilepath = self.filepath + '.tmp'
+        with open(tempFilepath, 'w') as indexFile:
+            json.dump(index, indexFile, separators=(',', ':'))
+        os.replace(tempFilepath, self.filepath)
+        self.modified = False
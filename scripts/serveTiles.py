@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+import argparse
+import functools
+import json
+import logging
+import os
+import posixpath
+import re
+import threading
+import urllib.parse
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from tileArchive import TileArchive, ARCHIVE_EXTENSION
+from tileRenderer import OnDemandTiles, ONDEMAND_SOURCES_FILENAME
+
+# url of a tile in Deep Zoom layout : <slice>_files/<level>/<column>_<row>.<format>
+TILE_URL_RE = re.compile(r'^(.+)_files/(\d+)/(\d+)_(\d+)\.(\w+)$')
+
+TILE_CONTENT_TYPES = {
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'webp': 'image/webp',
+    'avif': 'image/avif',
+}
+
+# pre-compressed variants of files (generated for overlay SVG files), by preference order
+PRECOMPRESSED_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# number of tile archives kept open
+OPENED_ARCHIVES = 256
+
+
+@functools.lru_cache(maxsize=OPENED_ARCHIVES)
+def getTileArchive(path, mtime):
+    # modification time is part of the cache key, so regenerated archives are reopened
+    return TileArchive(path)
+
+
+class TileRequestHandler(SimpleHTTPRequestHandler):
+    '''
+    Serve content of an output folder prepared by prepareDZImages.py, laid out as in ZAViewer UI container
+    (configuration at the root, data under 'data/'). Tiles missing from the file system are read from tile archives, or
+    rendered from the source images for slices prepared with the --ondemand option.
+    '''
+    extensions_map = dict(SimpleHTTPRequestHandler.extensions_map,
+                          **{'.' + tileFormat: contentType for (tileFormat, contentType) in TILE_CONTENT_TYPES.items()})
+
+    def __init__(self, *args, ondemandTiles=None, **kwargs):
+        self.ondemandTiles = ondemandTiles
+        super().__init__(*args, **kwargs)
+
+    def translate_path(self, path):
+        path = urllib.parse.unquote(urllib.parse.urlsplit(path).path)
+        trailingSlash = path.endswith('/')
+        path = posixpath.normpath(path).lstrip('/')
+        if path == 'data' or path.startswith('data/'):
+            path = path[len('data/'):]
+        filepath = os.path.join(self.directory, *[part for part in path.split('/') if part not in ('', '.', '..')])
+        return filepath + os.sep if trailingSlash else filepath
+
+    def do_GET(self):
+        filepath = self.translate_path(self.path)
+        match = TILE_URL_RE.match(filepath)
+        if match and not os.path.exists(filepath):
+            if not (self.ondemandTiles and self.sendRenderedTile(match)):
+                self.sendArchivedTile(match)
+        elif not self.sendPrecompressedFile(filepath):
+            super().do_GET()
+
+    def sendPrecompressedFile(self, filepath):
+        acceptedEncodings = [encoding.split(';')[0].strip() for encoding in self.headers.get('Accept-Encoding', '').split(',')]
+        for (encoding, extension) in PRECOMPRESSED_ENCODINGS:
+            if encoding in acceptedEncodings and os.path.isfile(filepath + extension):
+                with open(filepath + extension, 'rb') as compressedFile:
+                    data = compressedFile.read()
+                self.send_response(200)
+                self.send_header('Content-Type', self.guess_type(filepath))
+                self.send_header('Content-Encoding', encoding)
+                self.send_header('Content-Length', str(len(data)))
+                self.send_header('Vary', 'Accept-Encoding')
+                self.end_headers()
+                self.wfile.write(data)
+                return True
+        return False
+
+    def sendRenderedTile(self, match):
+        (slicePath, level, column, row, tileFormat) = match.groups()
+        slicePath = os.path.relpath(slicePath, self.directory).replace(os.sep, '/')
+        try:
+            data = self.ondemandTiles.getTile(slicePath, int(level), int(column), int(row), tileFormat)
+        except Exception as error:
+            logging.error(f"Failed to render tile {level}/{column}_{row} of {slicePath} : {error}")
+            self.send_error(500, "Tile could not be rendered")
+            return True
+        if data is None:
+            return False
+        self.sendTile(data, tileFormat)
+        return True
+
+    def sendArchivedTile(self, match):
+        (slicePath, level, column, row, tileFormat) = match.groups()
+        archivePath = slicePath + ARCHIVE_EXTENSION
+        try:
+            archive = getTileArchive(archivePath, os.stat(archivePath).st_mtime_ns)
+        except (OSError, ValueError):
+            self.send_error(404, "Tile archive not found")
+            return
+
+        data = archive.read(int(level), int(column), int(row)) if tileFormat == archive.format else None
+        if data is None:
+            self.send_error(404, "Tile not found")
+            return
+
+        self.sendTile(data, tileFormat)
+
+    def sendTile(self, data, tileFormat):
+        self.send_response(200)
+        self.send_header('Content-Type', TILE_CONTENT_TYPES.get(tileFormat, 'application/octet-stream'))
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def end_headers(self):
+        # data may be displayed by a ZAViewer instance served from another origin (datasrc parameter)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        super().end_headers()
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(description='Serve Deep Zoom images prepared for ZAViewer, including tile archives')
+    parser.add_argument('-d', '--datapath', type=str, default='.',
+                        help='path of the output folder generated by prepareDZImages.py')
+    parser.add_argument('-p', '--port', type=int, default=8080,
+                        help='listening port')
+    parser.add_argument('-b', '--bind', type=str, default='',
+                        help='address to bind to (all interfaces by default)')
+    parser.add_argument('-c', '--cachepath', type=str, default=None,
+                        help='path of the folder where tiles rendered on demand are cached (tile_cache in data path by default)')
+    parser.add_argument('-m', '--memorycache', type=int, default=256,
+                        help='size of the in-memory cache of tiles rendered on demand (in MB)')
+    parser.add_argument('-k', '--diskcache', type=int, default=2048,
+                        help='size of the on-disk cache of tiles rendered on demand (in MB)')
+    parser.add_argument('-w', '--warmup', type=int, default=2,
+                        help='number of neighbours of the initially displayed slice whose coarse levels are rendered at startup')
+    return parser
+
+
+def warmUpTiles(ondemandTiles, data_path, neighbours):
+    # slice initially displayed by the viewer, and its neighbours, are rendered in the background
+    configPath = os.path.join(data_path, 'viewer.json')
+    if not os.path.isfile(configPath):
+        return
+    with open(configPath, 'r') as configFile:
+        firstAccess = json.load(configFile).get('first_access', {})
+    if 'slide' not in firstAccess:
+        return
+    print(f"Rendering tiles of slice {firstAccess['slide']} and its neighbours ...")
+    ondemandTiles.warmUp(firstAccess.get('plane'), int(firstAccess['slide']), neighbours)
+    print("... initial tiles rendered.")
+
+
+def startServer():
+    args = arg_parser().parse_args()
+    data_path = os.path.realpath(args.datapath)
+    ondemandTiles = None
+    if os.path.isfile(os.path.join(data_path, ONDEMAND_SOURCES_FILENAME)):
+        ondemandTiles = OnDemandTiles(data_path, args.cachepath or os.path.join(data_path, 'tile_cache'),
+                                      args.memorycache * 1024 * 1024, args.diskcache * 1024 * 1024)
+        print(f"{len(ondemandTiles.sources)} slice(s) rendered on demand.")
+        threading.Thread(target=warmUpTiles, args=(ondemandTiles, data_path, args.warmup), daemon=True).start()
+    handler = functools.partial(TileRequestHandler, directory=data_path, ondemandTiles=ondemandTiles)
+    server = ThreadingHTTPServer((args.bind, args.port), handler)
+    print(f"Serving {args.datapath} on port {args.port} ...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    startServer()
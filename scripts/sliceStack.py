@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+import json
+import logging
+import os
+
+import numpy as np
+import tifffile
+
+from dziTiler import iterTiffRowBands
+from importManifest import getFileInfo
+
+STACK_FILENAME_PATTERN = '{name}_{axis}'
+STACK_RAW_EXTENSION = '.raw'
+STACK_HEADER_EXTENSION = '.json'
+
+
+def readStackLayout(source):
+    '''
+    Retrieve the pixel type of a TIFF slice, as (dtype, samples per pixel, colormap), from its header only.
+    '''
+    with tifffile.TiffFile(source) as tiff:
+        page = tiff.pages[0]
+        colormap = page.colormap if page.photometric == tifffile.PHOTOMETRIC.PALETTE else None
+        return (page.dtype.str, page.samplesperpixel, colormap.tolist() if colormap is not None else None)
+
+
+def openStackSlice(stack, mode='r'):
+    '''
+    Return memory-mapped pixel array (height x width [x samples]) of a stacked slice, as described by the stack entry
+    of a slice task.
+    '''
+    array = np.memmap(stack['path'], dtype=np.dtype(stack['dtype']), mode=mode, shape=tuple(stack['shape']))
+    return array[stack['index'], :stack['height'], :stack['width']]
+
+
+def storeStackSlice(stack, source, crop=None, bandHeight=256):
+    '''
+    Decode TIFF slice (optionally cropped to the box (x, y, width, height)) in the stack, by bands of rows.
+    Return memory-mapped pixel array of the stacked slice.
+    '''
+    array = openStackSlice(stack, 'r+')
+    y = 0
+    for band in iterTiffRowBands(source, bandHeight, crop):
+        if band.shape[1:] != array.shape[1:] or band.dtype != array.dtype:
+            raise Exception(f"Pixel type or size of {source} differs from the other slices of the stack ({stack['path']})")
+        array[y:y + band.shape[0]] = band
+        y += band.shape[0]
+    array.flush()
+    return array
+
+
+class SliceStack(object):
+    '''
+    Decoded (and cropped) slices of a layer along an axis, stored in a raw file which is memory-mapped by the slice
+    processing, with a JSON header recording the pixel type, the shape and the spacing of the stack, as well as the
+    source file and crop box of each stacked slice (slices are padded to the size of the largest slice).
+    Slices are only decoded again when their source file or crop box have changed, so later imports (e.g. with other
+    tile parameters) do not need to decode the source images again.
+    Palette slices are stored as raw palette indexes, with the colormap in the header: it is applied when tiling them
+    (unless they are kept as label maps), as when they are tiled from their source.
+    '''
+
+    def __init__(self, path, name, axis, source, sliceCount, width, height, spacing):
+        filename = STACK_FILENAME_PATTERN.format(name=name, axis=axis)
+        self.rawPath = os.path.join(path, filename + STACK_RAW_EXTENSION)
+        self.headerPath = os.path.join(path, filename + STACK_HEADER_EXTENSION)
+
+        # pixel type of the stack is the one of the specified source slice
+        (dtype, samples, colormap) = readStackLayout(source)
+        shape = [sliceCount, height, width]
+        if samples > 1:
+            shape.append(samples)
+        self.header = {
+            'dtype': dtype,
+            'shape': shape,
+            'spacing': spacing,
+            'colormap': colormap,
+            'slices': [None] * sliceCount
+        }
+        self.modified = False
+
+        previous = self.load()
+        if previous and all(previous[key] == self.header[key] for key in ('dtype', 'shape', 'colormap')) and (
+                os.path.getsize(self.rawPath) == np.prod(shape) * np.dtype(dtype).itemsize):
+            self.header['slices'] = previous['slices']
+        else:
+            os.makedirs(path, exist_ok=True)
+            # space is allocated as slices are stored (sparse file)
+            np.memmap(self.rawPath, dtype=np.dtype(dtype), mode='w+', shape=tuple(shape)).flush()
+            self.modified = True
+
+    def load(self):
+        if not (os.path.isfile(self.headerPath) and os.path.isfile(self.rawPath)):
+            return None
+        try:
+            with open(self.headerPath, 'r') as headerFile:
+                return json.load(headerFile)
+        except ValueError:
+            logging.warning(f"Ignoring invalid slice stack header : {self.headerPath}")
+            return None
+
+    def getSliceTask(self, index, width, height):
+        # slice tasks only carry what is needed to memory-map the stack in worker processes
+        return {
+            'path': self.rawPath,
+            'dtype': self.header['dtype'],
+            'shape': self.header['shape'],
+            'colormap': self.header['colormap'],
+            'index': index,
+            'width': width,
+            'height': height,
+            'stored': None
+        }
+
+    def getStoredSlice(self, index, source, crop):
+        '''
+        Return the entry of the slice if it was stacked from the current version of the source file, with the same crop box.
+        '''
+        entry = self.header['slices'][index]
+        if entry is None or entry['crop'] != (list(crop) if crop else None):
+            return None
+        current = getFileInfo(source)
+        recorded = entry['source']
+        if (recorded['path'], recorded['size'], recorded['mtime']) != (current['path'], current['size'], current['mtime']):
+            return None
+        return entry
+
+    def setSlice(self, index, sourceInfo, crop):
+        self.header['slices'][index] = {'source': sourceInfo, 'crop': list(crop) if crop else None}
+        self.modified = True
+
+    def save(self):
+        if not self.modified:
+            return
+        tempFilepath = self.headerPath + '.tmp'
+        with open(tempFilepath, 'w') as headerFile:
+            json.dump(self.header, headerFile)
+        os.replace(tempFilepath, self.headerPath)
+        self.modified = False
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+import io
+import logging
+import os
+
+import numpy as np
+import PIL.Image
+
+# size of the subview images (in pixels), which are displayed stretched to a square whatever the actual image proportions
+SUBVIEW_SIZE = 200
+
+VOLUME_FILENAME_PATTERN = 'subview_volume_{axis}.npy'
+
+# Volume arrays are indexed by (slice, row, column) of the slices of their own axis, while coordinate axes are
+#   x : left to right (horizontal axis in coronal and axial planes),
+#   y : anterior to posterior (horizontal axis in sagittal plane, vertical axis in axial plane),
+#   z : superior to inferior (vertical axis in coronal and sagittal planes).
+# Functions below extract the plane orthogonal to the volume axis, passing through the specified relative position
+# (row or column), as an image whose orientation is consistent with the subview markers of the viewer:
+# in single plane mode, index of the displayed slices grows from left to right, and from bottom to top.
+RESLICERS = {
+    # sagittal plane is a column of every coronal slices
+    ('coronal', 'sagittal'): lambda volume, position: volume[:, :, int(position * (volume.shape[2] - 1))].swapaxes(0, 1),
+    # axial plane is a row of every coronal slices
+    ('coronal', 'axial'): lambda volume, position: volume[::-1, int(position * (volume.shape[1] - 1)), :],
+    # coronal plane is a column of every sagittal slices
+    ('sagittal', 'coronal'): lambda volume, position: volume[:, :, int(position * (volume.shape[2] - 1))].swapaxes(0, 1),
+    # axial plane is a row of every sagittal slices
+    ('sagittal', 'axial'): lambda volume, position: volume[:, int(position * (volume.shape[1] - 1)), :].swapaxes(0, 1),
+    # coronal plane is a row of every axial slices
+    ('axial', 'coronal'): lambda volume, position: volume[::-1, int(position * (volume.shape[1] - 1)), :],
+    # sagittal plane is a column of every axial slices
+    ('axial', 'sagittal'): lambda volume, position: volume[::-1, :, int(position * (volume.shape[2] - 1))],
+}
+
+
+def makeSliceThumbnail(image):
+    '''
+    Downsample slice image (typically a coarse level of its Deep Zoom pyramid) to a volume slice.
+    Slice is stretched to the square volume slice (not padded), since the viewer maps positions in the subview images
+    (e.g. subview min/max, and the current slice line) to the whole extent of the slices.
+    '''
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return np.asarray(image.resize((SUBVIEW_SIZE, SUBVIEW_SIZE), PIL.Image.BILINEAR))
+
+
+class SubviewVolume(object):
+    '''
+    Low resolution volume made of the stacked thumbnails of the reference layer slices along an axis, from which subview
+    images of that axis and of the orthogonal planes are derived.
+    Volume is saved in the output folder, so slices which are not regenerated by a later import do not need to be decoded
+    again; a saved volume is only reused when it has the expected number of slices (reused attribute).
+    Saved volume is deleted as soon as it is modified, and until it is saved again, so that an interrupted import does
+    not leave a volume older than the slices recorded in the import manifest.
+    '''
+
+    def __init__(self, axis, sliceCount, output_path):
+        self.axis = axis
+        self.filepath = os.path.join(output_path, VOLUME_FILENAME_PATTERN.format(axis=axis))
+        self.shape = (sliceCount, SUBVIEW_SIZE, SUBVIEW_SIZE, 3)
+        self.volume = None
+        self.modified = False
+        if os.path.isfile(self.filepath):
+            try:
+                volume = np.load(self.filepath)
+                if volume.shape == self.shape and volume.dtype == np.uint8:
+                    self.volume = volume
+            except (ValueError, OSError, EOFError):
+                logging.warning(f"Ignoring invalid subview volume : {self.filepath}")
+        self.reused = self.volume is not None
+        if self.volume is None:
+            self.volume = np.zeros(self.shape, np.uint8)
+
+    def setSlice(self, index, thumbnail):
+        if not self.modified and os.path.isfile(self.filepath):
+            os.remove(self.filepath)
+        self.volume[index] = thumbnail
+        self.modified = True
+
+    def save(self):
+        if not self.modified:
+            return
+        tempFilepath = self.filepath + '.tmp.npy'
+        np.save(tempFilepath, self.volume)
+        os.replace(tempFilepath, self.filepath)
+        self.modified = False
+
+    def saveSlices(self, path, sink=None):
+        '''
+        Save every slice of the volume as a subview image, named after its index (written through the output sink when
+        specified).
+        '''
+        for index in range(self.shape[0]):
+            filepath = os.path.join(path, f"{index}.jpg")
+            if sink:
+                data = io.BytesIO()
+                PIL.Image.fromarray(self.volume[index]).save(data, 'JPEG')
+                sink.writeFile(filepath, data.getvalue())
+            else:
+                PIL.Image.fromarray(self.volume[index]).save(filepath)
+
+    def saveReslice(self, plane, filepath, position=0.5):
+        '''
+        Save the plane orthogonal to the volume axis at the specified relative position as a subview image.
+        '''
+        reslice = RESLICERS[(self.axis, plane)](self.volume, position)
+        PIL.Image.fromarray(np.ascontiguousarray(reslice)).resize(
+            (SUBVIEW_SIZE, SUBVIEW_SIZE), PIL.Image.BILINEAR).save(filepath)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+import gzip
+import io
+import re
+import xml.etree.ElementTree as ET
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+SVG_NAMESPACE = 'http://www.w3.org/2000/svg'
+
+# path of the background region, which is never merged with other paths (see BACKGROUND_PATHID in ViewerManager.js)
+BACKGROUND_PATHID = 'background'
+
+# attributes holding coordinates, whose precision is reduced
+COORDINATES_ATTRIBUTES = ('d', 'points')
+
+NUMBER_RE = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+PATH_TOKEN_RE = re.compile(r'[MmZzLlHhVvCcSsQqTtAa]|' + NUMBER_RE.pattern)
+
+# available pre-compressed variants of the optimized files, as file extension: compression function
+COMPRESSIONS = {
+    'gz': lambda data: gzip.compress(data, compresslevel=9, mtime=0),
+}
+if brotli is not None:
+    COMPRESSIONS['br'] = lambda data: brotli.compress(data, mode=brotli.MODE_TEXT)
+
+
+def formatNumber(value, precision):
+    text = f"{round(float(value), precision):.{precision}f}"
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    if text.startswith('0.'):
+        text = text[1:]
+    elif text.startswith('-0.'):
+        text = '-' + text[2:]
+    return '0' if text in ('-0', '') else text
+
+
+def minifyPathData(pathData, precision):
+    '''
+    Round coordinates of SVG path data to the specified number of decimals, and remove superfluous separators.
+    '''
+    output = []
+    previous = None
+    for token in PATH_TOKEN_RE.findall(pathData):
+        if token.isalpha():
+            output.append(token)
+        else:
+            number = formatNumber(token, precision)
+            # a separator is only needed between consecutive numbers, when the next one does not start with a sign,
+            # or with a decimal point following a number which already has one
+            if previous is not None and not previous.isalpha() and not (
+                    number.startswith('-') or (number.startswith('.') and '.' in previous)):
+                output.append(' ')
+            output.append(number)
+            token = number
+        previous = token
+    return ''.join(output)
+
+
+def makeFirstMoveAbsolute(pathData):
+    '''
+    Replace initial relative moveto of path data by an absolute one, so the path data can be appended to another path.
+    '''
+    tokens = PATH_TOKEN_RE.findall(pathData)
+    if not tokens or tokens[0] != 'm':
+        return pathData
+    # coordinates pairs following the first one of an initial moveto are relative lineto
+    numbers = 0
+    while numbers + 1 < len(tokens) and not tokens[numbers + 1].isalpha():
+        numbers += 1
+    tokens = ['M'] + tokens[1:3] + (['l'] if numbers > 2 else []) + tokens[3:]
+    return ' '.join(tokens)
+
+
+def minifyCoordinates(value, precision):
+    return NUMBER_RE.sub(lambda match: formatNumber(match.group(0), precision), value)
+
+
+def getRegionId(path):
+    # region id is held by a specific attribute when defined (path id then being unique), otherwise by path id (legacy)
+    for (name, value) in path.attrib.items():
+        if name.endswith('}regionId') or name == 'regionId':
+            return value.strip()
+    return path.get('id', '').strip()
+
+
+def mergeRegionPaths(parent):
+    '''
+    Merge sibling paths belonging to the same region and sharing the same presentation attributes into a single path,
+    located at the position of the first one. Return the number of removed paths.
+    '''
+    paths = {}
+    removed = []
+    for child in list(parent):
+        if child.tag != f"{{{SVG_NAMESPACE}}}path" or len(child):
+            continue
+        regionId = getRegionId(child)
+        if not regionId or regionId == BACKGROUND_PATHID:
+            continue
+        key = (regionId, tuple(sorted((name, value) for (name, value) in child.attrib.items() if name not in ('id', 'd'))))
+        if key in paths:
+            first = paths[key]
+            first.set('d', first.get('d', '') + makeFirstMoveAbsolute(child.get('d', '')))
+            removed.append(child)
+        else:
+            paths[key] = child
+    for child in removed:
+        parent.remove(child)
+    return len(removed)
+
+
+def registerNamespaces(data):
+    # keep original namespace prefixes (e.g. 'bma:regionId' attribute is retrieved by its prefixed name in the viewer)
+    for (_, (prefix, uri)) in ET.iterparse(io.BytesIO(data), events=('start-ns',)):
+        try:
+            ET.register_namespace(prefix, uri)
+        except ValueError:
+            # reserved prefix (ns<N>), which is generated anyway
+            pass
+
+
+def optimizeSVG(data, precision=1, mergePaths=True):
+    '''
+    Return optimized SVG document: coordinates rounded to the specified number of decimals, paths of the same region merged,
+    comments and indentation removed.
+    '''
+    registerNamespaces(data)
+    root = ET.fromstring(data)
+
+    mergedPaths = 0
+    if mergePaths:
+        for element in list(root.iter()):
+            mergedPaths += mergeRegionPaths(element)
+
+    for element in root.iter():
+        for name in COORDINATES_ATTRIBUTES:
+            value = element.get(name)
+            if value is not None:
+                element.set(name, minifyPathData(value, precision) if name == 'd' else minifyCoordinates(value, precision))
+        # whitespace only content is indentation, while actual text (e.g. region labels) is kept as is
+        if element.text is not None and not element.text.strip():
+            element.text = None
+        if element.tail is not None and not element.tail.strip():
+            element.tail = None
+    # comments are discarded by the parser
+    return (ET.tostring(root, encoding='UTF-8', xml_declaration=False), mergedPaths)
+
+
+def optimizeSVGFile(source, output, precision=1, mergePaths=True, compressions=()):
+    '''
+    Write optimized version of source SVG file to output, along with the requested pre-compressed variants (output + '.gz'...).
+    Return the sizes of the source and the generated files.
+    '''
+    with open(source, 'rb') as sourceFile:
+        data = sourceFile.read()
+    (optimized, mergedPaths) = optimizeSVG(data, precision, mergePaths)
+    with open(output, 'wb') as outputFile:
+        outputFile.write(optimized)
+
+    stats = {'bytes_read': len(data), 'bytes_written': len(optimized), 'merged_paths': mergedPaths}
+    stats.update(saveCompressedVariants(output, optimized, compressions))
+    return stats
+
+
+def saveCompressedVariants(output, data, compressions):
+    '''
+    Save pre-compressed variants of the file content (output + '.gz'...), return their sizes.
+    '''
+    stats = {}
+    for extension in compressions:
+        compressed = COMPRESSIONS[extension](data)
+        with open(f"{output}.{extension}", 'wb') as compressedFile:
+            compressedFile.write(compressed)
+        stats[f"bytes_{extension}"] = len(compressed)
+    return stats
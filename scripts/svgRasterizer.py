@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+
+import json
+import logging
+import math
+import re
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import PIL.Image
+import PIL.ImageChops
+import PIL.ImageDraw
+
+from svgOptimizer import BACKGROUND_PATHID, NUMBER_RE, PATH_TOKEN_RE, SVG_NAMESPACE, getRegionId
+
+BACKGROUND_LABEL = 'Background'
+BACKGROUND_COLOR = (0, 0, 0)
+
+# number of segments used to approximate Bezier curves
+CURVE_SEGMENTS = 8
+
+TRANSFORM_RE = re.compile(r'(matrix|translate|scale|rotate|skewX|skewY)\s*\(([^)]*)\)')
+
+
+def parseHexColor(color):
+    color = color.lstrip('#')
+    return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def makeRegionLabels(regionTreePath):
+    '''
+    Assign label values and distinct colors to the regions of the hierarchical region information resource.
+    Regions keep their own color (or the nearest ancestor's one) when it is not already used, otherwise a close color is picked,
+    since a label map color must identify a single region.
+    Return list of (label value, region abbreviation, RGB color), starting with the background (label 0).
+    '''
+    with open(regionTreePath, 'r') as regionTreeFile:
+        regions = json.load(regionTreeFile)['regions']
+    regionByAbb = {region['abb']: region for region in regions}
+
+    def getColor(region):
+        while region is not None and not region.get('color'):
+            region = regionByAbb.get(region['parent'])
+        return parseHexColor(region['color']) if region else (127, 127, 127)
+
+    labels = [(0, BACKGROUND_LABEL, BACKGROUND_COLOR)]
+    usedColors = {BACKGROUND_COLOR}
+    for region in sorted(regions, key=lambda region: region['id']):
+        abb = region['abb'].strip()
+        if any(character.isspace() for character in abb):
+            # FIXME label of color table can not contain whitespace, such region is rendered but not identified in the viewer
+            logging.warning(f"Region abbreviation containing whitespace can not be used as a label : '{abb}'")
+        color = getColor(region)
+        step = 0
+        while color in usedColors:
+            step += 1
+            color = (color[0], (color[1] + step // 256) % 256, (color[2] + step) % 256)
+        usedColors.add(color)
+        labels.append((len(labels), abb, color))
+    return labels
+
+
+def saveColorTable(filepath, labels):
+    '''
+    Save color table (.ctbl) of the label map, as expected by the viewer : "<value> <label> <R> <G> <B> <A>" lines.
+    '''
+    with open(filepath, 'w') as colorTableFile:
+        for (value, label, (red, green, blue)) in labels:
+            if not any(character.isspace() for character in label):
+                colorTableFile.write(f"{value} {label} {red} {green} {blue} {0 if value == 0 else 255}\n")
+
+
+def multiplyMatrices(first, second):
+    # affine transforms represented as (a, b, c, d, e, f), as in SVG matrix()
+    (a1, b1, c1, d1, e1, f1) = first
+    (a2, b2, c2, d2, e2, f2) = second
+    return (a1 * a2 + c1 * b2, b1 * a2 + d1 * b2,
+            a1 * c2 + c1 * d2, b1 * c2 + d1 * d2,
+            a1 * e2 + c1 * f2 + e1, b1 * e2 + d1 * f2 + f1)
+
+
+def parseTransform(value):
+    matrix = (1, 0, 0, 1, 0, 0)
+    for (name, arguments) in TRANSFORM_RE.findall(value or ''):
+        values = [float(number) for number in NUMBER_RE.findall(arguments)]
+        if name == 'matrix' and len(values) == 6:
+            transform = tuple(values)
+        elif name == 'translate':
+            transform = (1, 0, 0, 1, values[0], values[1] if len(values) > 1 else 0)
+        elif name == 'scale':
+            transform = (values[0], 0, 0, values[1] if len(values) > 1 else values[0], 0, 0)
+        elif name == 'rotate':
+            angle = math.radians(values[0])
+            (cos, sin) = (math.cos(angle), math.sin(angle))
+            transform = (cos, sin, -sin, cos, 0, 0)
+            if len(values) == 3:
+                transform = multiplyMatrices(multiplyMatrices((1, 0, 0, 1, values[1], values[2]), transform),
+                                             (1, 0, 0, 1, -values[1], -values[2]))
+        elif name == 'skewX':
+            transform = (1, 0, math.tan(math.radians(values[0])), 1, 0, 0)
+        elif name == 'skewY':
+            transform = (1, math.tan(math.radians(values[0])), 0, 1, 0, 0)
+        else:
+            continue
+        matrix = multiplyMatrices(matrix, transform)
+    return matrix
+
+
+def flattenPathData(pathData):
+    '''
+    Convert SVG path data to a list of subpaths, each being a list of (x, y) points, with curves approximated by segments.
+    '''
+    tokens = PATH_TOKEN_RE.findall(pathData)
+    subpaths = []
+    points = []
+    (x, y) = (startX, startY) = (0.0, 0.0)
+    # last control point, for smooth curves
+    control = None
+    command = None
+    index = 0
+
+    def bezier(controlPoints):
+        for step in range(1, CURVE_SEGMENTS + 1):
+            t = step / CURVE_SEGMENTS
+            if len(controlPoints) == 3:
+                coefficients = ((1 - t) ** 2, 2 * (1 - t) * t, t ** 2)
+            else:
+                coefficients = ((1 - t) ** 3, 3 * (1 - t) ** 2 * t, 3 * (1 - t) * t ** 2, t ** 3)
+            points.append((sum(c * p[0] for c, p in zip(coefficients, controlPoints)),
+                           sum(c * p[1] for c, p in zip(coefficients, controlPoints))))
+
+    while index < len(tokens):
+        if tokens[index].isalpha():
+            command = tokens[index]
+            index += 1
+            if command in 'Zz':
+                if points:
+                    subpaths.append(points)
+                points = []
+                (x, y) = (startX, startY)
+                control = None
+                continue
+        elif command is None:
+            raise ValueError("Path data must start with a command")
+
+        relative = command.islower()
+        (offsetX, offsetY) = (x, y) if relative else (0.0, 0.0)
+        argumentCount = {'m': 2, 'l': 2, 'h': 1, 'v': 1, 'c': 6, 's': 4, 'q': 4, 't': 2, 'a': 7}.get(command.lower())
+        argumentTokens = tokens[index:index + (argumentCount or 0)]
+        if not argumentCount or len(argumentTokens) < argumentCount or any(token.isalpha() for token in argumentTokens):
+            # malformed path data, remaining is ignored
+            break
+        arguments = [float(token) for token in argumentTokens]
+        index += argumentCount
+
+        lowerCommand = command.lower()
+        if lowerCommand == 'm':
+            if points:
+                subpaths.append(points)
+            (x, y) = (startX, startY) = (offsetX + arguments[0], offsetY + arguments[1])
+            points = [(x, y)]
+            # subsequent coordinates pairs are implicit lineto
+            command = 'l' if relative else 'L'
+            control = None
+            continue
+        if lowerCommand == 'l':
+            (x, y) = (offsetX + arguments[0], offsetY + arguments[1])
+            control = None
+        elif lowerCommand == 'h':
+            x = offsetX + arguments[0]
+            control = None
+        elif lowerCommand == 'v':
+            y = offsetY + arguments[0]
+            control = None
+        elif lowerCommand in 'cs':
+            if lowerCommand == 'c':
+                first = (offsetX + arguments[0], offsetY + arguments[1])
+                arguments = arguments[2:]
+            else:
+                # first control point is the reflection of the previous curve's last control point
+                first = (2 * x - control[0], 2 * y - control[1]) if control else (x, y)
+            second = (offsetX + arguments[0], offsetY + arguments[1])
+            end = (offsetX + arguments[2], offsetY + arguments[3])
+            bezier(((x, y), first, second, end))
+            control = second
+            (x, y) = end
+            continue
+        elif lowerCommand in 'qt':
+            if lowerCommand == 'q':
+                first = (offsetX + arguments[0], offsetY + arguments[1])
+                arguments = arguments[2:]
+            else:
+                first = (2 * x - control[0], 2 * y - control[1]) if control else (x, y)
+            end = (offsetX + arguments[0], offsetY + arguments[1])
+            bezier(((x, y), first, end))
+            control = first
+            (x, y) = end
+            continue
+        elif lowerCommand == 'a':
+            # FIXME elliptical arcs are approximated by a straight line to their end point
+            (x, y) = (offsetX + arguments[5], offsetY + arguments[6])
+            control = None
+        points.append((x, y))
+
+    if points:
+        subpaths.append(points)
+    return subpaths
+
+
+def parseSVGShapes(svgPath, labelByRegion, width, height, unknownRegionIds=None):
+    '''
+    Retrieve filled shapes of SVG region delineations, in the coordinates of a label map of the specified size.
+    Return list of (label value, fill rule is even-odd, subpaths as arrays of points, bounding box), in painting order.
+    Regions missing from labelByRegion are ignored, and added to the unknownRegionIds set when specified (so they can be
+    reported once for many files), or logged otherwise.
+    '''
+    root = ET.parse(svgPath).getroot()
+
+    # SVG user space is stretched over the whole image
+    viewBox = [float(value) for value in NUMBER_RE.findall(root.get('viewBox', ''))]
+    if len(viewBox) == 4:
+        (viewX, viewY, viewWidth, viewHeight) = viewBox
+    else:
+        sizes = [NUMBER_RE.match(root.get(name) or '') for name in ('width', 'height')]
+        (viewX, viewY) = (0.0, 0.0)
+        (viewWidth, viewHeight) = [float(size.group(0)) if size else default for size, default in zip(sizes, (width, height))]
+    rootMatrix = (width / viewWidth, 0, 0, height / viewHeight, -viewX * width / viewWidth, -viewY * height / viewHeight)
+
+    shapes = []
+    unknownRegions = set()
+
+    def visit(element, matrix):
+        matrix = multiplyMatrices(matrix, parseTransform(element.get('transform')))
+        for child in element:
+            if child.tag == f"{{{SVG_NAMESPACE}}}path" or child.tag == f"{{{SVG_NAMESPACE}}}polygon":
+                regionId = getRegionId(child)
+                if regionId == BACKGROUND_PATHID:
+                    continue
+                if regionId not in labelByRegion:
+                    unknownRegions.add(regionId)
+                    continue
+                childMatrix = multiplyMatrices(matrix, parseTransform(child.get('transform')))
+                if child.tag.endswith('polygon'):
+                    coordinates = [float(value) for value in NUMBER_RE.findall(child.get('points', ''))]
+                    subpaths = [list(zip(coordinates[0::2], coordinates[1::2]))]
+                else:
+                    subpaths = flattenPathData(child.get('d', ''))
+                (a, b, c, d, e, f) = childMatrix
+                arrays = []
+                for subpath in subpaths:
+                    if len(subpath) < 3:
+                        continue
+                    points = np.array(subpath, dtype=np.float64)
+                    arrays.append(np.column_stack((a * points[:, 0] + c * points[:, 1] + e,
+                                                   b * points[:, 0] + d * points[:, 1] + f)))
+                if arrays:
+                    allPoints = np.concatenate(arrays)
+                    bbox = (allPoints[:, 0].min(), allPoints[:, 1].min(), allPoints[:, 0].max(), allPoints[:, 1].max())
+                    evenOdd = (child.get('fill-rule') or '').strip() == 'evenodd'
+                    shapes.append((labelByRegion[regionId], evenOdd, arrays, bbox))
+            else:
+                visit(child, matrix)
+
+    visit(root, rootMatrix)
+    if unknownRegionIds is not None:
+        unknownRegionIds.update(unknownRegions)
+    elif unknownRegions:
+        logging.warning(f"Regions not found in region information, ignored in {svgPath} : {', '.join(sorted(unknownRegions))}")
+    return shapes
+
+
+def iterLabelMapBands(shapes, colors, width, height, bandHeight):
+    '''
+    Rasterize shapes into successive bands of bandHeight rows of the RGB label map (each label value being painted with its color).
+    Only the shapes intersecting the current band are drawn, so memory usage is proportional to the image width.
+    '''
+    for bandY in range(0, height, bandHeight):
+        bandRows = min(bandHeight, height - bandY)
+        band = PIL.Image.new('I', (width, bandRows), 0)
+        draw = PIL.ImageDraw.Draw(band)
+        for (label, evenOdd, subpaths, (minX, minY, maxX, maxY)) in shapes:
+            if maxY < bandY or minY >= bandY + bandRows or maxX < 0 or minX >= width:
+                continue
+            polygons = [[(x, y - bandY) for (x, y) in subpath.tolist()] for subpath in subpaths]
+            if len(polygons) == 1:
+                draw.polygon(polygons[0], fill=label)
+                continue
+            # with several subpaths, inner ones make holes in even-odd mode, otherwise subpaths are merged
+            mask = PIL.Image.new('1', (width, bandRows), 0)
+            for polygon in polygons:
+                subMask = PIL.Image.new('1', (width, bandRows), 0)
+                PIL.ImageDraw.Draw(subMask).polygon(polygon, fill=1)
+                mask = PIL.ImageChops.logical_xor(mask, subMask) if evenOdd else PIL.ImageChops.logical_or(mask, subMask)
+            band.paste(label, mask=mask)
+        yield colors[np.asarray(band)]
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# modules of the import scripts are imported by name, as when the scripts are run from their folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
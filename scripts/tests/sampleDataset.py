@@ -0,0 +1,31 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import tifffile
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'prepareDZImages.py')
+
+SVG = ('<?xml version="1.0"?>\n<svg xmlns="http://www.w3.org/2000/svg" width="300" height="200">'
+       '<path id="R{index}" fill="#ff0000" d="M 10 10 L 200 40 L 90 180 Z"/></svg>\n')
+
+
+def makeDataset(path):
+    '''
+    Generate a small dataset (coronal and sagittal axes, RGB and grayscale layers, an overlay) of 3 slices per axis.
+    '''
+    rng = np.random.default_rng(5)
+    for axis in ('coronal', 'sagittal'):
+        for (layer, shape) in (('layer0_Nissl', (200, 300, 3)), ('layer1_T2', (200, 300))):
+            os.makedirs(path / axis / layer)
+            for index in range(3):
+                tifffile.imwrite(path / axis / layer / f"sl_{index}.tif", rng.integers(0, 256, shape, dtype=np.uint8))
+        os.makedirs(path / axis / 'overlay0_Regions')
+        for index in range(3):
+            (path / axis / 'overlay0_Regions' / f"a_{index}.svg").write_text(SVG.format(index=index))
+
+
+def runImport(*args, check=True):
+    return subprocess.run([sys.executable, SCRIPT] + [str(arg) for arg in args], check=check, capture_output=True,
+                          text=True)
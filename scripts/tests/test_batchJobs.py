@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from prepareDZImages import arg_parser, getDatasetArgs, runBatchImport
+
+
+def parseDatasets(tmp_path, jobs, argv=()):
+    args = arg_parser().parse_args(['-b', str(tmp_path / 'jobs.json')] + list(argv))
+    return [getDatasetArgs(args, dict(jobs.get('defaults', {}), **dataset), index, args.batch)
+            for (index, dataset) in enumerate(jobs['datasets'])]
+
+
+def test_options_are_converted_like_command_line(tmp_path):
+    jobs = {
+        'defaults': {'tileformat': 'png', 'svgcompress': 'gz'},
+        'datasets': [
+            {'name': 'a', 'inputpath': 'in_a', 'outputpath': 'out_a', 'shard': '1/2', 'tilequality': '0.5'},
+            {'inputpath': 'in_b', 'outputpath': 'out_b', 'svgcompress': ['gz'], 'streaming': True,
+             'windowpercentiles': [1, 99]},
+        ]
+    }
+    (datasetA, datasetB) = parseDatasets(tmp_path, jobs, ['-s'])
+    assert datasetA.svgcompress == ['gz']
+    assert datasetA.shard == (1, 2)
+    assert datasetA.tilequality == 0.5
+    assert datasetA.tileformat == 'png'
+    assert datasetA.streaming
+    assert datasetA.batch is None
+    assert datasetB.svgcompress == ['gz']
+    assert datasetB.shard is None
+    assert datasetB.windowpercentiles == [1.0, 99.0]
+
+
+def test_flags_can_be_cleared(tmp_path):
+    jobs = {'datasets': [{'inputpath': 'in', 'outputpath': 'out', 'streaming': False}]}
+    (dataset, ) = parseDatasets(tmp_path, jobs, ['-s'])
+    assert not dataset.streaming
+
+
+@pytest.mark.parametrize('option', [
+    {'tilecontainer': 'zip'},
+    {'svgcompress': 'zz'},
+    {'shard': '3/2'},
+    {'physicalunit': 'um'},
+    {'streaming': 'yes'},
+    {'unknownoption': 1},
+    {'jobs': 4},
+])
+def test_invalid_options_are_rejected(tmp_path, option):
+    jobs = {'datasets': [dict({'inputpath': 'in', 'outputpath': 'out'}, **option)]}
+    with pytest.raises(Exception):
+        parseDatasets(tmp_path, jobs)
+
+
+def test_invalid_dataset_rejected_before_any_import(tmp_path):
+    inputPath = tmp_path / 'in'
+    inputPath.mkdir()
+    jobfile = tmp_path / 'jobs.json'
+    jobfile.write_text(json.dumps({'datasets': [
+        {'inputpath': str(inputPath), 'outputpath': str(tmp_path / 'out_a')},
+        {'inputpath': str(inputPath), 'outputpath': str(tmp_path / 'out_b'), 'svgcompress': 'zz'},
+    ]}))
+    args = arg_parser().parse_args(['-b', str(jobfile)])
+    with pytest.raises(Exception):
+        runBatchImport(args, None)
+    assert not (tmp_path / 'out_a').exists()
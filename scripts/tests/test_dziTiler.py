@@ -0,0 +1,78 @@
+import os
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import PIL.Image
+
+from dziTiler import DeepZoomTiler, DZI_NAMESPACE, getLevelCount, getLevelSize, getTileBounds
+
+
+def test_level_sizes():
+    assert getLevelCount(1, 1) == 1
+    assert getLevelCount(733, 517) == 11
+    assert getLevelSize(733, 517, 10, 11) == (733, 517)
+    assert getLevelSize(733, 517, 9, 11) == (367, 259)
+    assert getLevelSize(733, 517, 0, 11) == (1, 1)
+
+
+def test_tile_bounds_overlap_neighbours():
+    assert getTileBounds(0, 0, 733, 517, 256, 1) == (0, 0, 257, 257)
+    assert getTileBounds(1, 1, 733, 517, 256, 1) == (255, 255, 258, 258)
+    assert getTileBounds(2, 2, 733, 517, 256, 1) == (511, 511, 222, 6)
+
+
+def test_pyramid_tiles(tmp_path):
+    (width, height) = (733, 517)
+    image = np.random.default_rng(2).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    destination = str(tmp_path / 'slice.dzi')
+    DeepZoomTiler(tile_format='png').createFromArray(image, destination)
+
+    descriptor = ET.parse(destination).getroot()
+    assert descriptor.tag == f"{{{DZI_NAMESPACE}}}Image"
+    assert (descriptor.get('TileSize'), descriptor.get('Overlap'), descriptor.get('Format')) == ('256', '1', 'png')
+    size = descriptor.find(f"{{{DZI_NAMESPACE}}}Size")
+    assert (size.get('Width'), size.get('Height')) == (str(width), str(height))
+
+    tilesPath = tmp_path / 'slice_files'
+    levelCount = getLevelCount(width, height)
+    assert sorted(int(level) for level in os.listdir(tilesPath)) == list(range(levelCount))
+    for level in range(levelCount):
+        (levelWidth, levelHeight) = getLevelSize(width, height, level, levelCount)
+        (columns, rows) = (-(-levelWidth // 256), -(-levelHeight // 256))
+        assert len(os.listdir(tilesPath / str(level))) == columns * rows
+        for column in range(columns):
+            for row in range(rows):
+                with PIL.Image.open(tilesPath / str(level) / f"{column}_{row}.png") as tile:
+                    (_, _, tileWidth, tileHeight) = getTileBounds(column, row, levelWidth, levelHeight, 256, 1)
+                    assert tile.size == (tileWidth, tileHeight)
+
+    # finest level tiles hold the image pixels (lossless format)
+    for (column, row) in ((0, 0), (1, 1), (2, 2)):
+        (x, y, tileWidth, tileHeight) = getTileBounds(column, row, width, height, 256, 1)
+        with PIL.Image.open(tilesPath / str(levelCount - 1) / f"{column}_{row}.png") as tile:
+            assert np.array_equal(np.asarray(tile), image[y:y + tileHeight, x:x + tileWidth])
+
+
+def test_odd_level_keeps_border_pixels(tmp_path):
+    # 3x1 image is reduced to 2x1, last column replicated before averaging
+    image = np.array([[0, 100, 200]], np.uint8)
+    DeepZoomTiler(tile_format='png').createFromArray(image, str(tmp_path / 'slice.dzi'))
+    with PIL.Image.open(tmp_path / 'slice_files' / '1' / '0_0.png') as tile:
+        assert np.asarray(tile).tolist() == [[50, 200]]
+
+
+
+def test_uniform_tiles_are_counted_as_duplicates(tmp_path):
+    tiler = DeepZoomTiler(tile_format='png')
+    tiler.createFromArray(np.random.default_rng(4).integers(0, 256, (600, 600), dtype=np.uint8),
+                          str(tmp_path / 'noise.dzi'))
+    assert (tiler.stats['duplicate_tiles'], tiler.stats['duplicate_bytes']) == (0, 0)
+
+    # every tile of a blank image is uniform : its 29 tiles have 13 distinct sizes, hence 16 duplicates
+    tiler = DeepZoomTiler(tile_format='png')
+    tiler.createFromArray(np.zeros((1024, 1024), np.uint8), str(tmp_path / 'blank.dzi'))
+    assert (tiler.stats['tiles'], tiler.stats['duplicate_tiles']) == (29, 16)
+    assert tiler.stats['duplicate_bytes'] > 0
+    for tile in (tmp_path / 'blank_files' / '10').iterdir():
+        with PIL.Image.open(tile) as image:
+            assert not np.asarray(image).any()
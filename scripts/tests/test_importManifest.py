@@ -0,0 +1,58 @@
+import os
+
+from importManifest import ImportManifest, MANIFEST_FILENAME, getFileInfo, getFileDigest
+
+PARAMS = {'format': 'jpg', 'quality': 0.9, 'crop': None}
+
+
+def recordOutput(tmp_path, content=b'slice'):
+    source = tmp_path / 'slice.tif'
+    source.write_bytes(content)
+    output = tmp_path / 'out' / '0.dzi'
+    output.parent.mkdir(exist_ok=True)
+    output.write_text('dzi')
+    manifest = ImportManifest(str(tmp_path / 'out'))
+    manifest.record(str(output), dict(getFileInfo(str(source)), hash=getFileDigest(str(source))), PARAMS)
+    manifest.close()
+    return (str(source), str(output))
+
+
+def test_unchanged_output_is_skipped(tmp_path):
+    (source, output) = recordOutput(tmp_path)
+    manifest = ImportManifest(str(tmp_path / 'out'))
+    assert manifest.isUpToDate(output, source, PARAMS)
+    assert not manifest.isUpToDate(output, source, dict(PARAMS, quality=0.8))
+    assert not ImportManifest(str(tmp_path / 'out'), reuse=False).isUpToDate(output, source, PARAMS)
+
+
+def test_changed_source_is_regenerated(tmp_path):
+    (source, output) = recordOutput(tmp_path)
+    with open(source, 'wb') as file:
+        file.write(b'SLICE')
+    os.utime(source, ns=(0, 1))
+    assert not ImportManifest(str(tmp_path / 'out')).isUpToDate(output, source, PARAMS)
+
+
+def test_touched_source_with_same_content_is_skipped(tmp_path):
+    (source, output) = recordOutput(tmp_path)
+    os.utime(source, ns=(0, 1))
+    manifest = ImportManifest(str(tmp_path / 'out'))
+    assert manifest.isUpToDate(output, source, PARAMS)
+    manifest.close()
+    # new modification time is recorded, so content is not hashed again
+    assert ImportManifest(str(tmp_path / 'out')).entries['0.dzi']['source']['mtime'] == 1
+
+
+def test_missing_output_is_regenerated(tmp_path):
+    (source, output) = recordOutput(tmp_path)
+    os.remove(output)
+    assert not ImportManifest(str(tmp_path / 'out')).isUpToDate(output, source, PARAMS)
+
+
+def test_truncated_entry_is_ignored(tmp_path):
+    (source, output) = recordOutput(tmp_path)
+    with open(tmp_path / 'out' / MANIFEST_FILENAME, 'a') as manifest:
+        manifest.write('{"output": "1.dzi", "sou')
+    manifest = ImportManifest(str(tmp_path / 'out'))
+    assert manifest.isUpToDate(output, source, PARAMS)
+    assert '1.dzi' not in manifest.entries
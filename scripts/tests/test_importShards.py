@@ -0,0 +1,37 @@
+import filecmp
+import os
+
+import pytest
+
+from importManifest import ImportManifest
+from sampleDataset import makeDataset, runImport
+
+# bookkeeping files whose content depends on the import history (e.g. timestamps, order of the entries)
+BOOKKEEPING = ('import_manifest.jsonl', 'scan_cache.json', 'import_shards')
+
+
+def compareFolders(comparison, path=''):
+    differences = [os.path.join(path, name) for name in comparison.diff_files + comparison.funny_files]
+    differences += [os.path.join(path, name) for name in comparison.left_only + comparison.right_only
+                    if name not in BOOKKEEPING and not name.startswith('viewer.json2')]
+    for (name, subComparison) in comparison.subdirs.items():
+        differences += compareFolders(subComparison, os.path.join(path, name))
+    return differences
+
+
+@pytest.mark.parametrize('container', ['files', 'archive'])
+def test_merged_shards_match_single_import(tmp_path, container):
+    makeDataset(tmp_path / 'in')
+    for name in ('single', 'sharded'):
+        os.makedirs(tmp_path / name)
+
+    runImport('-i', tmp_path / 'in', '-o', tmp_path / 'single', '-c', container)
+    for shard in (1, 2, 3):
+        runImport('-i', tmp_path / 'in', '-o', tmp_path / 'sharded', '-c', container, '--shard', f"{shard}/3")
+    runImport('-i', tmp_path / 'in', '-o', tmp_path / 'sharded', '--merge')
+
+    comparison = filecmp.dircmp(tmp_path / 'single', tmp_path / 'sharded', ignore=list(BOOKKEEPING))
+    assert compareFolders(comparison) == []
+    single = ImportManifest(str(tmp_path / 'single')).entries
+    sharded = ImportManifest(str(tmp_path / 'sharded')).entries
+    assert sharded == single
@@ -0,0 +1,25 @@
+import json
+import os
+
+from sampleDataset import SVG, makeDataset, runImport
+
+
+def test_overlay_failure_does_not_stop_slices(tmp_path):
+    makeDataset(tmp_path / 'in')
+    badOverlay = tmp_path / 'in' / 'coronal' / 'overlay0_Regions' / 'a_1.svg'
+    badOverlay.write_text('<svg xmlns="http://www.w3.org/2000/svg"><path d="M 0 0 L')
+    os.makedirs(tmp_path / 'out')
+
+    # overlays are optimized, so the truncated one can not be parsed
+    result = runImport('-i', tmp_path / 'in', '-o', tmp_path / 'out', '--svgprecision', '2', check=False)
+    assert result.returncode != 0
+    assert '1 overlay image(s) could not be processed' in result.stderr
+    with open(tmp_path / 'out' / 'import_manifest.jsonl', 'r') as manifest:
+        outputs = set(json.loads(line)['output'] for line in manifest)
+    # every slice is tiled, and every other overlay is processed
+    assert sum(output.endswith('.dzi') for output in outputs) == 12
+    assert sum(output.endswith('.svg') for output in outputs) == 5
+
+    badOverlay.write_text(SVG.format(index=1))
+    result = runImport('-i', tmp_path / 'in', '-o', tmp_path / 'out', '--svgprecision', '2')
+    assert '12 slice image(s) already up-to-date' in result.stdout
@@ -0,0 +1,32 @@
+import os
+
+import numpy as np
+
+from subviewVolume import SubviewVolume, SUBVIEW_SIZE
+
+
+def test_modified_volume_is_not_reused_until_saved(tmp_path):
+    thumbnail = np.full((SUBVIEW_SIZE, SUBVIEW_SIZE, 3), 128, np.uint8)
+    volume = SubviewVolume('coronal', 3, str(tmp_path))
+    assert not volume.reused
+    volume.setSlice(1, thumbnail)
+    volume.save()
+
+    volume = SubviewVolume('coronal', 3, str(tmp_path))
+    assert volume.reused
+    assert np.array_equal(volume.volume[1], thumbnail)
+
+    # import interrupted after a slice was regenerated (and recorded in the manifest), before the volume was saved
+    volume.setSlice(2, thumbnail)
+    assert not os.path.exists(volume.filepath)
+    assert not SubviewVolume('coronal', 3, str(tmp_path)).reused
+
+    volume.save()
+    assert SubviewVolume('coronal', 3, str(tmp_path)).reused
+
+
+def test_volume_with_other_slice_count_is_not_reused(tmp_path):
+    volume = SubviewVolume('sagittal', 3, str(tmp_path))
+    volume.setSlice(0, np.zeros((SUBVIEW_SIZE, SUBVIEW_SIZE, 3), np.uint8))
+    volume.save()
+    assert not SubviewVolume('sagittal', 4, str(tmp_path)).reused
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+import tifffile
+
+from dziTiler import iterTiffRowBands
+
+
+def makeImage():
+    return np.random.default_rng(3).integers(0, 256, (517, 733, 3), dtype=np.uint8)
+
+
+@pytest.mark.parametrize('planarconfig', ['contig', 'separate'])
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_row_bands_match_image(tmp_path, planarconfig, compression):
+    image = makeImage()
+    source = str(tmp_path / 'image.tif')
+    # separated color planes are written from (samples, height, width) data
+    data = np.moveaxis(image, -1, 0) if planarconfig == 'separate' else image
+    tifffile.imwrite(source, data, photometric='rgb', planarconfig=planarconfig, compression=compression,
+                     rowsperstrip=16)
+
+    crop = (40, 60, 200, 133)
+    bands = list(iterTiffRowBands(source, 50, crop))
+    assert all(band.shape[1:] == (200, 3) for band in bands)
+    assert np.array_equal(np.concatenate(bands), image[60:193, 40:240])
+
+    assert np.array_equal(np.concatenate(list(iterTiffRowBands(source, 64))), image)
@@ -0,0 +1,55 @@
+import numpy as np
+import PIL.Image
+import tifffile
+
+from dziTiler import DeepZoomTiler
+from tileCompositor import createCompositeImage, blendRows
+
+
+def makeSlice(path, shape, seed):
+    image = np.random.default_rng(seed).integers(0, 256, shape, dtype=np.uint8)
+    tifffile.imwrite(path, image, rowsperstrip=32)
+    return image
+
+
+def getSlice(path, image, crop=None, window=None):
+    (height, width) = (crop[3], crop[2]) if crop else image.shape[:2]
+    return {'source': str(path), 'crop': crop, 'width': width, 'height': height, 'window': window}
+
+
+def readTile(path):
+    with PIL.Image.open(path) as tile:
+        return np.asarray(tile)
+
+
+def test_opaque_layer_is_encoded_once(tmp_path):
+    # composite of a single opaque layer is tiled exactly as the layer itself, even in a lossy format
+    image = makeSlice(tmp_path / 'nissl.tif', (600, 700, 3), 1)
+    DeepZoomTiler(tile_format='jpg', image_quality=0.8).createStreaming(str(tmp_path / 'nissl.tif'),
+                                                                        str(tmp_path / 'layer.dzi'))
+    createCompositeImage([getSlice(tmp_path / 'nissl.tif', image), getSlice(tmp_path / 'nissl.tif', image)], [1.0, 0.0],
+                         str(tmp_path / 'composite.dzi'), 'jpg', 0.8)
+    for tile in ('10/0_0.jpg', '10/2_2.jpg', '8/0_0.jpg'):
+        assert (tmp_path / 'composite_files' / tile).read_bytes() == (tmp_path / 'layer_files' / tile).read_bytes()
+
+
+def test_layers_are_blended_from_sources(tmp_path):
+    nissl = makeSlice(tmp_path / 'nissl.tif', (600, 700, 3), 2)
+    t2 = makeSlice(tmp_path / 't2.tif', (650, 720), 3)
+    crop = (10, 20, 700, 600)
+    createCompositeImage([getSlice(tmp_path / 'nissl.tif', nissl), getSlice(tmp_path / 't2.tif', t2, crop)], [1.0, 0.4],
+                         str(tmp_path / 'composite.dzi'), 'png', 1.0)
+    expected = blendRows([nissl, t2[20:620, 10:710]], [1.0, 0.4])
+    assert np.array_equal(readTile(tmp_path / 'composite_files' / '10' / '0_0.png'), expected[:257, :257])
+    assert np.array_equal(readTile(tmp_path / 'composite_files' / '10' / '2_2.png'), expected[511:, 511:])
+
+
+def test_smaller_layer_is_stretched_to_reference_width(tmp_path):
+    nissl = makeSlice(tmp_path / 'nissl.tif', (600, 700), 4)
+    # half size layer, uniform so that it is not altered by resampling
+    t2 = np.full((300, 350), 200, np.uint8)
+    tifffile.imwrite(tmp_path / 't2.tif', t2, rowsperstrip=32)
+    createCompositeImage([getSlice(tmp_path / 'nissl.tif', nissl), getSlice(tmp_path / 't2.tif', t2)], [1.0, 1.0],
+                         str(tmp_path / 'composite.dzi'), 'png', 1.0)
+    for tile in ('0_0', '2_2'):
+        assert (readTile(tmp_path / 'composite_files' / '10' / f"{tile}.png") == 200).all()
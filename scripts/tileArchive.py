@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+import json
+import os
+import struct
+
+# Tile archive layout:
+#   [tile data ...][index (JSON)][footer]
+# where the index maps "<level>/<column>_<row>" to [offset, length] of the tile data,
+# and the footer contains the offset and length of the index followed by the magic string.
+ARCHIVE_EXTENSION = '.dza'
+ARCHIVE_MAGIC = b'ZAVTILES'
+FOOTER_FORMAT = '<QQ8s'
+FOOTER_SIZE = struct.calcsize(FOOTER_FORMAT)
+
+
+def getArchivePath(descriptorPath):
+    # archive is stored next to the .dzi descriptor, in place of the tiles folder
+    return os.path.splitext(descriptorPath)[0] + ARCHIVE_EXTENSION
+
+
+def getTileKey(level, column, row):
+    return f"{level}/{column}_{row}"
+
+
+class TileArchiveWriter(object):
+    '''
+    Pack all tiles of a Deep Zoom image in a single file, indexed by byte offset.
+    Tiles written with the same content key share the data of the first one.
+    The archive is written in a temporary file, renamed once complete.
+    When an output sink is specified, offsets of the tiles are assigned as they are stored, while their data is written
+    behind (possibly concurrently, each tile having its own range of the file).
+    '''
+
+    def __init__(self, path, tile_format, sink=None):
+        self.path = path
+        self.tempPath = path + '.tmp'
+        self.sink = sink
+        self.file = open(self.tempPath, 'wb')
+        self.offset = 0
+        self.index = {'format': tile_format, 'tiles': {}}
+        self.written = {}
+
+    def write(self, level, column, row, data, key=None):
+        '''
+        Store tile data, return False if it was stored as a duplicate of a previous tile with the same key.
+        '''
+        if key is not None and key in self.written:
+            self.index['tiles'][getTileKey(level, column, row)] = self.written[key]
+            return False
+        location = [self.offset, len(data)]
+        if self.sink:
+            self.sink.writeAt(self.file.fileno(), data, self.offset)
+        else:
+            self.file.write(data)
+        self.index['tiles'][getTileKey(level, column, row)] = location
+        self.offset += len(data)
+        if key is not None:
+            self.written[key] = location
+        return True
+
+    def close(self):
+        if self.sink:
+            try:
+                self.sink.flush()
+            except Exception:
+                self.file.close()
+                raise
+            # tiles data was written at explicit offsets, without moving the file position
+            self.file.seek(self.offset)
+        indexData = json.dumps(self.index, separators=(',', ':')).encode('UTF-8')
+        self.file.write(indexData)
+        self.file.write(struct.pack(FOOTER_FORMAT, self.offset, len(indexData), ARCHIVE_MAGIC))
+        self.file.close()
+        os.replace(self.tempPath, self.path)
+
+
+class TileArchive(object):
+    '''
+    Read access to the tiles of an archive, each tile being retrieved by a single ranged read.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        try:
+            fileSize = os.fstat(self.fd).st_size
+            (indexOffset, indexLength, magic) = struct.unpack(
+                FOOTER_FORMAT, os.pread(self.fd, FOOTER_SIZE, fileSize - FOOTER_SIZE))
+            if magic != ARCHIVE_MAGIC:
+                raise ValueError(f"Not a tile archive : {path}")
+            self.index = json.loads(os.pread(self.fd, indexLength, indexOffset))
+        except Exception:
+            os.close(self.fd)
+            raise
+        self.format = self.index['format']
+
+    def read(self, level, column, row):
+        '''
+        Return tile data, or None if there is no such tile in the archive.
+        '''
+        location = self.index['tiles'].get(getTileKey(level, column, row))
+        if location is None:
+            return None
+        (offset, length) = location
+        return os.pread(self.fd, length, offset)
+
+    def close(self):
+        os.close(self.fd)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+import math
+
+import numpy as np
+import PIL.Image
+
+from dziTiler import DeepZoomTiler, iterTiffRowBands
+from sliceStack import readStackLayout
+
+
+class SliceReader(object):
+    '''
+    Read access to the rows of a (cropped) TIFF slice, converted to 8-bit values as in the tiles of its layer (through the
+    intensity window of the layer, palette images being converted to RGB); the slice is decoded by bands of rows, of
+    which only the rows not yet requested are kept, since rows are requested from top to bottom.
+    '''
+
+    def __init__(self, source, crop, width, height, window=None):
+        self.width = width
+        self.height = height
+        # tiles of the composite layer are 8-bit, whatever the tile format
+        converter = DeepZoomTiler(tile_format='jpg', window=window)
+        colormap = readStackLayout(source)[2]
+        self.bands = (converter.toTileArray(band, False, colormap) for band in iterTiffRowBands(source, 256, crop))
+        self.rows = None
+        self.rowsY = 0
+
+    def readRows(self, y, height):
+        '''
+        Return rows [y, y + height) of the slice (fewer rows beyond the bottom of the slice).
+        '''
+        while self.rows is None or self.rowsY + len(self.rows) < min(y + height, self.height):
+            band = next(self.bands)
+            self.rows = band if self.rows is None else np.concatenate([self.rows, band])
+        if y > self.rowsY:
+            # rows above the requested ones are not needed anymore
+            self.rows = self.rows[y - self.rowsY:]
+            self.rowsY = y
+        return self.rows[y - self.rowsY:y + height - self.rowsY]
+
+
+def matchChannels(arrays):
+    # grayscale arrays are expanded to the number of channels of the others (e.g. grayscale layer blended with RGB one)
+    channels = max(array.shape[2] if array.ndim == 3 else 1 for array in arrays)
+    if channels == 1:
+        return arrays
+    return [np.repeat(array[..., np.newaxis], channels, axis=2) if array.ndim == 2 else array for array in arrays]
+
+
+def readLayerRows(reader, width, height, y, rowCount):
+    '''
+    Return rows [y, y + rowCount) of the composite image of size (width, height), taken from a layer slice; slices of
+    another size are resampled, since the viewer displays all layers stretched to the width of the reference layer
+    (rows beyond the layer slice are left black).
+    '''
+    if (reader.width, reader.height) == (width, height):
+        return reader.readRows(y, rowCount)
+
+    scale = reader.width / width
+    (fromY, toY) = (y * scale, min((y + rowCount) * scale, reader.height))
+    if fromY >= toY:
+        return np.zeros((rowCount, width), np.uint8)
+    firstRow = int(fromY)
+    rows = reader.readRows(firstRow, int(math.ceil(toY)) - firstRow)
+    resizedHeight = min(rowCount, max(1, int(round((toY - fromY) / scale))))
+    resized = np.asarray(PIL.Image.fromarray(rows).resize(
+        (width, resizedHeight), PIL.Image.BILINEAR, box=(0, fromY - firstRow, reader.width, toY - firstRow)))
+    if resizedHeight == rowCount:
+        return resized
+    padded = np.zeros((rowCount,) + resized.shape[1:], np.uint8)
+    padded[:resizedHeight] = resized
+    return padded
+
+
+def blendRows(layerRows, opacities):
+    '''
+    Blend rows of the layers, from bottom to top, each layer being drawn with its opacity (0 to 1) over the ones below
+    (the bottom one over a black background).
+    '''
+    layerRows = matchChannels(layerRows)
+    composite = np.zeros(layerRows[0].shape, np.float32)
+    for (rows, opacity) in zip(layerRows, opacities):
+        composite = composite * (1 - opacity) + rows.astype(np.float32) * opacity
+    return np.clip(composite + 0.5, 0, 255).astype(np.uint8)
+
+
+def getVisibleLayers(opacities):
+    '''
+    Return indexes of the layers (ordered from bottom to top) visible in the composite image, i.e. not transparent,
+    and not below an opaque layer.
+    '''
+    opaque = [index for (index, opacity) in enumerate(opacities) if opacity >= 1]
+    bottom = opaque[-1] if opaque else 0
+    return [index for (index, opacity) in enumerate(opacities) if index >= bottom and opacity > 0]
+
+
+def createCompositeImage(slices, opacities, destination, tile_format, image_quality, tile_container='files',
+                         encode_threads=1, write_threads=0):
+    '''
+    Create Deep Zoom image blending the slices of the layers (ordered from bottom to top) with their opacities, with the
+    size of the first (reference) slice. Slices are specified as dict with source, crop, width, height and window, as the
+    slice tasks of their layers.
+    Layers are blended from their decoded source slices, by bands of rows, rather than from their tiles, so the
+    composite tiles are encoded only once (blending already encoded tiles would add the loss of a second encoding to
+    lossy tile formats); the pyramid levels are then downsampled from the blended image.
+    Slices of the layers which are not visible in the composite image are not read at all.
+    Return tiling statistics, as DeepZoomTiler.stats (time spent reading and blending slices being the read time).
+    '''
+    reference = slices[0]
+    (width, height) = (reference['width'], reference['height'])
+    visible = getVisibleLayers(opacities)
+    readers = {index: SliceReader(slices[index]['source'], slices[index]['crop'], slices[index]['width'],
+                                  slices[index]['height'], slices[index]['window'])
+               for index in visible}
+    tiler = DeepZoomTiler(tile_size=256, tile_overlap=1, tile_format=tile_format, image_quality=image_quality,
+                          tile_container=tile_container, encode_threads=encode_threads, write_threads=write_threads)
+
+    def readBands():
+        for y in range(0, height, tiler.tile_size):
+            rowCount = min(tiler.tile_size, height - y)
+            layerRows = [readLayerRows(readers[index], width, height, y, rowCount) for index in visible]
+            if len(visible) == 1 and opacities[visible[0]] >= 1:
+                yield layerRows[0]
+            else:
+                yield blendRows(layerRows, [opacities[index] for index in visible])
+
+    tiler.createFromRowBands(readBands(), width, height, destination)
+    return tiler.stats
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+import collections
+import functools
+import json
+import logging
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from dziTiler import (DeepZoomTiler, LABELMAP_FORMATS, applyColormap, getLevelCount, getLevelSize, getTileBounds,
+                      iterTiffRowBands)
+from imageResize import reduceBandsByArea
+
+# sources of the slices whose tiles are rendered on demand, saved in the output folder by prepareDZImages.py --ondemand
+ONDEMAND_SOURCES_FILENAME = 'ondemand_sources.json'
+
+# levels up to that many pixels are rendered entirely (and kept in memory) to cut their tiles, while tiles of finer
+# levels are rendered from the intersecting region of the source image only
+COARSE_LEVEL_PIXELS = 2048 * 2048
+
+# number of coarse level images kept in memory
+COARSE_LEVELS_CACHED = 32
+
+
+def loadOnDemandSources(data_path):
+    '''
+    Return sources of the slices rendered on demand, by path of their Deep Zoom descriptor (relative to data_path).
+    '''
+    filepath = os.path.join(data_path, ONDEMAND_SOURCES_FILENAME)
+    if not os.path.isfile(filepath):
+        return {}
+    with open(filepath, 'r') as sourcesFile:
+        return json.load(sourcesFile)
+
+
+def isLabelMapEntry(entry):
+    # palette images are only kept as label maps in tile formats able to store them
+    return entry['colormap'] is not None and entry['format'] in LABELMAP_FORMATS
+
+
+def readRegion(entry, box, factor):
+    '''
+    Read the box (x, y, width, height) of a slice, in full resolution coordinates of the (cropped) slice, downsampled by
+    factor: pixels are averaged, except for label maps (palette images) whose pixels are picked; other palette images
+    are converted to RGB beforehand, as when they are tiled by DeepZoomTiler.
+    '''
+    (cropX, cropY) = entry['crop'][:2] if entry['crop'] else (0, 0)
+    (x, y, width, height) = box
+    bands = iterTiffRowBands(entry['source'], 256, (cropX + x, cropY + y, width, height))
+    if isLabelMapEntry(entry):
+        bands = list(bands)
+        return np.concatenate(bands)[::factor, ::factor]
+    if entry['colormap'] is not None:
+        bands = (applyColormap(band, entry['colormap']) for band in bands)
+    return reduceBandsByArea(bands, factor)
+
+
+@functools.lru_cache(maxsize=COARSE_LEVELS_CACHED)
+def getLevelArray(entryKey, entryJSON, level):
+    '''
+    Return pixel array of a coarse level, derived from the finest coarse level which is read from the source image.
+    Slice entry is passed serialized, so it is part of the cache key.
+    '''
+    entry = json.loads(entryJSON)
+    (width, height) = (entry['width'], entry['height'])
+    levelCount = getLevelCount(width, height)
+    finestCoarseLevel = getCoarseLevel(width, height)
+    if level == finestCoarseLevel:
+        return readRegion(entry, (0, 0, width, height), 2 ** (levelCount - 1 - level))
+    array = getLevelArray(entryKey, entryJSON, finestCoarseLevel)
+    factor = 2 ** (finestCoarseLevel - level)
+    if isLabelMapEntry(entry):
+        return array[::factor, ::factor]
+    return reduceBandsByArea([array], factor)
+
+
+def getCoarseLevel(width, height):
+    # finest level small enough to be entirely rendered
+    levelCount = getLevelCount(width, height)
+    for level in range(levelCount - 1, -1, -1):
+        (levelWidth, levelHeight) = getLevelSize(width, height, level, levelCount)
+        if levelWidth * levelHeight <= COARSE_LEVEL_PIXELS:
+            return level
+    return 0
+
+
+def renderTile(entryKey, entry, level, column, row):
+    '''
+    Render and encode a tile of a slice, as it would have been generated by DeepZoomTiler.
+    Return None when the tile does not exist.
+    '''
+    (width, height) = (entry['width'], entry['height'])
+    tiler = DeepZoomTiler(tile_format=entry['format'], image_quality=entry['quality'], window=entry['window'])
+    levelCount = getLevelCount(width, height)
+    if level >= levelCount:
+        return None
+    (levelWidth, levelHeight) = getLevelSize(width, height, level, levelCount)
+    (x, y, tileWidth, tileHeight) = getTileBounds(column, row, levelWidth, levelHeight, tiler.tile_size, tiler.tile_overlap)
+    if tileWidth <= 0 or tileHeight <= 0:
+        return None
+
+    if level <= getCoarseLevel(width, height):
+        array = getLevelArray(entryKey, json.dumps(entry, sort_keys=True), level)[y:y + tileHeight, x:x + tileWidth]
+    else:
+        factor = 2 ** (levelCount - 1 - level)
+        box = (x * factor, y * factor, min(tileWidth * factor, width - x * factor), min(tileHeight * factor, height - y * factor))
+        array = readRegion(entry, box, factor)
+
+    (isLabelMap, palette) = tiler.getTiffPalette(entry['colormap'])
+    if isLabelMap:
+        tiler.lossless = True
+    # pixels of other palette images were already converted to RGB
+    return tiler.encodeTile(tiler.toTileArray(array, isLabelMap), palette)
+
+
+class TileCache(object):
+    '''
+    Bounded least recently used cache of encoded tiles, in memory and on disk (in cache_path): tiles evicted from memory
+    remain available on disk until the disk cache is full.
+    Disk cache is cleared when it was filled from other sources (version, e.g. modification time of the sources file).
+    '''
+
+    def __init__(self, cache_path, memoryBytes, diskBytes, version):
+        self.cache_path = cache_path
+        self.memoryBytes = memoryBytes
+        self.diskBytes = diskBytes
+        self.memory = collections.OrderedDict()
+        self.memorySize = 0
+        self.disk = collections.OrderedDict()
+        self.diskSize = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0}
+
+        versionPath = os.path.join(cache_path, 'version')
+        previousVersion = None
+        if os.path.isfile(versionPath):
+            with open(versionPath, 'r') as versionFile:
+                previousVersion = versionFile.read()
+        if previousVersion != str(version):
+            shutil.rmtree(cache_path, ignore_errors=True)
+            os.makedirs(cache_path, exist_ok=True)
+            with open(versionPath, 'w') as versionFile:
+                versionFile.write(str(version))
+        else:
+            # least recently used tiles are the least recently modified files
+            files = []
+            for (folder, _, filenames) in os.walk(cache_path):
+                for filename in filenames:
+                    filepath = os.path.join(folder, filename)
+                    if filepath != versionPath:
+                        stat = os.stat(filepath)
+                        files.append((stat.st_mtime_ns, os.path.relpath(filepath, cache_path), stat.st_size))
+            for (_, key, size) in sorted(files):
+                self.disk[key] = size
+                self.diskSize += size
+
+    def get(self, key):
+        with self.lock:
+            data = self.memory.get(key)
+            if data is not None:
+                self.memory.move_to_end(key)
+                self.stats['hits'] += 1
+                return data
+            if key not in self.disk:
+                self.stats['misses'] += 1
+                return None
+            self.disk.move_to_end(key)
+            self.stats['disk_hits'] += 1
+        filepath = os.path.join(self.cache_path, key)
+        try:
+            with open(filepath, 'rb') as tileFile:
+                data = tileFile.read()
+            os.utime(filepath)
+        except OSError:
+            return None
+        self.putInMemory(key, data)
+        return data
+
+    def put(self, key, data):
+        self.putInMemory(key, data)
+        filepath = os.path.join(self.cache_path, key)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        tempFilepath = f"{filepath}.{threading.get_ident()}.tmp"
+        with open(tempFilepath, 'wb') as tileFile:
+            tileFile.write(data)
+        os.replace(tempFilepath, filepath)
+        evicted = []
+        with self.lock:
+            self.diskSize += len(data) - self.disk.pop(key, 0)
+            self.disk[key] = len(data)
+            while self.diskSize > self.diskBytes and len(self.disk) > 1:
+                (evictedKey, size) = self.disk.popitem(last=False)
+                self.diskSize -= size
+                evicted.append(evictedKey)
+        for evictedKey in evicted:
+            try:
+                os.remove(os.path.join(self.cache_path, evictedKey))
+            except OSError:
+                pass
+
+    def putInMemory(self, key, data):
+        with self.lock:
+            self.memorySize += len(data) - len(self.memory.pop(key, b''))
+            self.memory[key] = data
+            while self.memorySize > self.memoryBytes and len(self.memory) > 1:
+                (_, evicted) = self.memory.popitem(last=False)
+                self.memorySize -= len(evicted)
+
+
+class OnDemandTiles(object):
+    '''
+    Tiles of the slices prepared with prepareDZImages.py --ondemand, rendered from their source images when first
+    requested, and then kept in the tile cache.
+    '''
+
+    def __init__(self, data_path, cache_path, memoryBytes, diskBytes):
+        self.data_path = data_path
+        self.sources = loadOnDemandSources(data_path)
+        sourcesPath = os.path.join(data_path, ONDEMAND_SOURCES_FILENAME)
+        version = os.stat(sourcesPath).st_mtime_ns if os.path.isfile(sourcesPath) else None
+        self.cache = TileCache(cache_path, memoryBytes, diskBytes, version)
+
+    def getTile(self, slicePath, level, column, row, tileFormat):
+        '''
+        Return encoded tile of the slice (path of its descriptor without extension, relative to data path), or None
+        when the slice is not rendered on demand, or the tile does not exist.
+        '''
+        entryKey = slicePath + '.dzi'
+        entry = self.sources.get(entryKey)
+        if entry is None or entry['format'] != tileFormat:
+            return None
+        key = f"{slicePath}_files/{level}/{column}_{row}.{tileFormat}"
+        data = self.cache.get(key)
+        if data is None:
+            data = renderTile(entryKey, entry, level, column, row)
+            if data is not None:
+                self.cache.put(key, data)
+        return data
+
+    def warmUp(self, plane, slide, neighbours=1):
+        '''
+        Render tiles of the coarse levels of the specified slice and its neighbours, for every layer.
+        '''
+        for (entryKey, entry) in self.sources.items():
+            parts = entryKey.split('/')
+            index = int(os.path.splitext(parts[-1])[0])
+            # slices are in a folder named after their axis in multi-plane datasets
+            if (len(parts) > 2 and parts[-2] != plane) or abs(index - slide) > neighbours:
+                continue
+            slicePath = os.path.splitext(entryKey)[0]
+            try:
+                self.warmUpSlice(slicePath, entry)
+            except Exception as error:
+                logging.warning(f"Failed to render tiles of {slicePath} : {error}")
+
+    def warmUpSlice(self, slicePath, entry):
+        (width, height) = (entry['width'], entry['height'])
+        levelCount = getLevelCount(width, height)
+        for level in range(getCoarseLevel(width, height) + 1):
+            (levelWidth, levelHeight) = getLevelSize(width, height, level, levelCount)
+            for row in range(-(-levelHeight // 256)):
+                for column in range(-(-levelWidth // 256)):
+                    self.getTile(slicePath, level, column, row, entry['format'])
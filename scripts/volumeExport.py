@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+
+import json
+import logging
+import os
+import shutil
+import zlib
+
+import numpy as np
+
+from dziTiler import iterTiffRowBands
+from imageResize import reduceBlocks
+from importManifest import getFileInfo
+from intensityWindow import getSourcesDigest
+
+# volumes are saved in a sub-folder of the output folder, as a zarr (v2) group with one multiscale array per layer
+VOLUMES_FOLDERNAME = 'volumes'
+
+# shape of the chunks (slices, rows, columns): slices of typical datasets are much thicker than their pixels, hence
+# chunks are flat, and levels are only downsampled in the slice plane
+CHUNK_SHAPE = (32, 128, 128)
+
+COMPRESSION_LEVEL = 5
+
+
+def getLevelShapes(sliceCount, height, width):
+    '''
+    Return shape (slices, rows, columns) of every resolution level of a volume, each level being downsampled by 2 in the
+    slice plane, until the level fits in a single chunk.
+    '''
+    shapes = [(sliceCount, height, width)]
+    while shapes[-1][1] > CHUNK_SHAPE[1] or shapes[-1][2] > CHUNK_SHAPE[2]:
+        (_, levelHeight, levelWidth) = shapes[-1]
+        shapes.append((sliceCount, -(-levelHeight // 2), -(-levelWidth // 2)))
+    return shapes
+
+
+def reduceSlab(slab, pick):
+    # slices of the slab are downsampled by 2 (pixels of label maps are picked, instead of averaged)
+    if pick:
+        return slab[:, ::2, ::2]
+    reduced = np.stack([reduceBlocks(np.asarray(rows), 2) for rows in slab])
+    if slab.dtype.kind in 'ui':
+        reduced = np.round(reduced)
+    return reduced.astype(slab.dtype)
+
+
+class SlabWriter(object):
+    '''
+    Write the chunks of a slab (chunk deep range of slices) of every level of a volume, from successive bands of rows
+    of the full resolution slices: rows are buffered in each level until a row of chunks is complete, which is then
+    written and downsampled for the next level, so memory usage is proportional to the slices width only.
+    Chunks whose values are all 0 (fill value) are not written.
+    '''
+
+    def __init__(self, path, slab, levelShapes, samples, pick):
+        self.path = path
+        self.slab = slab
+        self.levelShapes = levelShapes
+        self.samples = samples
+        self.pick = pick
+        self.buffers = [None] * len(levelShapes)
+        self.chunkRows = [0] * len(levelShapes)
+        self.stats = {'chunks': 0, 'empty_chunks': 0, 'bytes_written': 0}
+        for level in range(len(levelShapes)):
+            # chunks previously written for this slab might not be overwritten (empty chunks)
+            shutil.rmtree(os.path.join(path, str(level), str(slab)), ignore_errors=True)
+
+    def feed(self, level, rows):
+        buffer = self.buffers[level]
+        buffer = rows if buffer is None else np.concatenate((buffer, rows), axis=1)
+        while buffer is not None and buffer.shape[1] >= CHUNK_SHAPE[1]:
+            self.writeChunkRow(level, buffer[:, :CHUNK_SHAPE[1]])
+            buffer = buffer[:, CHUNK_SHAPE[1]:] if buffer.shape[1] > CHUNK_SHAPE[1] else None
+        self.buffers[level] = buffer
+
+    def finish(self):
+        for level in range(len(self.levelShapes)):
+            if self.buffers[level] is not None:
+                self.writeChunkRow(level, self.buffers[level])
+                self.buffers[level] = None
+        return self.stats
+
+    def writeChunkRow(self, level, rows):
+        if level + 1 < len(self.levelShapes):
+            self.feed(level + 1, reduceSlab(rows, self.pick))
+
+        # partial chunks (at the edges of the volume) are padded with the fill value
+        (depth, height, width) = rows.shape[:3]
+        padding = [(0, CHUNK_SHAPE[0] - depth), (0, CHUNK_SHAPE[1] - height), (0, -(-width // CHUNK_SHAPE[2]) * CHUNK_SHAPE[2] - width)]
+        if rows.ndim > 3:
+            padding.append((0, 0))
+        rows = np.pad(rows, padding)
+        chunkRowPath = os.path.join(self.path, str(level), str(self.slab), str(self.chunkRows[level]))
+        self.chunkRows[level] += 1
+        for column in range(rows.shape[2] // CHUNK_SHAPE[2]):
+            chunk = rows[:, :, column * CHUNK_SHAPE[2]:(column + 1) * CHUNK_SHAPE[2]]
+            if not chunk.any():
+                self.stats['empty_chunks'] += 1
+                continue
+            data = zlib.compress(np.ascontiguousarray(chunk).tobytes(), COMPRESSION_LEVEL)
+            chunkPath = os.path.join(chunkRowPath, str(column))
+            if self.samples > 1:
+                # samples of the pixels are a single chunk deep dimension
+                os.makedirs(chunkPath, exist_ok=True)
+                chunkPath = os.path.join(chunkPath, '0')
+            else:
+                os.makedirs(chunkRowPath, exist_ok=True)
+            with open(chunkPath, 'wb') as chunkFile:
+                chunkFile.write(data)
+            self.stats['chunks'] += 1
+            self.stats['bytes_written'] += len(data)
+
+
+def writeVolumeSlab(path, slab, sources, levelShapes, dtype, samples, pick):
+    '''
+    Write the chunks of every level for a slab of a volume, from its source slices (list of (TIFF path, crop box)),
+    which are read together by bands of rows. Slices smaller than the volume are padded with 0.
+    '''
+    (_, height, width) = levelShapes[0]
+    writer = SlabWriter(path, slab, levelShapes, samples, pick)
+    readers = [iterTiffRowBands(source, CHUNK_SHAPE[1], crop) for (source, crop) in sources]
+    pending = [None] * len(sources)
+    for y in range(0, height, CHUNK_SHAPE[1]):
+        bandHeight = min(CHUNK_SHAPE[1], height - y)
+        rows = np.zeros((len(sources), bandHeight, width) + ((samples,) if samples > 1 else ()), dtype)
+        for (index, reader) in enumerate(readers):
+            band = pending[index]
+            while band is None or band.shape[0] < bandHeight:
+                nextBand = next(reader, None)
+                if nextBand is None:
+                    break
+                if nextBand.ndim == 3 and samples == 1:
+                    nextBand = nextBand[..., 0]
+                band = nextBand if band is None else np.concatenate((band, nextBand))
+            if band is None:
+                continue
+            rows[index, :min(bandHeight, band.shape[0]), :band.shape[1]] = band[:bandHeight]
+            pending[index] = band[bandHeight:] if band.shape[0] > bandHeight else None
+        writer.feed(0, rows)
+    for reader in readers:
+        reader.close()
+    return writer.finish()
+
+
+class LayerVolume(object):
+    '''
+    Multi-resolution volume of the slices of a layer along an axis, saved as a chunked and compressed zarr (v2) array
+    per level in the volumes folder (with multiscales metadata in the style of OME-NGFF), so tools can read only the
+    chunks they need, e.g. to reslice the volume along any plane.
+    Volume is exported by slabs of slices (as deep as the chunks), independently from each other; the sources of each
+    slab are recorded in the volume metadata, so only the slabs whose slices have changed are exported again.
+    '''
+
+    def __init__(self, output_path, name, safename, axis, sliceCount, width, height, layout, spacing, sliceStep, phys_unit,
+                 window=None):
+        self.path = os.path.join(output_path, VOLUMES_FOLDERNAME, safename)
+        self.groupPath = os.path.join(output_path, VOLUMES_FOLDERNAME)
+        (dtype, samples, colormap) = layout
+        self.layout = {
+            'dtype': dtype,
+            'samples': samples,
+            'chunks': list(CHUNK_SHAPE),
+            'levels': [list(shape) for shape in getLevelShapes(sliceCount, height, width)]
+        }
+        self.attributes = {
+            'multiscales': [{
+                'name': name,
+                'axes': [{'name': 'z', 'type': 'space'},
+                         {'name': 'y', 'type': 'space', 'unit': 'micrometer'},
+                         {'name': 'x', 'type': 'space', 'unit': 'micrometer'}]
+                        + ([{'name': 'c', 'type': 'channel'}] if samples > 1 else []),
+                'datasets': [{
+                    'path': str(level),
+                    'coordinateTransformations': [{
+                        'type': 'scale',
+                        # spacing along slices is expressed as a number of slices
+                        'scale': [sliceStep, spacing[1] * phys_unit * 2 ** level, spacing[0] * phys_unit * 2 ** level]
+                                 + ([1] if samples > 1 else [])
+                    }]
+                } for level in range(len(self.layout['levels']))]
+            }],
+            'zaviewer': {
+                'layer': name,
+                'axis': axis,
+                # pixel values are stored as is, window being the one used to map them to 8-bit tiles
+                'window': list(window) if window else None,
+                'colormap': colormap,
+                'layout': self.layout,
+                'slabs': [None] * -(-sliceCount // CHUNK_SHAPE[0])
+            }
+        }
+        self.modified = False
+
+        previous = self.load()
+        if previous and previous.get('zaviewer', {}).get('layout') == self.layout:
+            self.attributes['zaviewer']['slabs'] = previous['zaviewer']['slabs']
+            # metadata (e.g. spacing) might have changed, while exported slabs are still valid
+            self.modified = previous != self.attributes
+        else:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.modified = True
+
+    def load(self):
+        filepath = os.path.join(self.path, '.zattrs')
+        if not os.path.isfile(filepath):
+            return None
+        try:
+            with open(filepath, 'r') as attributesFile:
+                return json.load(attributesFile)
+        except ValueError:
+            logging.warning(f"Ignoring invalid volume attributes : {filepath}")
+            return None
+
+    def getSlabTasks(self, sources):
+        '''
+        Return the slabs which must be exported (as dict of slab index, sources, and digest of the sources), given the
+        sources (TIFF path, crop box) of every slice.
+        '''
+        slabs = []
+        for slab in range(len(self.attributes['zaviewer']['slabs'])):
+            slabSources = sources[slab * CHUNK_SHAPE[0]:(slab + 1) * CHUNK_SHAPE[0]]
+            digest = getSourcesDigest([[getFileInfo(source), list(crop) if crop else None] for (source, crop) in slabSources])
+            if digest != self.attributes['zaviewer']['slabs'][slab]:
+                slabs.append({'slab': slab, 'sources': slabSources, 'digest': digest})
+        return slabs
+
+    def setSlab(self, slab, digest):
+        self.attributes['zaviewer']['slabs'][slab] = digest
+        self.modified = True
+
+    def save(self):
+        if not self.modified:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        writeJSON(os.path.join(self.groupPath, '.zgroup'), {'zarr_format': 2})
+        writeJSON(os.path.join(self.path, '.zgroup'), {'zarr_format': 2})
+        for (level, shape) in enumerate(self.layout['levels']):
+            samples = [self.layout['samples']] if self.layout['samples'] > 1 else []
+            os.makedirs(os.path.join(self.path, str(level)), exist_ok=True)
+            writeJSON(os.path.join(self.path, str(level), '.zarray'), {
+                'zarr_format': 2,
+                'shape': shape + samples,
+                'chunks': self.layout['chunks'] + samples,
+                'dtype': self.layout['dtype'],
+                'compressor': {'id': 'zlib', 'level': COMPRESSION_LEVEL},
+                'fill_value': 0,
+                'order': 'C',
+                'filters': None,
+                'dimension_separator': '/'
+            })
+        # attributes are written last, since they record the exported slabs
+        writeJSON(os.path.join(self.path, '.zattrs'), self.attributes)
+        self.modified = False
+
+
+def writeJSON(filepath, content):
+    tempFilepath = filepath + '.tmp'
+    with open(tempFilepath, 'w') as jsonFile:
+        json.dump(content, jsonFile, indent=2)
+    os.replace(tempFilepath, filepath)